@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.core.cache import cache
+
+GUEST_USER_CACHE_TTL = getattr(settings, "GUEST_USER_CACHE_TTL", 300)
+
+# Per-process caches: a save or delete in one worker can't drop another worker's entry
+LOCAL_CACHE_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+def _cache_key(user_id):
+    return f"auth:guest-user:{user_id}"
+
+
+def is_guest(user):
+    # temp_login users: no usable password, no admin rights
+    return (
+        (user.password or "").startswith(UNUSABLE_PASSWORD_PREFIX)
+        and not user.is_staff
+        and not user.is_superuser
+    )
+
+
+def cache_is_shared():
+    return settings.CACHES["default"]["BACKEND"] not in LOCAL_CACHE_BACKENDS
+
+
+def forget_user(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    # ModelBackend whose per-request user lookup is served from the cache for guest users.
+    # Users with a real password always come from the database, and so does everyone when the
+    # cache isn't shared between workers.
+
+    def get_user(self, user_id):
+        if not cache_is_shared():
+            return super().get_user(user_id)
+
+        key = _cache_key(user_id)
+        user = cache.get(key)
+        if user is not None:
+            return user
+
+        user = super().get_user(user_id)
+        if user is not None and is_guest(user):
+            cache.set(key, user, timeout=GUEST_USER_CACHE_TTL)
+        return user
+
+
+def remember_users(users) -> int:
+    # Warms the cache with guests about to show up (e.g. members of running rooms)
+    if not cache_is_shared():
+        return 0
+    guests = {_cache_key(user.pk): user for user in users if is_guest(user)}
+    cache.set_many(guests, timeout=GUEST_USER_CACHE_TTL)
+    return len(guests)
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+
+    User = get_user_model()
+    post_save.connect(invalidate_cached_user, sender=User, dispatch_uid="core.backends.invalidate_cached_user")
+    post_delete.connect(invalidate_cached_user, sender=User, dispatch_uid="core.backends.forget_deleted_user")
+
+
+def guest_users():
+    User = get_user_model()
+    return User.objects.filter(
+        password__startswith=UNUSABLE_PASSWORD_PREFIX,
+        is_staff=False,
+        is_superuser=False,
+    )
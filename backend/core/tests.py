@@ -1,3 +1,73 @@
-from django.test import TestCase
+import json
+import tempfile
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+
+from core.backends import CachedModelBackend, remember_users
+
+
+class CachedModelBackendTests(TestCase):
+	def setUp(self):
+		self.cache_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.cache_dir.cleanup)
+		shared = override_settings(CACHES={
+			"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": self.cache_dir.name},
+		})
+		shared.enable()
+		self.addCleanup(shared.disable)
+
+		self.backend = CachedModelBackend()
+		self.guest = User(username="guest", first_name="Guest")
+		self.guest.set_unusable_password()
+		self.guest.save()
+
+	def test_guest_is_served_from_the_cache(self):
+		self.assertEqual(self.backend.get_user(self.guest.pk), self.guest)
+		with self.assertNumQueries(0):
+			self.assertEqual(self.backend.get_user(self.guest.pk).first_name, "Guest")
+
+	def test_users_with_a_password_are_not_cached(self):
+		user = User.objects.create_user(username="member", password="secret")
+		self.backend.get_user(user.pk)
+		with self.assertNumQueries(1):
+			self.backend.get_user(user.pk)
+
+	def test_save_drops_the_cached_user(self):
+		self.backend.get_user(self.guest.pk)
+		self.guest.first_name = "Renamed"
+		self.guest.save()
+		self.assertEqual(self.backend.get_user(self.guest.pk).first_name, "Renamed")
+
+	def test_delete_drops_the_cached_user(self):
+		self.assertEqual(remember_users([self.guest]), 1)
+		pk = self.guest.pk
+		self.guest.delete()
+		self.assertIsNone(self.backend.get_user(pk))
+
+	def test_process_local_cache_is_not_used(self):
+		with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+			self.assertEqual(remember_users([self.guest]), 0)
+			self.backend.get_user(self.guest.pk)
+			# Another worker deleting the guest couldn't reach this cache, so every lookup hits the DB
+			with self.assertNumQueries(1):
+				self.backend.get_user(self.guest.pk)
+			cache.clear()
+
+
+class SessionBackendTests(TestCase):
+	def test_guest_login_survives_each_session_backend(self):
+		for name, engine in settings.SESSION_ENGINES.items():
+			with self.subTest(name), override_settings(SESSION_ENGINE=engine):
+				client = Client(HTTP_HOST="localhost")
+				response = client.post(
+					"/api/temp-login/",
+					json.dumps({"display_name": f"Guest {name}", "role": "facilitator"}),
+					content_type="application/json",
+				)
+				self.assertEqual(response.status_code, 200, response.content)
+
+				response = client.post("/api/rooms/", json.dumps({"action": "create", "name": name}), content_type="application/json")
+				self.assertEqual(response.status_code, 201, response.content)
@@ -2,6 +2,7 @@ import json
 
 from django.contrib.auth import login
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.http import JsonResponse
 from django.shortcuts import render
 from django.utils.crypto import get_random_string
@@ -9,9 +10,13 @@ from django.utils.text import slugify
 from django.views.decorators.csrf import csrf_exempt
 
 
+USER_COUNT_CACHE_SECONDS = 60
+
+
 def home(request):
 	context = {
-		"user_count": User.objects.count(),
+		# COUNT(*) over auth_user on every hit adds up; a minute-old figure is fine here
+		"user_count": cache.get_or_set("core:user_count", User.objects.count, USER_COUNT_CACHE_SECONDS),
 	}
 	return render(request, "core/home.html", context)
 
@@ -25,6 +30,8 @@ def temp_login(request):
 		payload = json.loads(request.body or "{}")
 	except json.JSONDecodeError:
 		return JsonResponse({"detail": "Invalid JSON"}, status=400)
+	if not isinstance(payload, dict):
+		return JsonResponse({"detail": "Expected a JSON object"}, status=400)
 
 	display_name = (payload.get("display_name") or "").strip()
 	role = (payload.get("role") or "").strip()
@@ -40,7 +47,7 @@ def temp_login(request):
 	user.set_unusable_password()
 	user.save()
 
-	login(request, user)
+	login(request, user, backend="core.backends.CachedModelBackend")
 
 	return JsonResponse(
 		{
@@ -1,7 +1,14 @@
+import time
+from collections import namedtuple
 from datetime import timedelta
-from django.utils import timezone
-from django.db.models import Count
-from .models import Post, Agent, Intervention, RoomMember, EvidenceNudgeState
+from django.db import IntegrityError, router
+from django.db.models import Count, F, Q
+from . import clock
+from .fragments import intervention_fragment
+from .models import Agent, Intervention, RoomMember, EvidenceNudgeState
+from .participation import phase_post_counts
+from .presence import PRESENCE_TTL
+from .write_buffer import WriteBufferTimeout, insert
 import re
 
 INDIVIDUAL_INACTIVITY_THRESHOLD = timedelta(minutes=2)
@@ -23,14 +30,70 @@ CITATION_PATTERNS = [
     r"\bdoi:\s*\S+",     
 ]
 
+# Tunable limits of the rules above and below; the module constants are the defaults.
+# Callers that need other values (the replay) pass their own instead of patching the module.
+RuleLimits = namedtuple("RuleLimits", [
+    "individual_inactivity_threshold",
+    "individual_inactivity_cooldown",
+    "join_grace_period",
+    "equity_cooldown",
+    "evidence_nudge_every_n_flagged",
+    "evidence_nudge_min_interval",
+])
+
+
+def rule_limits(**overrides) -> RuleLimits:
+    # Raises ValueError for a name that isn't a field
+    return RuleLimits(
+        INDIVIDUAL_INACTIVITY_THRESHOLD,
+        INDIVIDUAL_INACTIVITY_COOLDOWN,
+        JOIN_GRACE_PERIOD,
+        EQUITY_COOLDOWN,
+        EVIDENCE_NUDGE_EVERY_N_FLAGGED,
+        EVIDENCE_NUDGE_MIN_INTERVAL,
+    )._replace(**overrides)
+
+
+# Agent rows are read on every rule check; keep them per process for a while so an admin
+# switching an agent off still takes effect everywhere within the TTL
+AGENT_CACHE_TTL = 60
+_agents = {}   # name -> (agent, loaded at)
+
+
 def _agent(name: str, description: str) -> Agent:
-    a, _ = Agent.objects.get_or_create(
-        name=name,
-        defaults={"description": description, "is_active": True},
-    )
+    cached = _agents.get(name)
+    if cached is not None and time.monotonic() - cached[1] < AGENT_CACHE_TTL:
+        return cached[0]
+    # Names aren't unique: two workers creating the same agent at once leave two rows, and
+    # get_or_create would fail from then on. Everyone settles on the oldest one.
+    agents = Agent.objects.filter(name=name).order_by("id")
+    a = agents.first()
+    if a is None:
+        Agent.objects.create(name=name, description=description, is_active=True)
+        a = agents.first()
+    _agents[name] = (a, time.monotonic())
     return a
 
 
+def prime_agents() -> int:
+    loaded = time.monotonic()
+    agents = list(Agent.objects.all())
+    for a in agents:
+        _agents[a.name] = (a, loaded)
+    return len(agents)
+
+
+def forget_agents(**kwargs):
+    _agents.clear()
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+
+    post_save.connect(forget_agents, sender=Agent, dispatch_uid="message_board.agent_rules.forget_agents")
+    post_delete.connect(forget_agents, sender=Agent, dispatch_uid="message_board.agent_rules.forget_deleted_agents")
+
+
 def _recent(room, agent: Agent, rule_name: str, since, phase_index):
     qs = Intervention.objects.filter(
         room=room,
@@ -46,10 +109,39 @@ def _recent(room, agent: Agent, rule_name: str, since, phase_index):
     return qs.exists()
 
 
-def _create(room, agent: Agent, rule_name: str, message: str, explanation: str, phase_index):
+def _dedup_key(room, rule_name, phase_index, bucket) -> str:
+    phase = "-" if phase_index is None else phase_index
+    return f"{room.id}:{room.activity_run_id or '-'}:{phase}:{rule_name}:{bucket}"
+
+
+def _cooldown_bucket(now, cooldown) -> int:
+    return int(now.timestamp() // cooldown.total_seconds())
+
+
+def _insert_once(intervention):
+    # _recent() is only a fast path: two workers can both pass it. The unique dedup_key
+    # lets exactly one insert through; the other gets None. Any other integrity error (a
+    # missing agent or room, ...) is a real failure and propagates.
+    try:
+        insert(intervention)
+    except WriteBufferTimeout:
+        # Withdrawn unwritten; the next check of the rule tries again
+        return None
+    except IntegrityError:
+        using = router.db_for_write(Intervention, instance=intervention)
+        taken = Intervention.objects.using(using).filter(dedup_key=intervention.dedup_key)
+        if intervention.dedup_key is None or not taken.exists():
+            raise
+        return None
+    intervention_fragment(intervention)
+    return intervention
+
+
+def _create(room, agent: Agent, rule_name: str, message: str, explanation: str, phase_index, now, bucket):
     if not agent.is_active:
-        return
-    Intervention.objects.create(
+        return None
+    return _insert_once(Intervention(
+        created_at=now,
         agent=agent,
         room=room,
         rule_name=rule_name,
@@ -57,97 +149,97 @@ def _create(room, agent: Agent, rule_name: str, message: str, explanation: str,
         explanation=explanation or "",
         phase_index=phase_index,
         activity_run_id=room.activity_run_id, 
-    )
+        dedup_key=_dedup_key(room, rule_name, phase_index, bucket),
+    ))
 
 #Rules
 
-def check_individual_inactivity_rule(room, phase_index=None):
-    now = timezone.now()
-
-    members_qs = room.members.all()
-    if not members_qs.exists():
-        return False
+def check_individual_inactivity_rule(room, phase_index=None, limits=None):
+    limits = limits or rule_limits()
+    now = clock.now()
+    threshold_time = now - limits.individual_inactivity_threshold
 
-    threshold_time = now - INDIVIDUAL_INACTIVITY_THRESHOLD
-    active_user_ids = set(
-        Post.objects.filter(
+    # Members still present and past the join grace period who haven't posted in this run/phase recently.
+    # Members with no heartbeat on record yet are treated as present, as before presence tracking.
+    inactive_members = list(
+        RoomMember.objects.filter(
+            Q(last_seen_at__gte=now - PRESENCE_TTL) | Q(last_seen_at__isnull=True),
             room=room,
+            joined_at__lte=now - limits.join_grace_period,
+        ).exclude(
+            activity_run_id=room.activity_run_id,
             phase_index=phase_index,
-            created_at__gte=threshold_time,
-        ).values_list("author_id", flat=True).distinct()
+            last_posted_at__gte=threshold_time,
+        ).select_related("user")
     )
+    if not inactive_members:
+        return False
+
+    agent = _agent("Facilitator Agent", "Encourages quieter members to participate.")
 
-    agent, _ = Agent.objects.get_or_create(
-        name="Facilitator Agent",
-        defaults={"description": "Encourages quieter members to participate.", "is_active": True},
+    cooldown_since = now - limits.individual_inactivity_cooldown
+    recent = Intervention.objects.filter(
+        agent=agent,
+        room=room,
+        rule_name__startswith="individual_inactivity:",
+        created_at__gte=cooldown_since,
     )
+    if phase_index is None:
+        recent = recent.filter(phase_index__isnull=True)
+    else:
+        recent = recent.filter(phase_index=phase_index)
+    recently_nudged = set(recent.values_list("rule_name", flat=True))
 
-    cooldown_since = now - INDIVIDUAL_INACTIVITY_COOLDOWN
     triggered = False
 
-    for user in members_qs:
-        # If they posted recently, they are not inactive
-        if user.id in active_user_ids:
-            continue
-
-        # Ensure joined_at exists (prevents “grace logic” from skipping forever)
-        membership, _ = RoomMember.objects.get_or_create(room=room, user=user)
-
-        # Grace period after joining
-        if now - membership.joined_at < JOIN_GRACE_PERIOD:
-            continue
-
+    for membership in inactive_members:
+        user = membership.user
         rule_name = f"individual_inactivity:user={user.id}"
-
-        recent = Intervention.objects.filter(
-            agent=agent,
-            room=room,
-            rule_name=rule_name,
-            created_at__gte=cooldown_since,
-        )
-        if phase_index is None:
-            recent = recent.filter(phase_index__isnull=True)
-        else:
-            recent = recent.filter(phase_index=phase_index)
-
-        if recent.exists():
+        if rule_name in recently_nudged:
             continue
 
-        Intervention.objects.create(
+        created = _insert_once(Intervention(
+            created_at=now,
             agent=agent,
             room=room,
             rule_name=rule_name,
             message=f"Hi {user.first_name or user.username} — we’d love your thoughts when you’re ready.",
-            explanation=f"{user.username} hasn’t posted in the last {INDIVIDUAL_INACTIVITY_THRESHOLD.seconds // 60} minutes (this phase).",
+            explanation=f"{user.username} hasn’t posted in the last {limits.individual_inactivity_threshold.seconds // 60} minutes (this phase).",
             phase_index=phase_index,
             activity_run_id=room.activity_run_id,
-        )
-        triggered = True
+            dedup_key=_dedup_key(room, rule_name, phase_index, _cooldown_bucket(now, limits.individual_inactivity_cooldown)),
+        ))
+        if created:
+            triggered = True
 
     return triggered
 
 
-def check_equity_rule(room, phase_index=None) -> bool:
+def check_equity_rule(room, phase_index=None, limits=None) -> bool:
 #    Rule : Encourage balanced participation by nudging underrepresented members to contribute.
-    posts = Post.objects.filter(room=room, phase_index=phase_index)
-    if posts.count() < 3:
+    limits = limits or rule_limits()
+    counts = phase_post_counts(room, phase_index)
+    total_messages = sum(counts.values())
+    if total_messages < 3:
         return False
 
-    total_users = room.members.count()
+    members = list(room.members.all())
+    total_users = len(members)
     if total_users < 2:
         return False
 
-    total_messages = posts.count()
     expected_average = total_messages / total_users
     threshold = expected_average * 0.5
 
     agent = _agent("Equity Agent", "Encourages balanced participation and underrepresented voices.")
 
-    cooldown_since = timezone.now() - EQUITY_COOLDOWN
+    now = clock.now()
+    cooldown_since = now - limits.equity_cooldown
+    bucket = _cooldown_bucket(now, limits.equity_cooldown)
     triggered = False
 
-    for member in room.members.all():
-        member_count = posts.filter(author=member).count()
+    for member in members:
+        member_count = counts.get(member.id, 0)
         if member_count >= threshold:
             continue
 
@@ -161,8 +253,8 @@ def check_equity_rule(room, phase_index=None) -> bool:
         )
         message = f"{member.first_name or member.username}, your perspective would be really valuable here — want to jump in?"
 
-        _create(room, agent, rule_name, message, explanation, phase_index)
-        triggered = True
+        if _create(room, agent, rule_name, message, explanation, phase_index, now, bucket):
+            triggered = True
 
     return triggered
 
@@ -192,11 +284,17 @@ EVIDENCE_NUDGE_EVERY_N_FLAGGED = 3
 EVIDENCE_NUDGE_MIN_INTERVAL = timedelta(seconds=90)
 
 
-def check_evidence_rule(room, post) -> bool:
+def check_evidence_rule(room, post, limits=None) -> bool:
 # Rule: Nudge users to provide evidence when their messages lack it.
-    if not message_lacks_evidence(post.content):
+    # lacks_evidence is computed when the post is created, no need to re-run the heuristic
+    if not post.lacks_evidence:
         return False
 
+    return _record_evidence_flags(room, post.author, post.phase_index, flagged=1, limits=limits)
+
+
+def _record_evidence_flags(room, user, phase_index, flagged, limits=None) -> bool:
+    limits = limits or rule_limits()
     agent = _agent(
         "Socratic Agent",
         "Encourages evidence-based reasoning and clearer support for claims."
@@ -204,26 +302,26 @@ def check_evidence_rule(room, post) -> bool:
 
     state, _ = EvidenceNudgeState.objects.get_or_create(
         room=room,
-        user=post.author,
-        phase_index=post.phase_index,
+        user=user,
+        phase_index=phase_index,
         defaults={"flagged_count": 0, "last_nudged_at": None},
     )
 
-    state.flagged_count += 1
+    # Incremented in the database so no flag is lost; workers that see the same crossing share its dedup key
+    EvidenceNudgeState.objects.filter(pk=state.pk).update(flagged_count=F("flagged_count") + flagged)
+    state.refresh_from_db(fields=["flagged_count", "last_nudged_at"])
+    previous_count = state.flagged_count - flagged
 
-    now = timezone.now()
-    due_by_count = (state.flagged_count % EVIDENCE_NUDGE_EVERY_N_FLAGGED == 0)
-    due_by_time = (state.last_nudged_at is None) or (now - state.last_nudged_at >= EVIDENCE_NUDGE_MIN_INTERVAL)
+    now = clock.now()
+    # Crossed a multiple of N (for a single flag: landed on one)
+    every_n = limits.evidence_nudge_every_n_flagged
+    due_by_count = (state.flagged_count // every_n > previous_count // every_n)
+    due_by_time = (state.last_nudged_at is None) or (now - state.last_nudged_at >= limits.evidence_nudge_min_interval)
 
     if not (due_by_count or due_by_time):
-        state.save(update_fields=["flagged_count"])
         return False
 
-    # record the nudge time
-    state.last_nudged_at = now
-    state.save(update_fields=["flagged_count", "last_nudged_at"])
-
-    rule_name = f"missing_evidence:user={post.author.id}"
+    rule_name = f"missing_evidence:user={user.id}"
 
     explanation = (
         "This message appears to make a claim without supporting evidence "
@@ -238,30 +336,63 @@ def check_evidence_rule(room, post) -> bool:
         "• a clear ‘because…’ explanation"
     )
 
-    _create(
+    # One nudge per multiple of N crossed, and otherwise at most one per user and phase in each interval
+    if due_by_count:
+        bucket = f"flagged-{state.flagged_count // every_n}"
+    else:
+        bucket = _cooldown_bucket(now, limits.evidence_nudge_min_interval)
+    created = _create(
         room=room,
         agent=agent,
         rule_name=rule_name,
         message=message,
         explanation=explanation,
-        phase_index=post.phase_index,
+        phase_index=phase_index,
+        now=now,
+        bucket=bucket,
     )
+    if created is None:
+        return False
 
+    # Only a nudge that was actually written restarts the interval
+    EvidenceNudgeState.objects.filter(pk=state.pk).update(last_nudged_at=now)
     return True
 
-def check_all_rules(room, new_post=None):
+def check_all_rules(room, new_post=None, limits=None):
 # Check all rules and return a list of triggered rule names
     triggered = []
 
     phase_index = getattr(new_post, "phase_index", None)
 
     # Equity (optional to run on post)
-    if check_equity_rule(room, phase_index=phase_index):
+    if check_equity_rule(room, phase_index=phase_index, limits=limits):
         triggered.append("unequal_participation")
 
     # Evidence rule (post-specific)
-    if new_post and check_evidence_rule(room, new_post):
+    if new_post and check_evidence_rule(room, new_post, limits=limits):
         triggered.append("missing_evidence")
 
     return triggered
 
+
+def check_all_rules_for_batch(room, posts, limits=None):
+# Same rules as check_all_rules, evaluated once for a whole batch of new posts
+    triggered = []
+
+    for phase_index in sorted({p.phase_index for p in posts}, key=lambda i: -1 if i is None else i):
+        if check_equity_rule(room, phase_index=phase_index, limits=limits):
+            triggered.append("unequal_participation")
+
+    # One EvidenceNudgeState update (and at most one nudge) per author and phase
+    flagged = {}
+    for p in posts:
+        if p.lacks_evidence:
+            key = (p.author_id, p.phase_index)
+            flagged.setdefault(key, [p.author, 0])[1] += 1
+
+    for (_, phase_index), (author, count) in flagged.items():
+        if _record_evidence_flags(room, author, phase_index, flagged=count, limits=limits):
+            triggered.append("missing_evidence")
+
+    return triggered
+
@@ -0,0 +1,164 @@
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q
+
+from .models import Intervention, Post, RoomMember, RunSnapshot
+from .sharding import room_db
+
+SNAPSHOT_COLUMNS = ("user_ids", "phase_indices", "post_counts", "flagged_counts", "nudge_counts")
+
+_RULE_USER = re.compile(r":user=(\d+)$")
+
+
+def build_run_snapshot(room, activity_run_id, total_phases=None, activity=None, started_at=None):
+    post_rows = (
+        Post.objects.filter(room=room, activity_run_id=activity_run_id)
+        .order_by()
+        .values("author_id", "phase_index")
+        .annotate(posts=Count("id"), flagged=Count("id", filter=Q(lacks_evidence=True)))
+    )
+    nudge_rows = (
+        Intervention.objects.filter(room=room, activity_run_id=activity_run_id)
+        .order_by()
+        .values("rule_name", "phase_index")
+        .annotate(nudges=Count("id"))
+    )
+
+    cells = {}
+
+    def cell(user_id, phase_index):
+        return cells.setdefault((user_id, phase_index), [0, 0, 0])
+
+    for row in post_rows:
+        c = cell(row["author_id"], row["phase_index"])
+        c[0] += row["posts"]
+        c[1] += row["flagged"]
+
+    for row in nudge_rows:
+        m = _RULE_USER.search(row["rule_name"])
+        if m:
+            cell(int(m.group(1)), row["phase_index"])[2] += row["nudges"]
+
+    # Silent members still get a zero row per phase, otherwise balance metrics would skip them
+    phases = {phase for _, phase in cells}
+    if total_phases:
+        phases.update(range(total_phases))
+    for user_id in RoomMember.objects.filter(room=room).values_list("user_id", flat=True):
+        for phase in phases:
+            cell(user_id, phase)
+
+    columns = {name: [] for name in SNAPSHOT_COLUMNS}
+    for (user_id, phase_index), (posts, flagged, nudges) in sorted(
+        cells.items(), key=lambda item: (item[0][0], -1 if item[0][1] is None else item[0][1])
+    ):
+        columns["user_ids"].append(user_id)
+        columns["phase_indices"].append(phase_index)
+        columns["post_counts"].append(posts)
+        columns["flagged_counts"].append(flagged)
+        columns["nudge_counts"].append(nudges)
+
+    try:
+        with transaction.atomic(using=room_db(room)):
+            return RunSnapshot.objects.create(
+                room=room,
+                activity=activity,
+                activity_run_id=activity_run_id,
+                started_at=started_at,
+                **columns,
+            )
+    except IntegrityError:
+        # Another worker snapshotted the run first
+        return RunSnapshot.objects.get(activity_run_id=activity_run_id)
+
+
+class SnapshotFrame:
+    # Columns from many snapshots laid end to end; every query below is a single pass over them
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def load(cls, snapshots):
+        columns = {name: [] for name in ("run_ids", "room_codes") + SNAPSHOT_COLUMNS}
+        for snap in snapshots:
+            n = len(snap.user_ids)
+            columns["run_ids"].extend([str(snap.activity_run_id)] * n)
+            columns["room_codes"].extend([snap.room.code] * n)
+            for name in SNAPSHOT_COLUMNS:
+                columns[name].extend(getattr(snap, name))
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns["user_ids"])
+
+    def group_sum(self, key, *values) -> dict:
+        totals = {}
+        keys = self.columns[key]
+        cols = [self.columns[v] for v in values]
+        for i, k in enumerate(keys):
+            t = totals.setdefault(k, [0] * len(cols))
+            for j, col in enumerate(cols):
+                t[j] += col[i]
+        return totals
+
+    def participation_balance(self) -> list:
+        # Per run: share of posts written by the most active member, and the Gini coefficient of post counts
+        per_user = {}
+        for run_id, room_code, user_id, posts in zip(
+            self.columns["run_ids"], self.columns["room_codes"],
+            self.columns["user_ids"], self.columns["post_counts"],
+        ):
+            run = per_user.setdefault(run_id, {"room": room_code, "users": {}})
+            run["users"][user_id] = run["users"].get(user_id, 0) + posts
+
+        result = []
+        for run_id, run in per_user.items():
+            counts = sorted(run["users"].values())
+            total = sum(counts)
+            n = len(counts)
+            if total and n:
+                gini = sum((2 * (i + 1) - n - 1) * c for i, c in enumerate(counts)) / (n * total)
+                top_share = counts[-1] / total
+            else:
+                gini = top_share = 0.0
+            result.append({
+                "activity_run_id": run_id,
+                "room": run["room"],
+                "members": n,
+                "posts": total,
+                "top_member_share": round(top_share, 3),
+                "gini": round(gini, 3),
+            })
+        return result
+
+    def evidence_flag_rate_by_phase(self) -> dict:
+        totals = self.group_sum("phase_indices", "post_counts", "flagged_counts")
+        return {
+            str(phase): {
+                "posts": posts,
+                "flagged": flagged,
+                "rate": round(flagged / posts, 3) if posts else 0.0,
+            }
+            for phase, (posts, flagged) in totals.items()
+        }
+
+    def nudge_effectiveness(self) -> dict:
+        # Mean posts per member-phase for members who were nudged in that phase versus those who weren't
+        sums = {True: [0, 0], False: [0, 0]}
+        for posts, nudges in zip(self.columns["post_counts"], self.columns["nudge_counts"]):
+            s = sums[nudges > 0]
+            s[0] += posts
+            s[1] += 1
+
+        def summary(posts, member_phases):
+            return {
+                "member_phases": member_phases,
+                "mean_posts": round(posts / member_phases, 3) if member_phases else None,
+            }
+
+        return {
+            "nudged": summary(*sums[True]),
+            "not_nudged": summary(*sums[False]),
+            "total_nudges": sum(self.columns["nudge_counts"]),
+        }
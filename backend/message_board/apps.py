@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class MessageBoardConfig(AppConfig):
+    name = 'message_board'
+
+    def ready(self):
+        from . import agent_rules, search, sharding
+
+        agent_rules.connect_signals()
+        search.connect_signals()
+        sharding.connect_signals()
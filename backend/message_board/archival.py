@@ -0,0 +1,111 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import build_run_snapshot
+from .models import ArchivedIntervention, ArchivedPost, Intervention, Post, Room, RunSnapshot
+from .phases import get_activity_state
+from .sharding import room_db
+
+ARCHIVE_RETENTION = timedelta(days=30)
+ARCHIVE_BATCH_SIZE = 500
+
+POST_FIELDS = ("id", "room_id", "author_id", "content", "created_at", "phase_index", "lacks_evidence", "activity_run_id")
+INTERVENTION_FIELDS = (
+    "id", "agent_id", "room_id", "rule_name", "message", "explanation",
+    "created_at", "phase_index", "activity_run_id",
+)
+
+
+def archivable_runs(retention=ARCHIVE_RETENTION, now=None) -> list:
+    # (room_id, run_id) pairs whose last post/intervention is older than the retention window,
+    # skipping any run a room is still in the middle of
+    cutoff = (now or timezone.now()) - retention
+
+    # Only rows from before the cutoff are grouped (created_at is indexed), not the whole hot table
+    candidates = set()
+    for model in (Post, Intervention):
+        candidates.update(
+            model.objects.filter(created_at__lt=cutoff, activity_run_id__isnull=False)
+            .order_by()
+            .values_list("room_id", "activity_run_id")
+            .distinct()
+        )
+
+    # A candidate with anything newer than the cutoff is still in use
+    recent = set()
+    run_ids = sorted({run_id for _, run_id in candidates}, key=str)
+    for start in range(0, len(run_ids), ARCHIVE_BATCH_SIZE):
+        chunk = run_ids[start:start + ARCHIVE_BATCH_SIZE]
+        for model in (Post, Intervention):
+            recent.update(
+                model.objects.filter(activity_run_id__in=chunk, created_at__gte=cutoff)
+                .order_by()
+                .values_list("room_id", "activity_run_id")
+                .distinct()
+            )
+
+    stale = [key for key in candidates if key not in recent]
+    rooms = Room.objects.select_related("selected_activity").in_bulk({room_id for room_id, _ in stale})
+
+    runs = []
+    for room_id, run_id in stale:
+        room = rooms[room_id]
+        if run_id == room.activity_run_id and not get_activity_state(room).get("finished"):
+            continue
+        runs.append((room_id, run_id))
+    return sorted(runs, key=lambda r: (r[0], str(r[1])))
+
+
+def _move_batch(model, archive_model, fields, run_id, batch_size) -> int:
+    with transaction.atomic(using=room_db()):
+        rows = list(
+            model.objects.filter(activity_run_id=run_id)
+            .order_by("id")
+            .values(*fields)[:batch_size]
+        )
+        if not rows:
+            return 0
+        archive_model.objects.bulk_create([archive_model(**row) for row in rows])
+        model.objects.filter(id__in=[row["id"] for row in rows]).delete()
+    return len(rows)
+
+
+def archive_run(room, run_id, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None) -> dict:
+    # Moves the run in bounded batches, each in its own transaction; returns how many rows moved
+    if not RunSnapshot.objects.filter(activity_run_id=run_id).exists():
+        # The snapshot builder reads the hot tables, so it has to run before they are emptied
+        build_run_snapshot(room, run_id)
+
+    moved = {"posts": 0, "interventions": 0, "batches": 0}
+    for key, model, archive_model, fields in (
+        ("posts", Post, ArchivedPost, POST_FIELDS),
+        ("interventions", Intervention, ArchivedIntervention, INTERVENTION_FIELDS),
+    ):
+        while max_batches is None or moved["batches"] < max_batches:
+            n = _move_batch(model, archive_model, fields, run_id, batch_size)
+            if not n:
+                break
+            moved[key] += n
+            moved["batches"] += 1
+    return moved
+
+
+def run_posts(room, run_id, phase_index=None, all_phases=False) -> list:
+    # Posts of a run from the hot table and the archive, oldest first
+    filters = {"room": room, "activity_run_id": run_id}
+    if not all_phases:
+        filters["phase_index"] = phase_index
+    posts = list(Post.objects.filter(**filters).select_related("author"))
+    posts += ArchivedPost.objects.filter(**filters).select_related("author")
+    return sorted(posts, key=lambda p: (p.created_at, p.id))
+
+
+def run_interventions(room, run_id, phase_index=None, all_phases=False) -> list:
+    filters = {"room": room, "activity_run_id": run_id}
+    if not all_phases:
+        filters["phase_index"] = phase_index
+    interventions = list(Intervention.objects.filter(**filters).select_related("agent"))
+    interventions += ArchivedIntervention.objects.filter(**filters).select_related("agent")
+    return sorted(interventions, key=lambda i: (i.created_at, i.id))
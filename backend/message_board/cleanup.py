@@ -0,0 +1,113 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from core.backends import guest_users
+from .models import ArchivedPost, Post, Room, RoomMember, RunSnapshot
+from .sharding import each_shard, room_databases
+
+GC_INACTIVE_AFTER = timedelta(days=30)
+GC_BATCH_SIZE = 500
+
+
+def abandoned_guests(cutoff):
+    # Guests not logged in or seen in a room since the cutoff who never posted anything
+    recently_seen = RoomMember.objects.filter(user=OuterRef("pk"), last_seen_at__gte=cutoff)
+    return (
+        guest_users()
+        .filter(Q(last_login__lt=cutoff) | Q(last_login__isnull=True, date_joined__lt=cutoff))
+        .exclude(Exists(recently_seen))
+        .exclude(Exists(Post.objects.filter(author=OuterRef("pk"))))
+        .exclude(Exists(ArchivedPost.objects.filter(author=OuterRef("pk"))))
+    )
+
+
+def active_on_shards(user_ids, cutoff) -> set:
+    # abandoned_guests() only sees the rooms in the default database; with sharded rooms, these
+    # guests were seen or posted in a room on another shard
+    active = set()
+    for alias in room_databases()[1:]:
+        active.update(
+            RoomMember.objects.using(alias)
+            .filter(user_id__in=user_ids, last_seen_at__gte=cutoff)
+            .values_list("user_id", flat=True)
+        )
+        for model in (Post, ArchivedPost):
+            active.update(model.objects.using(alias).filter(author_id__in=user_ids).values_list("author_id", flat=True))
+    return active
+
+
+def abandoned_rooms(cutoff):
+    # Rooms older than the cutoff with no posts or snapshots, no running activity and nobody
+    # joining or looking at them since
+    recent_members = RoomMember.objects.filter(
+        Q(joined_at__gte=cutoff) | Q(last_seen_at__gte=cutoff),
+        room=OuterRef("pk"),
+    )
+    return (
+        Room.objects.filter(created_at__lt=cutoff, activity_is_running=False)
+        .exclude(Exists(recent_members))
+        .exclude(Exists(Post.objects.filter(room=OuterRef("pk"))))
+        .exclude(Exists(ArchivedPost.objects.filter(room=OuterRef("pk"))))
+        .exclude(Exists(RunSnapshot.objects.filter(room=OuterRef("pk"))))
+    )
+
+
+def collect(candidates, after_id=0, batch_size=GC_BATCH_SIZE, max_batches=None, pause=0.0, dry_run=False, keep=None):
+    # Deletes candidates() in id order, one short transaction per batch. Yields
+    # (last_id, {model label: rows deleted}) after each batch; last_id is where to resume from.
+    # keep(ids) may veto some of a batch's ids.
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(
+            candidates().filter(id__gt=after_id).order_by("id").values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return
+        after_id = ids[-1]
+        if keep is not None:
+            kept = keep(ids)
+            ids = [pk for pk in ids if pk not in kept]
+
+        if dry_run:
+            deleted = Counter({candidates().model._meta.label: len(ids)})
+        elif ids:
+            with transaction.atomic(using=candidates().db):
+                # Re-checked inside the transaction, in case a row came back to life since the scan
+                _, per_model = candidates().filter(id__in=ids).delete()
+            deleted = Counter(per_model)
+        else:
+            deleted = Counter()
+
+        batches += 1
+        yield after_id, deleted
+
+        if pause:
+            time.sleep(pause)
+
+
+def collect_garbage(inactive_after=GC_INACTIVE_AFTER, now=None, rooms_after=0, users_after=0, **options):
+    # Rooms first, so guests whose only membership was in an abandoned room go in the same pass
+    cutoff = (now or timezone.now()) - inactive_after
+    report = {"cutoff": cutoff, "deleted": Counter(), "batches": 0, "rooms_after": rooms_after, "users_after": users_after}
+
+    def tally(key, batches):
+        for last_id, deleted in batches:
+            report[key] = last_id
+            report["deleted"].update(deleted)
+            report["batches"] += 1
+
+    # Room ids grow from one shard to the next, so one rooms_after resumes across shards
+    for _ in each_shard():
+        tally("rooms_after", collect(lambda: abandoned_rooms(cutoff), after_id=report["rooms_after"], **options))
+    tally("users_after", collect(
+        lambda: abandoned_guests(cutoff),
+        after_id=report["users_after"],
+        keep=lambda ids: active_on_shards(ids, cutoff),
+        **options,
+    ))
+    return report
@@ -0,0 +1,33 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.utils import timezone
+
+# The time source for the agent rules and everything that decides "how long ago". Production
+# uses the wall clock; the replay simulator swaps in a SimulatedClock.
+_clock = contextvars.ContextVar("message_board_clock", default=timezone.now)
+
+
+def now():
+    return _clock.get()()
+
+
+@contextmanager
+def use_clock(clock):
+    token = _clock.set(clock)
+    try:
+        yield clock
+    finally:
+        _clock.reset(token)
+
+
+class SimulatedClock:
+    def __init__(self, start=None):
+        self.current = start or timezone.now()
+
+    def __call__(self):
+        return self.current
+
+    def advance(self, delta):
+        self.current += delta
+        return self.current
@@ -0,0 +1,182 @@
+import json
+import math
+import random
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from .agent_rules import CITATION_PATTERNS, EVIDENCE_KEYWORDS, message_lacks_evidence
+from .models import Post
+
+DEFAULT_WEIGHTS_FILE = Path(__file__).resolve().parent / "evidence_weights.json"
+RESCORE_BATCH_SIZE = 1000
+
+# Opinion and certainty markers: claims phrased like this are the ones that most need support
+HEDGES = [
+    "i think", "i feel", "i believe", "i guess", "maybe", "probably",
+    "obviously", "clearly", "definitely", "everyone knows",
+]
+
+# Column order of the feature matrix; a weight file names the columns it sets
+FEATURES = (
+    ["question", "digit", "long", "log_length"]
+    + [f"keyword:{k}" for k in EVIDENCE_KEYWORDS]
+    + [f"citation:{p}" for p in CITATION_PATTERNS]
+    + [f"hedge:{h}" for h in HEDGES]
+)
+
+_CITATIONS = [re.compile(p, re.IGNORECASE) for p in CITATION_PATTERNS]
+
+
+_WORDS = (
+    "we should pick the option that works for most of the group and then move on to the next "
+    "part because time is short idea plan team result approach cleaner simpler better worse"
+).split()
+_MARKERS = EVIDENCE_KEYWORDS + ["[3]", "(2019)", "doi:10.1000/182", "42", "?"]
+
+
+def synthetic_posts(n, seed=0) -> list:
+    # Claim-like posts with and without evidence markers, for the tests and the benchmark
+    rng = random.Random(seed)
+    posts = []
+    for _ in range(n):
+        words = rng.choices(_WORDS, k=rng.randint(3, 40))
+        if rng.random() < 0.3:
+            words.insert(0, rng.choice(HEDGES))
+        if rng.random() < 0.5:
+            words.insert(rng.randint(0, len(words)), rng.choice(_MARKERS))
+        posts.append(" ".join(words).capitalize())
+    return posts
+
+
+class EvidenceScorerError(Exception):
+    pass
+
+
+def _numpy():
+    # numpy is only needed when the scorer is switched on, so it is not a hard dependency
+    try:
+        import numpy
+    except ImportError as e:
+        raise EvidenceScorerError("The evidence scorer needs numpy (pip install numpy)") from e
+    return numpy
+
+
+class EvidenceScorer:
+    # Linear model over a handful of binary text features, scored for a whole batch at once:
+    # one substring pass per feature over an array of posts, then a matrix-vector product.
+    # Outputs the probability that a post is a claim without evidence.
+
+    def __init__(self, weights, bias=0.0, threshold=0.5):
+        unknown = set(weights) - set(FEATURES)
+        if unknown:
+            raise EvidenceScorerError(f"Unknown features in weights: {', '.join(sorted(unknown))}")
+        if not 0 < threshold < 1:
+            raise EvidenceScorerError("threshold must be between 0 and 1")
+        np = _numpy()
+        self.weights = np.array([float(weights.get(name, 0.0)) for name in FEATURES], dtype=np.float64)
+        self.bias = float(bias)
+        self.threshold = float(threshold)
+        # Compare raw scores to the logit of the threshold; no sigmoid needed to classify
+        self._cutoff = math.log(self.threshold / (1 - self.threshold))
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            data = json.loads(Path(path).read_text())
+        except (OSError, ValueError) as e:
+            raise EvidenceScorerError(f"Can't read evidence weights from {path}: {e}") from e
+        if not isinstance(data, dict) or not isinstance(data.get("weights"), dict):
+            raise EvidenceScorerError(f"{path} must be an object with a \"weights\" object")
+        return cls(data["weights"], bias=data.get("bias", 0.0), threshold=data.get("threshold", 0.5))
+
+    def features(self, texts):
+        np = _numpy()
+        lowered = [(t or "").strip().lower() for t in texts]
+        X = np.zeros((len(lowered), len(FEATURES)), dtype=np.float64)
+        if not lowered:
+            return X
+        posts = np.array(lowered, dtype=str)
+        # numpy 2 has faster string kernels under np.strings
+        find = np.strings.find if hasattr(np, "strings") else np.char.find
+
+        def contains(needle):
+            return find(posts, needle) >= 0
+
+        # Single characters straight off the code points: one pass instead of one per character
+        codes = posts.view(np.uint32).reshape(len(lowered), -1)
+        lengths = np.char.str_len(posts)
+        X[:, 0] = (codes == ord("?")).any(axis=1)
+        X[:, 1] = ((codes >= ord("0")) & (codes <= ord("9"))).any(axis=1)
+        X[:, 2] = lengths >= 20
+        X[:, 3] = np.log1p(lengths)
+        column = 4
+        for keyword in EVIDENCE_KEYWORDS:
+            X[:, column] = contains(keyword)
+            column += 1
+        for pattern in _CITATIONS:
+            # Regexes have no vectorized form; they're few and usually fail on the first character
+            X[:, column] = [pattern.search(t) is not None for t in lowered]
+            column += 1
+        for hedge in HEDGES:
+            X[:, column] = contains(hedge)
+            column += 1
+        return X
+
+    def raw_scores(self, texts):
+        return self.features(texts) @ self.weights + self.bias
+
+    def scores(self, texts):
+        np = _numpy()
+        return 1 / (1 + np.exp(-self.raw_scores(texts)))
+
+    def lacks_evidence(self, texts) -> list:
+        return (self.raw_scores(texts) >= self._cutoff).tolist()
+
+
+_scorers = {}
+
+
+def get_scorer(path=None) -> EvidenceScorer:
+    path = str(path or getattr(settings, "EVIDENCE_WEIGHTS_FILE", None) or DEFAULT_WEIGHTS_FILE)
+    scorer = _scorers.get(path)
+    if scorer is None:
+        scorer = _scorers[path] = EvidenceScorer.from_file(path)
+    return scorer
+
+
+def scorer_enabled() -> bool:
+    return getattr(settings, "EVIDENCE_SCORER", "heuristic") == "numpy"
+
+
+def lacks_evidence_batch(texts) -> list:
+    if scorer_enabled():
+        return get_scorer().lacks_evidence(texts)
+    return [message_lacks_evidence(t) for t in texts]
+
+
+def lacks_evidence(text) -> bool:
+    return lacks_evidence_batch([text])[0]
+
+
+def rescore_posts(queryset=None, scorer=None, batch_size=RESCORE_BATCH_SIZE, after=0, dry_run=False):
+    # Streams over the posts in id order, one batch in memory at a time, and brings their
+    # lacks_evidence flag in line with the scorer. Yields a progress dict per batch; each
+    # batch is its own transaction, so an interrupted run can resume from the last id.
+    scorer = scorer or get_scorer()
+    queryset = (queryset if queryset is not None else Post.objects.all()).order_by("id")
+    while True:
+        rows = list(queryset.filter(id__gt=after).values_list("id", "content", "lacks_evidence")[:batch_size])
+        if not rows:
+            return
+        flags = scorer.lacks_evidence([content for _, content, _ in rows])
+        flagged = [pk for (pk, _, old), new in zip(rows, flags) if new and not old]
+        cleared = [pk for (pk, _, old), new in zip(rows, flags) if old and not new]
+        if not dry_run and (flagged or cleared):
+            with transaction.atomic(using=queryset.db):
+                queryset.filter(id__in=flagged).update(lacks_evidence=True)
+                queryset.filter(id__in=cleared).update(lacks_evidence=False)
+        after = rows[-1][0]
+        yield {"last_id": after, "scanned": len(rows), "flagged": len(flagged), "cleared": len(cleared)}
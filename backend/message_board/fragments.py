@@ -0,0 +1,184 @@
+import json
+import threading
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.text import compress_string
+
+from .models import Intervention, Post
+
+FRAGMENT_CACHE_SIZE = 20000
+GZIP_CACHE_SIZE = 500
+# Smaller bodies aren't worth compressing
+GZIP_MIN_LENGTH = 1024
+
+
+class _LRU:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# (type, id, flag) -> JSON bytes of one timeline entry. Interventions never change once written
+# (archiving keeps the id). The one thing about a post that does, lacks_evidence (rescore_posts,
+# possibly in another process), is part of its key and read along with the id, so a rescored
+# post gets a new entry instead of an invalidation. Entries are only ever evicted.
+_fragments = _LRU(FRAGMENT_CACHE_SIZE)
+# timeline version -> gzipped response body
+_gzipped = _LRU(GZIP_CACHE_SIZE)
+
+
+def clear_fragments():
+    _fragments.clear()
+    _gzipped.clear()
+
+
+def _encode(data) -> bytes:
+    # Same encoding as JsonResponse, so assembled bodies match what it would have produced
+    return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+def post_message(post) -> dict:
+    return {
+        "type": "post",
+        "id": post.id,
+        "content": post.content,
+        "author": post.author.first_name or post.author.username,
+        "created_at": post.created_at.isoformat(),
+        "phase_index": post.phase_index,
+        "lacks_evidence": post.lacks_evidence,
+    }
+
+
+def intervention_message(intervention) -> dict:
+    return {
+        "type": "intervention",
+        "id": intervention.id,
+        "content": intervention.message,
+        "author": intervention.agent.name,
+        "explanation": intervention.explanation,
+        "rule_name": intervention.rule_name,
+        "created_at": intervention.created_at.isoformat(),
+        "phase_index": intervention.phase_index,
+    }
+
+
+def _post_key(pk, lacks_evidence):
+    return ("post", pk, bool(lacks_evidence))
+
+
+def _intervention_key(pk, _=None):
+    return ("intervention", pk, None)
+
+
+def post_fragment(post) -> bytes:
+    key = _post_key(post.id, post.lacks_evidence)
+    fragment = _fragments.get(key)
+    if fragment is None:
+        fragment = _encode(post_message(post))
+        _fragments.set(key, fragment)
+    return fragment
+
+
+def intervention_fragment(intervention) -> bytes:
+    key = _intervention_key(intervention.id)
+    fragment = _fragments.get(key)
+    if fragment is None:
+        fragment = _encode(intervention_message(intervention))
+        _fragments.set(key, fragment)
+    return fragment
+
+
+def _cached_fragments(key, model, related, rows, render):
+    # rows: (id, created_at, flag) triples; only the ids we have no fragment for are loaded in full
+    found = {}
+    missing = []
+    for pk, _, flag in rows:
+        fragment = _fragments.get(key(pk, flag))
+        if fragment is None:
+            missing.append(pk)
+        else:
+            found[pk] = fragment
+    if missing:
+        for obj in model.objects.filter(id__in=missing).select_related(related):
+            found[obj.id] = render(obj)
+    return found
+
+
+def _flagged(ids) -> int:
+    # Part of the version key: a rescore that flips any flag changes the gzipped body
+    return hash(tuple(ids))
+
+
+def timeline(posts_qs, interventions_qs):
+    # Returns (fragments in timeline order, version key of the listing)
+    post_rows = list(posts_qs.values_list("id", "created_at", "lacks_evidence"))
+    intervention_rows = [(pk, created_at, None) for pk, created_at in interventions_qs.values_list("id", "created_at")]
+
+    posts = _cached_fragments(_post_key, Post, "author", post_rows, post_fragment)
+    interventions = _cached_fragments(_intervention_key, Intervention, "agent", intervention_rows, intervention_fragment)
+
+    entries = [(created_at.isoformat(), posts[pk]) for pk, created_at, _ in post_rows if pk in posts]
+    entries += [(created_at.isoformat(), interventions[pk]) for pk, created_at, _ in intervention_rows if pk in interventions]
+    entries.sort(key=lambda e: e[0])
+
+    version = (
+        len(post_rows), max((pk for pk, _, _ in post_rows), default=0),
+        len(intervention_rows), max((pk for pk, _, _ in intervention_rows), default=0),
+        _flagged(pk for pk, _, flag in post_rows if flag),
+    )
+    return [fragment for _, fragment in entries], version
+
+
+def object_timeline(posts, interventions):
+    # Same as timeline() for already loaded objects (history mode)
+    entries = [(p.created_at.isoformat(), post_fragment(p)) for p in posts]
+    entries += [(i.created_at.isoformat(), intervention_fragment(i)) for i in interventions]
+    entries.sort(key=lambda e: e[0])
+    version = (
+        len(posts), max((p.id for p in posts), default=0),
+        len(interventions), max((i.id for i in interventions), default=0),
+        _flagged(p.id for p in posts if p.lacks_evidence),
+    )
+    return [fragment for _, fragment in entries], version
+
+
+def timeline_response(request, head: dict, fragments, version=None):
+    # head is the response object minus "messages", which goes last
+    head_bytes = _encode(head)
+    body = head_bytes[:-1] + b', "messages": [' + b", ".join(fragments) + b"]}"
+
+    response = HttpResponse(content_type="application/json")
+    response["Vary"] = "Accept-Encoding"
+    if version is None or len(body) < GZIP_MIN_LENGTH or "gzip" not in request.headers.get("Accept-Encoding", ""):
+        response.content = body
+        return response
+
+    key = (version, head_bytes)
+    compressed = _gzipped.get(key)
+    if compressed is None:
+        compressed = compress_string(body)
+        _gzipped.set(key, compressed)
+    response.content = compressed
+    response["Content-Encoding"] = "gzip"
+    return response
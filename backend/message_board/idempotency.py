@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+
+from .models import Post
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL = timedelta(hours=1)
+IDEMPOTENCY_KEY_MAX_LENGTH = Post._meta.get_field("client_id").max_length
+
+
+class InvalidIdempotencyKey(Exception):
+    pass
+
+
+def idempotency_key(request, payload):
+    # Header first; the batch endpoint's client_id field works here too
+    if not isinstance(payload, dict):
+        raise InvalidIdempotencyKey("Expected a JSON object")
+    key = request.headers.get(IDEMPOTENCY_HEADER) or payload.get("client_id")
+    if key is None:
+        return None
+    if not isinstance(key, str) or not key.strip() or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise InvalidIdempotencyKey(f"{IDEMPOTENCY_HEADER} must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+    return key
+
+
+def _cache_key(user, key):
+    return f"idempotency:{user.id}:{key}"
+
+
+def remembered_response(user, key):
+    # (status, data) of the first response for this key, from the TTL cache; None if it has expired
+    return cache.get(_cache_key(user, key))
+
+
+def remember_response(user, key, status, data):
+    cache.set(_cache_key(user, key), (status, data), timeout=IDEMPOTENCY_TTL.total_seconds())
+
+
+def existing_post(user, key):
+    # Fallback once the cache entry is gone (or was stored by another worker): the unique client_id
+    return Post.objects.filter(author=user, client_id=key).select_related("room", "author").first()
@@ -0,0 +1,143 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .agent_rules import check_all_rules_for_batch
+from .evidence import lacks_evidence_batch
+from .fragments import post_fragment
+from .models import Post
+from .participation import record_post, record_posts
+from .phases import get_activity_state
+from .rule_workers import rules_inline
+from .sharding import room_db
+
+MAX_BATCH_POSTS = 100
+CLIENT_ID_MAX_LENGTH = Post._meta.get_field("client_id").max_length
+
+# Client timestamps older than this (or from before the run started) are clamped
+MAX_BACKDATE = timedelta(minutes=30)
+
+
+def _clamp_timestamp(room, raw, now):
+    earliest = now - MAX_BACKDATE
+    if room.activity_is_running and room.activity_started_at and room.activity_started_at > earliest:
+        earliest = room.activity_started_at
+
+    ts = parse_datetime(raw) if isinstance(raw, str) else None
+    if ts is None:
+        return now
+    if timezone.is_naive(ts):
+        ts = timezone.make_aware(ts)
+    return min(max(ts, earliest), now)
+
+
+def _phase_at(room, ts):
+    state = get_activity_state(room, now=ts)
+    if state.get("is_running") and not state.get("finished", False):
+        return state.get("phase_index")
+    return None
+
+
+def ingest_posts(room, user, items, now=None) -> dict:
+    # Returns {"results": [...], "created": [Post, ...]}; results line up with items
+    now = now or timezone.now()
+    results = [None] * len(items)
+    pending = {}   # client_id -> index into items
+    repeats = []   # (index, client_id) of items repeating an earlier client_id in the batch
+
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = {"client_id": None, "status": "invalid", "detail": "each post must be an object"}
+            continue
+
+        client_id = item.get("client_id")
+        content = (item.get("content") or "").strip() if isinstance(item.get("content"), str) else ""
+        if not isinstance(client_id, str) or not client_id.strip() or len(client_id) > CLIENT_ID_MAX_LENGTH:
+            results[i] = {"client_id": client_id, "status": "invalid", "detail": "client_id is required"}
+        elif not content:
+            results[i] = {"client_id": client_id, "status": "invalid", "detail": "content is required"}
+        elif client_id in pending:
+            repeats.append((i, client_id))
+        else:
+            pending[client_id] = i
+
+    existing = dict(
+        Post.objects.filter(author=user, client_id__in=pending.keys()).values_list("client_id", "id")
+    )
+    for client_id, post_id in existing.items():
+        results[pending.pop(client_id)] = {"client_id": client_id, "status": "duplicate", "id": post_id}
+
+    contents = {i: items[i]["content"].strip() for i in pending.values()}
+    # Scored as one batch (matters with the numpy scorer)
+    flags = dict(zip(contents, lacks_evidence_batch(list(contents.values()))))
+    posts = []
+    for client_id, i in pending.items():
+        content = contents[i]
+        created_at = _clamp_timestamp(room, items[i].get("created_at"), now)
+        posts.append(Post(
+            room=room,
+            author=user,
+            content=content,
+            created_at=created_at,
+            phase_index=_phase_at(room, created_at),
+            activity_run_id=room.activity_run_id,
+            lacks_evidence=flags[i],
+            client_id=client_id,
+        ))
+
+    # Counters are bumped in the posts' own transaction, so they never count a post that isn't there
+    try:
+        with transaction.atomic(using=room_db(room)):
+            Post.objects.bulk_create(posts)
+            record_posts(posts)
+    except IntegrityError:
+        # A concurrent retry of the same batch got some of these in first; insert the rest one by one
+        created = []
+        for post in posts:
+            try:
+                with transaction.atomic(using=room_db(room)):
+                    post.save()
+                    record_post(post)
+                created.append(post)
+            except IntegrityError:
+                post.pk = None
+        posts = created
+
+    # Not every backend returns primary keys from bulk_create
+    if posts and posts[0].pk is None:
+        ids = dict(
+            Post.objects.filter(author=user, client_id__in=[p.client_id for p in posts]).values_list("client_id", "id")
+        )
+        for post in posts:
+            post.pk = ids.get(post.client_id)
+
+    stored = {p.client_id for p in posts}
+    lost = [client_id for client_id in pending if client_id not in stored]
+    if lost:
+        existing = dict(Post.objects.filter(author=user, client_id__in=lost).values_list("client_id", "id"))
+        for client_id in lost:
+            results[pending[client_id]] = {"client_id": client_id, "status": "duplicate", "id": existing.get(client_id)}
+
+    for post in posts:
+        results[pending[post.client_id]] = {
+            "client_id": post.client_id,
+            "status": "created",
+            "id": post.pk,
+            "created_at": post.created_at.isoformat(),
+            "phase_index": post.phase_index,
+            "lacks_evidence": post.lacks_evidence,
+        }
+
+    for i, client_id in repeats:
+        first = next(r for r in results if r and r.get("client_id") == client_id and r["status"] != "invalid")
+        results[i] = {"client_id": client_id, "status": "duplicate", "id": first.get("id")}
+
+    if posts:
+        for post in posts:
+            post_fragment(post)
+        if rules_inline():
+            check_all_rules_for_batch(room, posts)
+
+    return {"results": results, "created": posts}
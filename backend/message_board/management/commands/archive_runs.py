@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from message_board.archival import ARCHIVE_BATCH_SIZE, ARCHIVE_RETENTION, archivable_runs, archive_run
+from message_board.models import Room
+
+
+class Command(BaseCommand):
+    help = "Move posts and interventions of finished runs past the retention window into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=ARCHIVE_RETENTION.days, help="Retention window in days.")
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument(
+            "--max-batches", type=int, default=None,
+            help="Stop after this many batches; the next invocation picks up where this one left off.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only list the runs that would be archived.")
+
+    def handle(self, *args, **options):
+        runs = archivable_runs(retention=timedelta(days=options["days"]))
+        self.stdout.write(f"{len(runs)} runs eligible for archival.")
+        if options["dry_run"]:
+            for room_id, run_id in runs:
+                self.stdout.write(f"room={room_id} run={run_id}")
+            return
+
+        rooms = Room.objects.in_bulk({room_id for room_id, _ in runs})
+        budget = options["max_batches"]
+        totals = {"posts": 0, "interventions": 0, "batches": 0, "runs": 0}
+
+        for room_id, run_id in runs:
+            if budget is not None and totals["batches"] >= budget:
+                break
+            remaining = None if budget is None else budget - totals["batches"]
+            moved = archive_run(rooms[room_id], run_id, batch_size=options["batch_size"], max_batches=remaining)
+            for key in ("posts", "interventions", "batches"):
+                totals[key] += moved[key]
+            totals["runs"] += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {totals['posts']} posts and {totals['interventions']} interventions "
+            f"from {totals['runs']} runs in {totals['batches']} batches."
+        ))
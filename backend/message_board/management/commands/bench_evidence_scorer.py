@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from message_board.agent_rules import CITATION_PATTERNS, message_lacks_evidence
+from message_board.evidence import EvidenceScorerError, get_scorer, synthetic_posts
+from message_board.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the throughput (posts/s) of the keyword heuristic, one post at a time, "
+        "with the numpy evidence scorer on whole batches. Whether they agree is covered by the tests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=20000)
+        parser.add_argument("--batch-size", type=int, action="append", dest="batch_sizes",
+                            help="Scorer batch size; repeat to compare several (default 1, 100, 1000).")
+        parser.add_argument("--weights", help="Weight file (default: settings.EVIDENCE_WEIGHTS_FILE).")
+        parser.add_argument("--from-db", action="store_true", help="Use the latest posts instead of synthetic ones.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        n = options["posts"]
+        batch_sizes = options["batch_sizes"] or [1, 100, 1000]
+        if n < 1 or min(batch_sizes) < 1:
+            raise CommandError("--posts and --batch-size must be positive")
+        try:
+            scorer = get_scorer(options["weights"])
+        except EvidenceScorerError as e:
+            raise CommandError(str(e))
+
+        if options["from_db"]:
+            posts = list(Post.objects.order_by("-id").values_list("content", flat=True)[:n])
+            if not posts:
+                raise CommandError("No posts in the database")
+        else:
+            posts = synthetic_posts(n, options["seed"])
+        self.stdout.write(f"{len(posts)} posts, {len(CITATION_PATTERNS)} citation patterns")
+
+        started = time.perf_counter()
+        for post in posts:
+            message_lacks_evidence(post)
+        elapsed = time.perf_counter() - started
+        baseline = len(posts) / elapsed
+        self.stdout.write(f"{'heuristic':<16} {baseline:>10.0f} posts/s")
+
+        for size in batch_sizes:
+            started = time.perf_counter()
+            for i in range(0, len(posts), size):
+                scorer.lacks_evidence(posts[i:i + size])
+            elapsed = time.perf_counter() - started
+            rate = len(posts) / elapsed
+            self.stdout.write(f"{f'scorer x{size}':<16} {rate:>10.0f} posts/s  {rate / baseline:5.2f}x")
@@ -0,0 +1,81 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from message_board.models import Post, RoomMember
+from message_board.room_codes import allocate_room
+from message_board.write_buffer import insert, write_buffer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare single-row Post inserts from concurrent request threads, one transaction per row "
+        "versus through the group-commit write buffer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16, help="Concurrent posters.")
+        parser.add_argument("--posts", type=int, default=100, help="Posts per thread.")
+        parser.add_argument("--keep", action="store_true", help="Keep the generated room and posts.")
+
+    def handle(self, *args, **options):
+        threads, per_thread = options["threads"], options["posts"]
+        if threads < 1 or per_thread < 1:
+            raise CommandError("--threads and --posts must be positive")
+
+        tag = uuid.uuid4().hex[:8]
+        room = allocate_room(name=f"bench-{tag}", activity_run_id=uuid.uuid4())
+        users = []
+        for i in range(threads):
+            user = User(username=f"bench-{tag}-{i}")
+            user.set_unusable_password()
+            user.save()
+            users.append(user)
+        RoomMember.objects.bulk_create([RoomMember(room=room, user=u) for u in users])
+
+        def poster(user):
+            try:
+                for i in range(per_thread):
+                    insert(Post(
+                        room=room,
+                        author=user,
+                        content=f"benchmark post {i}",
+                        phase_index=0,
+                        activity_run_id=room.activity_run_id,
+                    ))
+            finally:
+                connection.close()
+
+        def run(label, buffered):
+            before = dict(write_buffer.stats)
+            with override_settings(WRITE_BUFFER=buffered):
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    list(pool.map(poster, users))
+                elapsed = time.perf_counter() - started
+
+            rows = threads * per_thread
+            line = f"{label:<12} {rows} posts in {elapsed:.2f}s, {rows / elapsed:.0f} posts/s"
+            batches = write_buffer.stats["batches"] - before.get("batches", 0)
+            if buffered and batches:
+                line += f" ({batches} commits, {rows / batches:.1f} rows per commit)"
+            self.stdout.write(line)
+            return rows / elapsed
+
+        try:
+            per_row = run("per-row", buffered=False)
+            buffered = run("buffered", buffered=True)
+            expected = 2 * threads * per_thread
+            stored = Post.objects.filter(room=room).count()
+            if stored != expected:
+                raise CommandError(f"Expected {expected} posts, found {stored}")
+            self.stdout.write(self.style.SUCCESS(f"Buffered/per-row throughput: {buffered / per_row:.2f}x"))
+        finally:
+            if not options["keep"]:
+                room.delete()
+                User.objects.filter(id__in=[u.id for u in users]).delete()
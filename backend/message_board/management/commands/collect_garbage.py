@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from message_board.cleanup import GC_BATCH_SIZE, GC_INACTIVE_AFTER, collect_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete abandoned temp-login guests and unused rooms in small batches. "
+        "Safe to interrupt; rerun (or pass the printed --*-after ids) to carry on."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=GC_INACTIVE_AFTER.days, help="Inactivity threshold in days.")
+        parser.add_argument("--batch-size", type=int, default=GC_BATCH_SIZE)
+        parser.add_argument("--max-batches", type=int, default=None, help="Stop after this many batches per table.")
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+        parser.add_argument("--rooms-after", type=int, default=0, help="Resume rooms after this id.")
+        parser.add_argument("--users-after", type=int, default=0, help="Resume users after this id.")
+        parser.add_argument("--dry-run", action="store_true", help="Count what would be deleted (rooms/users only).")
+
+    def handle(self, *args, **options):
+        if options["days"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--days and --batch-size must be positive")
+
+        started = time.perf_counter()
+        report = collect_garbage(
+            inactive_after=timedelta(days=options["days"]),
+            rooms_after=options["rooms_after"],
+            users_after=options["users_after"],
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+            pause=options["pause"],
+            dry_run=options["dry_run"],
+        )
+        elapsed = time.perf_counter() - started
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(f"Inactive since {report['cutoff']:%Y-%m-%d %H:%M} UTC, {report['batches']} batches in {elapsed:.2f}s")
+        if not report["deleted"]:
+            self.stdout.write("Nothing to reclaim.")
+        for label, n in sorted(report["deleted"].items()):
+            if n:
+                self.stdout.write(f"  {verb} {n} {label}")
+
+        if options["max_batches"] is not None and report["batches"] >= options["max_batches"]:
+            self.stdout.write(
+                f"Stopped at --max-batches; resume with --rooms-after {report['rooms_after']} "
+                f"--users-after {report['users_after']}"
+            )
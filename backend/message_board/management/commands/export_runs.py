@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from message_board.exports import EXPORT_FORMATS, EXPORT_KINDS, ExportError, parse_export_filters, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream posts and interventions for activity runs as JSONL or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl")
+        parser.add_argument("--kinds", default=",".join(EXPORT_KINDS), help="Comma-separated: posts,interventions")
+        parser.add_argument("--room", help="Room code.")
+        parser.add_argument("--run", help="activity_run_id (UUID).")
+        parser.add_argument("--since", help="ISO 8601 datetime, inclusive.")
+        parser.add_argument("--until", help="ISO 8601 datetime, exclusive.")
+        parser.add_argument("--output", help="File to write to (default: stdout).")
+
+    def handle(self, *args, **options):
+        kinds = [k.strip() for k in options["kinds"].split(",") if k.strip()]
+        try:
+            filters = parse_export_filters(
+                room=options["room"],
+                run=options["run"],
+                since=options["since"],
+                until=options["until"],
+            )
+            chunks = stream_export(filters, fmt=options["format"], kinds=kinds)
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        out = open(options["output"], "w", encoding="utf-8", newline="") if options["output"] else sys.stdout
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,60 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from message_board.models import Activity
+from message_board.provisioning import ProvisioningError, numbered_specs, provision_rooms
+
+
+class Command(BaseCommand):
+    help = "Provision many rooms in one transaction, optionally with members and a selected activity."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, help="Number of numbered rooms to create.")
+        parser.add_argument("--prefix", default="Room", help="Name prefix for numbered rooms.")
+        parser.add_argument(
+            "--spec",
+            help='JSON file with a list of rooms: [{"name": "...", "members": ["username", 42]}, ...]',
+        )
+        parser.add_argument("--activity", type=int, help="Activity id to select in every room.")
+        parser.add_argument("--creator", help="Username recorded as the rooms' creator.")
+        parser.add_argument("--join", action="store_true", help="Also add the creator to every room.")
+
+    def handle(self, *args, **options):
+        if options["spec"]:
+            try:
+                with open(options["spec"], encoding="utf-8") as f:
+                    specs = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                raise CommandError(f"Could not read {options['spec']}: {e}")
+        elif options["count"]:
+            specs = numbered_specs(options["count"], options["prefix"])
+        else:
+            raise CommandError("Pass either --count or --spec")
+
+        creator = None
+        if options["creator"]:
+            try:
+                creator = User.objects.get(username=options["creator"])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['creator']} not found")
+
+        activity = None
+        if options["activity"]:
+            try:
+                activity = Activity.objects.get(id=options["activity"])
+            except Activity.DoesNotExist:
+                raise CommandError(f"Activity {options['activity']} not found")
+
+        started = time.perf_counter()
+        try:
+            rooms = provision_rooms(specs, creator=creator, activity=activity, join_creator=options["join"])
+        except ProvisioningError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        for room in rooms:
+            self.stdout.write(f"{room.code}\t{room.name}\t{room.members_count} members")
+        self.stdout.write(self.style.SUCCESS(f"Provisioned {len(rooms)} rooms in {elapsed:.2f}s."))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max
+
+from message_board.models import ParticipationCounter, Post
+from message_board.room_codes import lookup_room
+
+
+class Command(BaseCommand):
+    help = "Rebuild participation counters from the Post table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", help="Only rebuild counters for this room code.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        counters = ParticipationCounter.objects.all()
+
+        if options["room"]:
+            room = lookup_room(options["room"])
+            if room is None:
+                raise CommandError(f"Room {options['room']} not found")
+            posts = posts.filter(room=room)
+            counters = counters.filter(room=room)
+
+        rows = (
+            posts.order_by()
+            .values("room_id", "activity_run_id", "phase_index", "author_id")
+            .annotate(post_count=Count("id"), last_posted_at=Max("created_at"))
+        )
+
+        with transaction.atomic(using=counters.db):
+            deleted, _ = counters.delete()
+            created = ParticipationCounter.objects.bulk_create(
+                (
+                    ParticipationCounter(
+                        room_id=row["room_id"],
+                        activity_run_id=row["activity_run_id"],
+                        phase_index=row["phase_index"],
+                        user_id=row["author_id"],
+                        post_count=row["post_count"],
+                        last_posted_at=row["last_posted_at"],
+                    )
+                    for row in rows.iterator()
+                ),
+                batch_size=options["batch_size"],
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(created)} participation counters (removed {deleted})."
+        ))
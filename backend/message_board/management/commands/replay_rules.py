@@ -0,0 +1,115 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from message_board.agent_rules import RuleLimits, rule_limits
+from message_board.models import Activity, Room
+from message_board.replay import ReplayError, recorded_script, replay, synthetic_script
+from message_board.room_codes import lookup_room
+
+
+def _parse_override(raw):
+    # NAME=VALUE, NAME a RuleLimits field (or its agent_rules constant); timedeltas take seconds
+    name, sep, value = raw.partition("=")
+    name = name.strip().lower()
+    if not sep or name not in RuleLimits._fields:
+        raise CommandError(f"--set expects NAME=VALUE with NAME one of {', '.join(RuleLimits._fields)}, got {raw!r}")
+    current = getattr(rule_limits(), name)
+    try:
+        if isinstance(current, timedelta):
+            return name, timedelta(seconds=float(value))
+        if isinstance(current, bool):
+            return name, value.strip().lower() in ("1", "true", "yes")
+        return name, type(current)(value)
+    except (TypeError, ValueError):
+        raise CommandError(f"Bad value for {name}: {value!r}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a recorded or synthetic run through the agent rules on a simulated clock, faster "
+        "than real time, and report interventions, rule CPU and queries per simulated minute. "
+        "Runs in scratch in-memory databases; the real ones are neither written nor locked."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", help="Room code of a recorded run (with --run).")
+        parser.add_argument("--run", help="activity_run_id of the recorded run.")
+        parser.add_argument("--members", type=int, default=5, help="Synthetic: number of members.")
+        parser.add_argument("--minutes", type=int, default=60, help="Synthetic: class length, split into four phases.")
+        parser.add_argument("--activity", type=int, help="Synthetic: use this activity's phases instead.")
+        parser.add_argument("--posts-per-minute", type=float, default=3.0, help="Synthetic: posts per minute in the room.")
+        parser.add_argument("--evidence-share", type=float, default=0.5, help="Synthetic: share of posts with evidence.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between each member's polls.")
+        parser.add_argument(
+            "--set", action="append", default=[], metavar="NAME=VALUE",
+            help="Override a rule limit, e.g. individual_inactivity_threshold=180 (seconds).",
+        )
+        parser.add_argument("--json", action="store_true", help="Print the full report as JSON.")
+
+    def handle(self, *args, **options):
+        overrides = dict(_parse_override(raw) for raw in options["set"])
+
+        if options["room"] or options["run"]:
+            if not (options["room"] and options["run"]):
+                raise CommandError("--room and --run go together")
+            room = lookup_room(options["room"], Room.objects.select_related("selected_activity"))
+            if room is None:
+                raise CommandError(f"Room {options['room']} not found")
+            try:
+                events, members, phases = recorded_script(room, options["run"])
+            except (ReplayError, ValueError) as e:
+                raise CommandError(str(e))
+        else:
+            if options["activity"]:
+                activity = Activity.objects.filter(pk=options["activity"]).first()
+                if activity is None:
+                    raise CommandError(f"Activity {options['activity']} not found")
+                phases = activity.phases
+            else:
+                quarter = max(1, options["minutes"] // 4)
+                phases = [
+                    {"name": name, "prompt": "", "time_limit_minutes": quarter}
+                    for name in ("understand", "propose", "critique", "decide")
+                ]
+            members = options["members"]
+            minutes = sum(p.get("time_limit_minutes") or 0 for p in phases)
+            events = synthetic_script(
+                members=members,
+                minutes=minutes,
+                posts_per_minute=options["posts_per_minute"],
+                evidence_share=options["evidence_share"],
+                seed=options["seed"],
+            )
+
+        try:
+            report = replay(
+                events, members, phases,
+                poll_interval=timedelta(seconds=options["poll_interval"]),
+                overrides=overrides,
+            )
+        except ReplayError as e:
+            raise CommandError(str(e))
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{'min':>4} {'posts':>5} {'calls':>6} {'cpu ms':>8} {'queries':>7}  interventions")
+        for row in report["minutes"]:
+            nudges = ", ".join(f"{rule} {n}" for rule, n in sorted(row["interventions"].items()))
+            self.stdout.write(
+                f"{row['minute']:>4} {row['posts']:>5} {row['rule_calls']:>6} "
+                f"{row['rule_cpu_ms']:>8.1f} {row['rule_queries']:>7}  {nudges}"
+            )
+        nudges = ", ".join(f"{rule} {n}" for rule, n in sorted(report["interventions"].items())) or "none"
+        self.stdout.write(
+            f"\n{report['simulated_minutes']:.0f} simulated minutes, {report['members']} members, "
+            f"{report['posts']} posts in {report['wall_seconds']}s ({report['speedup']}x real time)\n"
+            f"Interventions: {nudges}\n"
+            f"Rules: {report['rule_calls']} calls, {report['rule_cpu_ms']:.0f} ms CPU, {report['rule_queries']} queries"
+        )
+        if report["not_replayed"]:
+            self.stdout.write(self.style.WARNING(f"{report['not_replayed']} posts fell after the end of the activity"))
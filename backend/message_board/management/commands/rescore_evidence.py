@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from message_board.evidence import RESCORE_BATCH_SIZE, EvidenceScorerError, get_scorer, rescore_posts
+from message_board.models import ArchivedPost, Post
+from message_board.room_codes import lookup_room
+from message_board.sharding import room_databases, room_db
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-score the lacks_evidence flag of stored posts with the numpy evidence scorer, "
+        "streaming through them in id order. Safe to interrupt; resume with --after."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", help="Only this room code.")
+        parser.add_argument("--archived", action="store_true", help="Re-score archived posts instead of live ones.")
+        parser.add_argument("--weights", help="Weight file (default: settings.EVIDENCE_WEIGHTS_FILE).")
+        parser.add_argument("--batch-size", type=int, default=RESCORE_BATCH_SIZE)
+        parser.add_argument("--after", type=int, default=0, help="Resume after this post id.")
+        parser.add_argument("--dry-run", action="store_true", help="Count what would change without writing.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        try:
+            scorer = get_scorer(options["weights"])
+        except EvidenceScorerError as e:
+            raise CommandError(str(e))
+
+        queryset = (ArchivedPost if options["archived"] else Post).objects.all()
+        databases = room_databases()
+        if options["room"]:
+            room = lookup_room(options["room"])
+            if room is None:
+                raise CommandError(f"No room {options['room']}")
+            queryset = queryset.filter(room=room)
+            databases = [room_db(room)]
+
+        totals = {"scanned": 0, "flagged": 0, "cleared": 0}
+        last_id = options["after"]
+        started = time.perf_counter()
+        # Shards in id range order, so --after resumes across them too
+        for alias in databases:
+            batches = rescore_posts(
+                queryset.using(alias), scorer, options["batch_size"], options["after"], options["dry_run"]
+            )
+            for batch in batches:
+                for key in totals:
+                    totals[key] += batch[key]
+                last_id = batch["last_id"]
+                self.stdout.write(f"  up to id {last_id}: {batch['flagged']} flagged, {batch['cleared']} cleared")
+        elapsed = time.perf_counter() - started
+
+        verb = "Would flag" if options["dry_run"] else "Flagged"
+        rate = totals["scanned"] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"{totals['scanned']} posts in {elapsed:.2f}s ({rate:.0f} posts/s). "
+            f"{verb} {totals['flagged']}, {'would clear' if options['dry_run'] else 'cleared'} {totals['cleared']}; "
+            f"last id {last_id}"
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from message_board.scheduler import PhaseScheduler
+
+
+class Command(BaseCommand):
+    help = "Fire phase-transition events for every running room at its phase boundaries."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--resync-interval", type=float, default=5.0,
+            help="Seconds between checks for newly started or stopped rooms.",
+        )
+        parser.add_argument("--once", action="store_true", help="Sync, fire whatever is due and exit.")
+
+    def handle(self, *args, **options):
+        scheduler = PhaseScheduler()
+
+        if options["once"]:
+            scheduler.sync()
+            fired = scheduler.fire_due()
+            self.stdout.write(f"Fired {fired} transitions; {len(scheduler)} events queued.")
+            return
+
+        self.stdout.write(f"Phase scheduler running (resync every {options['resync_interval']}s).")
+        try:
+            scheduler.run_forever(resync_interval=options["resync_interval"])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
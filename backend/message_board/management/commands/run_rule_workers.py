@@ -0,0 +1,50 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from message_board.rule_workers import INACTIVITY_TICK_INTERVAL, PostDispatcher, RuleWorkerPool
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate the agent rules in a pool of worker processes, rooms sharded across them by "
+        "consistent hashing of the room code. Use with AGENT_RULES_MODE=workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between checks for new posts.")
+        parser.add_argument(
+            "--tick-interval", type=float, default=INACTIVITY_TICK_INTERVAL,
+            help="Seconds between inactivity checks of running rooms.",
+        )
+        parser.add_argument("--from-id", type=int, default=None, help="Evaluate posts after this id (default: only new ones).")
+        parser.add_argument("--once", action="store_true", help="Dispatch what is pending, wait for the workers and exit.")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be positive")
+
+        pool = RuleWorkerPool(workers=options["workers"])
+        dispatcher = PostDispatcher(pool, after_id=options["from_id"])
+
+        if options["once"]:
+            posts = 0
+            while True:
+                n = dispatcher.dispatch_posts()
+                posts += n
+                if not n:
+                    break
+            ticks = dispatcher.dispatch_ticks()
+            pool.stop()
+            shards = ", ".join(f"{name}: {n}" for name, n in sorted(pool.dispatched.items()))
+            self.stdout.write(f"Evaluated {posts} posts and {ticks} room ticks ({shards or 'nothing to do'}).")
+            return
+
+        self.stdout.write(f"Rule workers running ({len(pool)} processes, posts after id {dispatcher.after_id}).")
+        try:
+            dispatcher.run_forever(poll_interval=options["poll_interval"], tick_interval=options["tick_interval"])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping...")
+        finally:
+            pool.stop()
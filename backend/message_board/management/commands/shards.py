@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max
+
+from message_board.models import Intervention, Post, Room, RoomDirectory, RoomMember
+from message_board.sharding import (
+    SHARD_ID_SPACING,
+    placement_shards,
+    rebuild_directory,
+    reference_drift,
+    reserve_id_range,
+    room_databases,
+    sharding_enabled,
+    sync_reference_tables,
+)
+
+ACTIONS = ["status", "sync", "directory", "reserve"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Inspect and maintain room shards. status: rows per shard and reference table drift; sync: copy users, activities and "
+        "agents to the shards (migrate does this too); directory: rebuild the room code -> shard directory; reserve: move "
+        "each shard's id sequences to the start of its range."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=ACTIONS)
+        parser.add_argument("--database", help="Only this shard (sync, reserve).")
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError("Sharding is off (set ROOM_SHARDS)")
+
+        databases = room_databases()
+        if options["database"]:
+            if options["database"] not in databases:
+                raise CommandError(f"{options['database']} is not a room database: {', '.join(databases)}")
+            databases = [options["database"]]
+
+        if options["action"] == "status":
+            self._status(databases)
+        elif options["action"] == "sync":
+            for alias in databases:
+                if alias == DEFAULT_DB_ALIAS:
+                    continue
+                synced = sync_reference_tables(alias)
+                counts = ", ".join(f"{label} {c['copied']} (-{c['removed']})" for label, c in synced.items())
+                self.stdout.write(f"{alias}: {counts}")
+            self.stdout.write(self.style.SUCCESS("Reference tables in sync."))
+        elif options["action"] == "directory":
+            result = rebuild_directory()
+            self.stdout.write(self.style.SUCCESS(
+                f"Directory rebuilt: {result['added']} added, {result['removed']} removed, "
+                f"{result['corrected']} corrected."
+            ))
+        else:
+            for alias in databases:
+                start = reserve_id_range(alias)
+                self.stdout.write(f"{alias}: ids from {start + 1}")
+            self.stdout.write(self.style.SUCCESS("Id ranges reserved."))
+
+    def _status(self, databases):
+        placed = set(placement_shards())
+        for index, alias in enumerate(room_databases()):
+            if alias not in databases:
+                continue
+            rooms = Room.objects.using(alias)
+            max_id = rooms.aggregate(Max("id"))["id__max"] or 0
+            in_range = max_id // SHARD_ID_SPACING == index or max_id == 0
+            self.stdout.write(
+                f"{alias}{'' if alias in placed else ' (no new rooms)'}: "
+                f"{rooms.count()} rooms, "
+                f"{RoomMember.objects.using(alias).count()} members, "
+                f"{Post.objects.using(alias).count()} posts, "
+                f"{Intervention.objects.using(alias).count()} interventions; "
+                f"directory {RoomDirectory.objects.filter(shard=alias).count()}"
+                + ("" if in_range else self.style.WARNING(f"; room ids outside its range (max {max_id})"))
+            )
+            if alias != DEFAULT_DB_ALIAS:
+                for label, (missing, extra) in reference_drift(alias).items():
+                    self.stdout.write(self.style.WARNING(
+                        f"  {label}: {missing} missing, {extra} not in {DEFAULT_DB_ALIAS}; run `shards sync`"
+                    ))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from message_board.analytics import build_run_snapshot
+from message_board.models import Intervention, Post, Room, RunSnapshot
+from message_board.phases import get_activity_state
+
+
+class Command(BaseCommand):
+    help = "Build analytics snapshots for finished activity runs that don't have one yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", help="Only snapshot runs of this room code.")
+
+    def handle(self, *args, **options):
+        posts = Post.objects.filter(activity_run_id__isnull=False)
+        interventions = Intervention.objects.filter(activity_run_id__isnull=False)
+        if options["room"]:
+            code = options["room"].strip().upper()
+            posts = posts.filter(room__code=code)
+            interventions = interventions.filter(room__code=code)
+
+        runs = set(posts.order_by().values_list("room_id", "activity_run_id").distinct())
+        runs |= set(interventions.order_by().values_list("room_id", "activity_run_id").distinct())
+
+        done = set(RunSnapshot.objects.values_list("activity_run_id", flat=True))
+        rooms = Room.objects.select_related("selected_activity").in_bulk({room_id for room_id, _ in runs})
+
+        created = skipped = 0
+        for room_id, run_id in sorted(runs, key=lambda r: (r[0], str(r[1]))):
+            if run_id in done:
+                continue
+            room = rooms[room_id]
+
+            total_phases = activity = started_at = None
+            if run_id == room.activity_run_id:
+                state = get_activity_state(room)
+                if not state.get("finished"):
+                    # Still live
+                    skipped += 1
+                    continue
+                total_phases = state.get("total_phases")
+                activity = room.selected_activity
+                started_at = room.activity_started_at
+
+            build_run_snapshot(room, run_id, total_phases=total_phases, activity=activity, started_at=started_at)
+            created += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Created {created} snapshots ({skipped} runs still live)."))
@@ -0,0 +1,103 @@
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from message_board.agent_rules import check_all_rules, check_individual_inactivity_rule
+from message_board.models import Intervention, Post, RoomMember
+from message_board.participation import record_posts
+from message_board.room_codes import allocate_room
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire many concurrent rule evaluations at one room, the way parallel posts and polls from "
+        "several workers would, and check each nudge was created only once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=64, help="Concurrent rule evaluations.")
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--keep", action="store_true", help="Keep the generated room and users.")
+
+    def handle(self, *args, **options):
+        total = options["requests"]
+        threads = options["threads"]
+        if total < 1 or threads < 1:
+            raise CommandError("--requests and --threads must be positive")
+
+        tag = uuid.uuid4().hex[:8]
+        users = []
+        for name in ("talker", "quiet-1", "quiet-2"):
+            user = User(username=f"stress-{name}-{tag}", first_name=name)
+            user.set_unusable_password()
+            user.save()
+            users.append(user)
+
+        room = allocate_room(name=f"stress-{tag}", activity_run_id=uuid.uuid4())
+        now = timezone.now()
+        RoomMember.objects.bulk_create([
+            RoomMember(room=room, user=u, last_seen_at=now) for u in users
+        ])
+        # Past the join grace period, so the quiet members are due an inactivity nudge
+        RoomMember.objects.filter(room=room).update(joined_at=now - timedelta(minutes=10))
+
+        # One member does all the talking, without evidence: equity, inactivity and evidence nudges all due.
+        # Every post evaluation below gets a post of its own, as concurrent requests would.
+        posts = Post.objects.bulk_create([
+            Post(room=room, author=users[0], content=f"I just think this is clearly right {i}", phase_index=0,
+                 activity_run_id=room.activity_run_id, lacks_evidence=True)
+            for i in range(max(6, total))
+        ])
+        for post in posts:
+            post.room = room
+        record_posts(posts)
+
+        barrier = threading.Barrier(min(threads, total))
+        errors = []
+
+        def worker(i):
+            try:
+                try:
+                    barrier.wait(timeout=10)
+                except threading.BrokenBarrierError:
+                    pass
+                if i % 2:
+                    check_all_rules(room, posts[i])
+                else:
+                    check_individual_inactivity_rule(room, phase_index=0)
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(worker, range(total)))
+        elapsed = time.perf_counter() - started
+
+        created = Counter(Intervention.objects.filter(room=room).values_list("rule_name", flat=True))
+        duplicates = {rule: n for rule, n in created.items() if n > 1}
+
+        self.stdout.write(f"{total} concurrent evaluations in {elapsed:.2f}s on {threads} threads")
+        for rule, n in sorted(created.items()):
+            self.stdout.write(f"  {rule}: {n}")
+        for error in errors[:5]:
+            self.stdout.write(self.style.WARNING(f"  error: {error}"))
+
+        if not options["keep"]:
+            room.delete()
+            User.objects.filter(id__in=[u.id for u in users]).delete()
+
+        if duplicates:
+            raise CommandError(f"Duplicate interventions: {duplicates}")
+        if not created:
+            raise CommandError("No interventions were created; the scenario did not trigger any rule")
+        self.stdout.write(self.style.SUCCESS("No duplicate interventions."))
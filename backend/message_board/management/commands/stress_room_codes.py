@@ -0,0 +1,66 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from message_board.models import Room
+from message_board.room_codes import ROOM_CODE_LENGTH, allocate_room
+from message_board.sharding import release_codes, room_databases
+
+
+class Command(BaseCommand):
+    help = "Create many rooms concurrently through the room code allocator and check every code is unique."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=20000)
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument(
+            "--code-length", type=int, default=ROOM_CODE_LENGTH,
+            help="Starting code length; use a small value to force collisions.",
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the generated rooms.")
+
+    def handle(self, *args, **options):
+        total = options["rooms"]
+        threads = options["threads"]
+        if total < 1 or threads < 1:
+            raise CommandError("--rooms and --threads must be positive")
+
+        prefix = f"stress-{uuid.uuid4().hex[:8]}"
+
+        def worker(count):
+            try:
+                return [
+                    allocate_room(code_length=options["code_length"], name=prefix).code
+                    for _ in range(count)
+                ]
+            finally:
+                connections.close_all()
+
+        share, extra = divmod(total, threads)
+        counts = [share + (1 if i < extra else 0) for i in range(threads)]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            codes = [code for batch in pool.map(worker, counts) for code in batch]
+        elapsed = time.perf_counter() - started
+
+        stored = sum(Room.objects.using(alias).filter(name=prefix).count() for alias in room_databases())
+        unique = len(set(codes))
+        lengths = sorted({len(code) for code in codes})
+
+        self.stdout.write(
+            f"Created {len(codes)} rooms in {elapsed:.2f}s "
+            f"({len(codes) / elapsed:.0f} rooms/s, {threads} threads, code lengths {lengths})"
+        )
+
+        if not options["keep"]:
+            for alias in room_databases():
+                Room.objects.using(alias).filter(name=prefix).delete()
+            release_codes(codes)
+
+        if unique != len(codes) or stored != len(codes):
+            raise CommandError(f"Expected {len(codes)} unique rooms, got {unique} codes and {stored} rows")
+        self.stdout.write(self.style.SUCCESS("All room codes unique."))
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+
+from . import clock
+from .models import RoomMember
+
+# Write coalescing: at most one RoomMember UPDATE per member (and run/phase) per interval
+MEMBER_POST_TOUCH_INTERVAL = timedelta(seconds=10)
+
+
+def _should_write(key, interval) -> bool:
+    # cache.add only succeeds when the key is absent, so it doubles as a cheap "once per interval" gate.
+    # The window is part of the key so the gate follows the rules' clock, simulated or not.
+    window = int(clock.now().timestamp() // interval.total_seconds())
+    return cache.add(f"{key}:{window}", True, timeout=interval.total_seconds())
+
+
+def touch_member_posted(post):
+    # A move to a new run/phase always gets written, otherwise the inactivity rule would lose track of it
+    key = f"member-posted:{post.room_id}:{post.author_id}:{post.activity_run_id}:{post.phase_index}"
+    if not _should_write(key, MEMBER_POST_TOUCH_INTERVAL):
+        return
+
+    RoomMember.objects.filter(room_id=post.room_id, user_id=post.author_id).update(
+        last_posted_at=post.created_at,
+        last_seen_at=post.created_at,
+        activity_run_id=post.activity_run_id,
+        phase_index=post.phase_index,
+    )
+
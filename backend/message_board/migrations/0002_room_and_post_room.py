@@ -3,11 +3,12 @@ import django.db.models.deletion
 
 
 def assign_default_room(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
     Room = apps.get_model('message_board', 'Room')
     Post = apps.get_model('message_board', 'Post')
 
-    room, _ = Room.objects.get_or_create(code='GLOBAL', defaults={'name': 'Global'})
-    Post.objects.filter(room__isnull=True).update(room=room)
+    room, _ = Room.objects.using(db_alias).get_or_create(code='GLOBAL', defaults={'name': 'Global'})
+    Post.objects.using(db_alias).filter(room__isnull=True).update(room=room)
 
 
 class Migration(migrations.Migration):
@@ -4,10 +4,11 @@ from django.db import migrations
 
 
 def seed_agents(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
     Agent = apps.get_model('message_board', 'Agent')
     
     # Create Facilitator Agent
-    Agent.objects.get_or_create(
+    Agent.objects.using(db_alias).get_or_create(
         name='Facilitator Agent',
         defaults={
             'description': 'Keeps the group on task, prompts quieter members, and summarizes decisions.',
@@ -16,7 +17,7 @@ def seed_agents(apps, schema_editor):
     )
     
     # Create Socratic Agent
-    Agent.objects.get_or_create(
+    Agent.objects.using(db_alias).get_or_create(
         name='Socratic Agent',
         defaults={
             'description': 'Asks clarification questions when reasoning is incomplete or unsupported.',
@@ -26,8 +27,9 @@ def seed_agents(apps, schema_editor):
 
 
 def remove_agents(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
     Agent = apps.get_model('message_board', 'Agent')
-    Agent.objects.filter(name__in=['Facilitator Agent', 'Socratic Agent']).delete()
+    Agent.objects.using(db_alias).filter(name__in=['Facilitator Agent', 'Socratic Agent']).delete()
 
 
 class Migration(migrations.Migration):
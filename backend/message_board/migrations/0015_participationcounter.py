@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def backfill_counters(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Post = apps.get_model('message_board', 'Post')
+    ParticipationCounter = apps.get_model('message_board', 'ParticipationCounter')
+
+    rows = (
+        Post.objects.using(db_alias).order_by()
+        .values('room_id', 'activity_run_id', 'phase_index', 'author_id')
+        .annotate(post_count=Count('id'), last_posted_at=Max('created_at'))
+    )
+    ParticipationCounter.objects.using(db_alias).bulk_create(
+        [
+            ParticipationCounter(
+                room_id=row['room_id'],
+                activity_run_id=row['activity_run_id'],
+                phase_index=row['phase_index'],
+                user_id=row['author_id'],
+                post_count=row['post_count'],
+                last_posted_at=row['last_posted_at'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0014_intervention_activity_run_id_post_activity_run_id_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipationCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_run_id', models.UUIDField(blank=True, null=True)),
+                ('phase_index', models.IntegerField(blank=True, null=True)),
+                ('post_count', models.IntegerField(default=0)),
+                ('last_posted_at', models.DateTimeField(blank=True, null=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participation_counters', to='message_board.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('room', 'activity_run_id', 'phase_index', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_member_activity(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Post = apps.get_model('message_board', 'Post')
+    RoomMember = apps.get_model('message_board', 'RoomMember')
+
+    latest = {}
+    for post in Post.objects.using(db_alias).order_by('created_at').values(
+        'room_id', 'author_id', 'created_at', 'activity_run_id', 'phase_index'
+    ).iterator():
+        latest[(post['room_id'], post['author_id'])] = post
+
+    for (room_id, user_id), post in latest.items():
+        RoomMember.objects.using(db_alias).filter(room_id=room_id, user_id=user_id).update(
+            last_posted_at=post['created_at'],
+            last_seen_at=post['created_at'],
+            activity_run_id=post['activity_run_id'],
+            phase_index=post['phase_index'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0015_participationcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roommember',
+            name='activity_run_id',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roommember',
+            name='last_posted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roommember',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roommember',
+            name='phase_index',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='roommember',
+            index=models.Index(fields=['room', 'last_posted_at'], name='message_boa_room_id_8e7b33_idx'),
+        ),
+        migrations.RunPython(backfill_member_activity, migrations.RunPython.noop),
+    ]
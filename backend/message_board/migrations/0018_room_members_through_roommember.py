@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_memberships(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Room = apps.get_model('message_board', 'Room')
+    RoomMember = apps.get_model('message_board', 'RoomMember')
+
+    existing = set(RoomMember.objects.using(db_alias).values_list('room_id', 'user_id'))
+    RoomMember.objects.using(db_alias).bulk_create(
+        [
+            RoomMember(room_id=room_id, user_id=user_id)
+            for room_id, user_id in Room.members.through.objects.using(db_alias).values_list('room_id', 'user_id').iterator()
+            if (room_id, user_id) not in existing
+        ],
+        batch_size=1000,
+    )
+
+
+def split_memberships(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Room = apps.get_model('message_board', 'Room')
+    RoomMember = apps.get_model('message_board', 'RoomMember')
+
+    Room.members.through.objects.using(db_alias).bulk_create(
+        [
+            Room.members.through(room_id=room_id, user_id=user_id)
+            for room_id, user_id in RoomMember.objects.using(db_alias).values_list('room_id', 'user_id').iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0017_room_created_by'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # Django can't add through= to an existing M2M, so copy the auto table into RoomMember,
+    # drop it, and re-declare members on top of RoomMember.
+    operations = [
+        migrations.RunPython(merge_memberships, split_memberships),
+        migrations.RemoveField(
+            model_name='room',
+            name='members',
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='members',
+            field=models.ManyToManyField(blank=True, related_name='rooms', through='message_board.RoomMember', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0018_room_members_through_roommember'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_run_id', models.UUIDField(unique=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user_ids', models.JSONField(default=list)),
+                ('phase_indices', models.JSONField(default=list)),
+                ('post_counts', models.JSONField(default=list)),
+                ('flagged_counts', models.JSONField(default=list)),
+                ('nudge_counts', models.JSONField(default=list)),
+                ('activity', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='message_board.activity')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='run_snapshots', to='message_board.room')),
+            ],
+        ),
+    ]
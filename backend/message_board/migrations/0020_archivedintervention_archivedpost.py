@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0019_runsnapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedIntervention',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('rule_name', models.CharField(max_length=100)),
+                ('message', models.TextField()),
+                ('explanation', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('phase_index', models.IntegerField(blank=True, null=True)),
+                ('activity_run_id', models.UUIDField(blank=True, db_index=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('agent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_interventions', to='message_board.agent')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_interventions', to='message_board.room')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPost',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('phase_index', models.IntegerField(blank=True, null=True)),
+                ('lacks_evidence', models.BooleanField(default=False)),
+                ('activity_run_id', models.UUIDField(blank=True, db_index=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_posts', to='message_board.room')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0020_archivedintervention_archivedpost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='current_phase_index',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0022_post_client_id_alter_post_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='intervention',
+            name='dedup_key',
+            field=models.CharField(blank=True, max_length=200, null=True, unique=True),
+        ),
+    ]
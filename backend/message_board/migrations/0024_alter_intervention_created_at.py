@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0023_intervention_dedup_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='intervention',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,77 @@
+from django.db import migrations
+
+# Full-text index over Post and ArchivedPost content. The two tables share ids (archiving keeps
+# them), so one index entry per id covers a post wherever it lives.
+#
+# SQLite: an FTS5 table kept in sync by triggers. Deleting a row only drops its entry when the
+# other table doesn't hold the same id, so archiving (insert copy, delete original) keeps it.
+# PostgreSQL: a generated tsvector column with a GIN index on each table.
+
+SQLITE_FTS_TABLE = 'message_board_post_fts'
+POST_TABLES = ('message_board_post', 'message_board_archivedpost')
+SEARCH_COLUMNS = 'content, room_id, activity_run_id, phase_index, author_id'
+
+
+def _sqlite_triggers(table, other):
+    upsert = (
+        f"INSERT OR REPLACE INTO {SQLITE_FTS_TABLE}(rowid, {SEARCH_COLUMNS}) "
+        f"VALUES (new.id, new.content, new.room_id, new.activity_run_id, new.phase_index, new.author_id);"
+    )
+    return [
+        f"CREATE TRIGGER {table}_fts_ai AFTER INSERT ON {table} BEGIN {upsert} END;",
+        f"CREATE TRIGGER {table}_fts_au AFTER UPDATE OF {SEARCH_COLUMNS} ON {table} BEGIN {upsert} END;",
+        (
+            f"CREATE TRIGGER {table}_fts_ad AFTER DELETE ON {table} "
+            f"WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = old.id) "
+            f"BEGIN DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = old.id; END;"
+        ),
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5("
+            "content, room_id UNINDEXED, activity_run_id UNINDEXED, phase_index UNINDEXED, "
+            "author_id UNINDEXED, tokenize='porter unicode61')"
+        )
+        post, archived = POST_TABLES
+        for sql in _sqlite_triggers(post, archived) + _sqlite_triggers(archived, post):
+            schema_editor.execute(sql)
+        for table in POST_TABLES:
+            schema_editor.execute(
+                f"INSERT OR REPLACE INTO {SQLITE_FTS_TABLE}(rowid, {SEARCH_COLUMNS}) "
+                f"SELECT id, {SEARCH_COLUMNS} FROM {table}"
+            )
+    elif vendor == 'postgresql':
+        for table in POST_TABLES:
+            schema_editor.execute(
+                f"ALTER TABLE {table} ADD COLUMN search_vector tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED"
+            )
+            schema_editor.execute(f"CREATE INDEX {table}_search_idx ON {table} USING GIN (search_vector)")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for table in POST_TABLES:
+            for suffix in ('ai', 'au', 'ad'):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}")
+    elif vendor == 'postgresql':
+        for table in POST_TABLES:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+            schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0024_alter_intervention_created_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:10
+
+import django.db.models.functions.comparison
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def merge_duplicate_counters(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    # unique_together let rows with a NULL run or phase repeat; fold each group into one row
+    ParticipationCounter = apps.get_model('message_board', 'ParticipationCounter')
+    groups = (
+        ParticipationCounter.objects.using(db_alias).order_by()
+        .values('room_id', 'activity_run_id', 'phase_index', 'user_id')
+        .annotate(rows=Count('id'), total=Sum('post_count'), latest=Max('last_posted_at'), keep=Max('id'))
+        .filter(rows__gt=1)
+    )
+    for group in list(groups):
+        rows = ParticipationCounter.objects.using(db_alias).filter(
+            room_id=group['room_id'],
+            activity_run_id=group['activity_run_id'],
+            phase_index=group['phase_index'],
+            user_id=group['user_id'],
+        )
+        rows.exclude(id=group['keep']).delete()
+        rows.update(post_count=group['total'], last_posted_at=group['latest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0026_room_directory'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='participationcounter',
+            unique_together=set(),
+        ),
+        migrations.AddIndex(
+            model_name='participationcounter',
+            index=models.Index(fields=['room', 'activity_run_id', 'phase_index', 'user'], name='message_boa_room_id_9bfb50_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_counters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='participationcounter',
+            constraint=models.UniqueConstraint(models.F('room'), django.db.models.functions.comparison.Coalesce('activity_run_id', models.Value(uuid.UUID('00000000-0000-0000-0000-000000000000'), output_field=models.UUIDField())), django.db.models.functions.comparison.Coalesce('phase_index', models.Value(-1)), models.F('user'), name='unique_participation_counter'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+# Full-text search is SQLite (FTS5) only; PostgreSQL databases scan the tables instead.
+# Drops the generated tsvector columns and GIN indexes 0025 added there.
+
+POST_TABLES = ('message_board_post', 'message_board_archivedpost')
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for table in POST_TABLES:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+            schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0027_participationcounter_nulls_not_distinct'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message_board', '0028_drop_postgres_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='intervention',
+            index=models.Index(fields=['created_at'], name='message_boa_created_ae7bb5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_at'], name='message_boa_created_b000d3_idx'),
+        ),
+    ]
@@ -1,8 +1,15 @@
+import uuid
+
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.conf import settings
 
+# Stand-ins for "no run" / "no phase" in ParticipationCounter's unique constraint
+NO_RUN_ID = uuid.UUID(int=0)
+NO_PHASE_INDEX = -1
+
 
 class Room(models.Model):
     code = models.CharField(max_length=12, unique=True)
@@ -15,13 +22,16 @@ class Room(models.Model):
         ("critique", "Critique"),
         ("decide", "Decide"),
     ])
+    # Written by the phase scheduler at each phase boundary; len(phases) once the activity has ended
+    current_phase_index = models.IntegerField(null=True, blank=True)
 
-    members = models.ManyToManyField(User, related_name="rooms", blank=True)
+    members = models.ManyToManyField(User, through="RoomMember", related_name="rooms", blank=True)
 
     selected_activity = models.ForeignKey("Activity", null=True, blank=True, on_delete=models.SET_NULL)
     activity_started_at = models.DateTimeField(null=True, blank=True)
     activity_is_running = models.BooleanField(default=False)
     activity_run_id = models.UUIDField(null=True, blank=True, editable=False)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="created_rooms")
 
 
     def __str__(self):
@@ -31,19 +41,37 @@ class RoomMember(models.Model):
     room = models.ForeignKey("Room", on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     joined_at = models.DateTimeField(auto_now_add=True)
+    last_posted_at = models.DateTimeField(null=True, blank=True)
+    last_seen_at = models.DateTimeField(null=True, blank=True)
+    # run/phase the member last posted in
+    activity_run_id = models.UUIDField(null=True, blank=True)
+    phase_index = models.IntegerField(null=True, blank=True)
 
     class Meta:
         unique_together = ("room", "user")
+        indexes = [
+            models.Index(fields=["room", "last_posted_at"]),
+        ]
 
 class Post(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="posts")
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: batched posts from reconnecting clients keep their (clamped) client timestamp
+    created_at = models.DateTimeField(default=timezone.now)
     phase_index = models.IntegerField(null=True, blank=True)
     lacks_evidence = models.BooleanField(default=False)
     activity_run_id = models.UUIDField(null=True, blank=True, db_index=True)
+    client_id = models.CharField(max_length=64, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Archival looks for runs whose rows are all older than the retention cutoff
+            models.Index(fields=["created_at"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["author", "client_id"], name="unique_post_client_id"),
+        ]
 
     def __str__(self):
         return f'{self.room.code} - {self.author.username}: {self.content[:20]}'
@@ -78,10 +106,17 @@ class Intervention(models.Model):
     rule_name = models.CharField(max_length=100)
     message = models.TextField()
     explanation = models.TextField(blank=True)  
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set by the agent rules from their clock (simulated in replays)
+    created_at = models.DateTimeField(default=timezone.now)
     phase_index = models.IntegerField(null=True, blank=True)
     activity_run_id = models.UUIDField(null=True, blank=True, db_index=True)
+    # room:run:phase:rule:cooldown bucket; the unique index stops two workers nudging twice
+    dedup_key = models.CharField(max_length=200, null=True, blank=True, unique=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"]),
+        ]
     
     def __str__(self):
         return f'{self.agent.name} in {self.room.code}: {self.rule_name}'
@@ -98,4 +133,94 @@ class EvidenceNudgeState(models.Model):
     class Meta:
         unique_together = ("room", "user", "phase_index")
     def __str__(self):
-        return f'EvidenceNudgeState: {self.room.code} - {self.user.username} - Phase {self.phase_index}'
\ No newline at end of file
+        return f'EvidenceNudgeState: {self.room.code} - {self.user.username} - Phase {self.phase_index}'
+
+
+class ParticipationCounter(models.Model):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="participation_counters")
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    activity_run_id = models.UUIDField(null=True, blank=True)
+    phase_index = models.IntegerField(null=True, blank=True)
+    post_count = models.IntegerField(default=0)
+    last_posted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["room", "activity_run_id", "phase_index", "user"]),
+        ]
+        constraints = [
+            # Posts made outside a run or phase have NULLs there, and a plain unique constraint
+            # treats NULLs as distinct; count those together under sentinel values instead
+            models.UniqueConstraint(
+                models.F("room"),
+                Coalesce("activity_run_id", models.Value(NO_RUN_ID, output_field=models.UUIDField())),
+                Coalesce("phase_index", models.Value(NO_PHASE_INDEX)),
+                models.F("user"),
+                name="unique_participation_counter",
+            ),
+        ]
+
+    def __str__(self):
+        return f'ParticipationCounter: {self.room.code} - {self.user.username} - Phase {self.phase_index}: {self.post_count}'
+
+
+class RunSnapshot(models.Model):
+    # Per-run summary stored column-wise: entry i of every list describes one (user, phase) pair
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="run_snapshots")
+    activity = models.ForeignKey(Activity, null=True, blank=True, on_delete=models.SET_NULL)
+    activity_run_id = models.UUIDField(unique=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    user_ids = models.JSONField(default=list)
+    phase_indices = models.JSONField(default=list)
+    post_counts = models.JSONField(default=list)
+    flagged_counts = models.JSONField(default=list)
+    nudge_counts = models.JSONField(default=list)
+
+    def __str__(self):
+        return f'RunSnapshot: {self.room.code} - {self.activity_run_id}'
+
+
+class ArchivedPost(models.Model):
+    # Same primary key as the Post it was moved from
+    id = models.BigIntegerField(primary_key=True)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="archived_posts")
+    author = models.ForeignKey(User, on_delete=models.CASCADE)
+    content = models.TextField()
+    created_at = models.DateTimeField()
+    phase_index = models.IntegerField(null=True, blank=True)
+    lacks_evidence = models.BooleanField(default=False)
+    activity_run_id = models.UUIDField(null=True, blank=True, db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.room.code} - {self.author.username}: {self.content[:20]} (archived)'
+
+
+class ArchivedIntervention(models.Model):
+    # Same primary key as the Intervention it was moved from
+    id = models.BigIntegerField(primary_key=True)
+    agent = models.ForeignKey(Agent, on_delete=models.CASCADE, related_name='archived_interventions')
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='archived_interventions')
+    rule_name = models.CharField(max_length=100)
+    message = models.TextField()
+    explanation = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    phase_index = models.IntegerField(null=True, blank=True)
+    activity_run_id = models.UUIDField(null=True, blank=True, db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.agent.name} in {self.room.code}: {self.rule_name} (archived)'
+
+
+class RoomDirectory(models.Model):
+    # Which database a room lives on, when rooms are sharded (see message_board.sharding).
+    # Always in the default database; its unique code is what keeps codes unique across shards.
+    code = models.CharField(max_length=12, unique=True)
+    shard = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.code} -> {self.shard}'
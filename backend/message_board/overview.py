@@ -0,0 +1,124 @@
+from django.core.cache import cache
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Intervention, ParticipationCounter, Room, RoomMember
+from .phases import get_activity_state
+from .sharding import each_shard
+
+# Facilitators poll this for all their rooms at once; a couple of seconds old is fine
+OVERVIEW_CACHE_SECONDS = 2
+OVERVIEW_MAX_ROOMS = 200
+OVERVIEW_RECENT_INTERVENTIONS = 5
+
+
+def facilitator_room_ids(user):
+    # Rooms the user created, plus rooms they are a member of (rooms from before created_by existed)
+    return Room.objects.filter(Q(created_by=user) | Q(roommember__user=user)).values("id")
+
+
+def facilitator_rooms(user):
+    member_count = (
+        RoomMember.objects.filter(room=OuterRef("pk"))
+        .order_by()
+        .values("room")
+        .annotate(n=Count("id"))
+        .values("n")
+    )
+    return (
+        Room.objects.filter(id__in=facilitator_room_ids(user))
+        .select_related("selected_activity")
+        .annotate(member_count=Subquery(member_count))
+        .order_by("-created_at")
+    )
+
+
+def _posts_by_room(runs):
+    # {room_id: ({phase_index: posts}, last_posted_at)} for each room's current run
+    posts = {}
+    rows = (
+        ParticipationCounter.objects.filter(activity_run_id__in=runs)
+        .order_by()
+        .values("room_id", "phase_index")
+        .annotate(posts=Sum("post_count"), last=Max("last_posted_at"))
+    )
+    for row in rows:
+        per_phase, last = posts.setdefault(row["room_id"], ({}, None))
+        per_phase[row["phase_index"]] = row["posts"]
+        if row["last"] and (last is None or row["last"] > last):
+            posts[row["room_id"]] = (per_phase, row["last"])
+    return posts
+
+
+def _recent_interventions(runs, limit=OVERVIEW_RECENT_INTERVENTIONS):
+    rows = (
+        Intervention.objects.filter(activity_run_id__in=runs)
+        .annotate(rank=Window(RowNumber(), partition_by=F("room_id"), order_by=F("created_at").desc()))
+        .filter(rank__lte=limit)
+        .values("id", "room_id", "rule_name", "message", "created_at", "phase_index", "agent__name")
+        .order_by("room_id", "-created_at")
+    )
+    recent = {}
+    for row in rows:
+        recent.setdefault(row["room_id"], []).append({
+            "id": row["id"],
+            "author": row["agent__name"],
+            "rule_name": row["rule_name"],
+            "content": row["message"],
+            "created_at": row["created_at"].isoformat(),
+            "phase_index": row["phase_index"],
+        })
+    return recent
+
+
+def build_overview(user) -> dict:
+    # Three queries per room database whatever the number of rooms: rooms (with member counts),
+    # post counters, interventions
+    now = timezone.now()
+    rooms, posts, recent = [], {}, {}
+    for _ in each_shard():
+        shard_rooms = list(facilitator_rooms(user)[:OVERVIEW_MAX_ROOMS])
+        runs = [room.activity_run_id for room in shard_rooms if room.activity_run_id]
+        if runs:
+            posts.update(_posts_by_room(runs))
+            recent.update(_recent_interventions(runs))
+        rooms += shard_rooms
+    rooms = sorted(rooms, key=lambda room: room.created_at, reverse=True)[:OVERVIEW_MAX_ROOMS]
+
+    data = []
+    for room in rooms:
+        state = get_activity_state(room, now=now)
+        per_phase, last_posted_at = posts.get(room.id, ({}, None))
+        interventions = recent.get(room.id, [])
+
+        last_activity = last_posted_at.isoformat() if last_posted_at else None
+        if interventions and (last_activity is None or interventions[0]["created_at"] > last_activity):
+            last_activity = interventions[0]["created_at"]
+
+        data.append({
+            "code": room.code,
+            "name": room.name,
+            "members_count": room.member_count or 0,
+            "activity": {
+                "is_running": state.get("is_running", False),
+                "finished": state.get("finished", False),
+                "activity_id": state.get("activity_id"),
+                "activity_name": state.get("activity_name"),
+                "activity_run_id": str(room.activity_run_id) if room.activity_run_id else None,
+                "phase_index": state.get("phase_index"),
+                "phase_name": state.get("phase_name"),
+                "phase_ends_at": state.get("phase_ends_at"),
+                "total_phases": state.get("total_phases"),
+            },
+            "posts_by_phase": {str(phase): n for phase, n in per_phase.items()},
+            "total_posts": sum(per_phase.values()),
+            "last_activity_at": last_activity,
+            "recent_interventions": interventions,
+        })
+
+    return {"generated_at": now.isoformat(), "rooms": data}
+
+
+def cached_overview(user) -> dict:
+    return cache.get_or_set(f"overview:{user.id}", lambda: build_overview(user), OVERVIEW_CACHE_SECONDS)
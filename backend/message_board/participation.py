@@ -0,0 +1,79 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .membership import touch_member_posted
+from .models import ParticipationCounter
+from .sharding import room_db
+
+
+def _counter_filters(room_id, activity_run_id, phase_index, user_id):
+    return {
+        "room_id": room_id,
+        "activity_run_id": activity_run_id,
+        "phase_index": phase_index,
+        "user_id": user_id,
+    }
+
+
+def _bump_counter(filters, n, posted_at):
+    # Atomic "UPDATE ... SET post_count = post_count + n", falling back to an insert for the first post
+    updates = {
+        "post_count": F("post_count") + n,
+        # Backdated batch posts must not move last_posted_at backwards
+        "last_posted_at": Coalesce(Greatest("last_posted_at", Value(posted_at)), Value(posted_at)),
+    }
+
+    if not ParticipationCounter.objects.filter(**filters).update(**updates):
+        try:
+            with transaction.atomic(using=room_db()):
+                ParticipationCounter.objects.create(post_count=n, last_posted_at=posted_at, **filters)
+        except IntegrityError:
+            # Another request inserted the row first
+            ParticipationCounter.objects.filter(**filters).update(**updates)
+
+
+def record_post(post):
+    filters = _counter_filters(post.room_id, post.activity_run_id, post.phase_index, post.author_id)
+    _bump_counter(filters, 1, post.created_at)
+    touch_member_posted(post)
+
+
+def record_posts(posts):
+    # One counter update per (room, run, phase, author) instead of one per post
+    groups = {}
+    for post in posts:
+        key = (post.room_id, post.activity_run_id, post.phase_index, post.author_id)
+        group = groups.setdefault(key, [0, post])
+        group[0] += 1
+        if post.created_at > group[1].created_at:
+            group[1] = post
+
+    for key, (n, latest) in groups.items():
+        _bump_counter(_counter_filters(*key), n, latest.created_at)
+        touch_member_posted(latest)
+
+
+def phase_counters(room, phase_index):
+    return ParticipationCounter.objects.filter(
+        room=room,
+        activity_run_id=room.activity_run_id,
+        phase_index=phase_index,
+    )
+
+
+def phase_post_counts(room, phase_index) -> dict:
+    return dict(phase_counters(room, phase_index).values_list("user_id", "post_count"))
+
+
+def run_post_counts(room) -> dict:
+    # {user_id: {phase_index: post_count}} for the room's current run
+    counts = {}
+    rows = ParticipationCounter.objects.filter(
+        room=room,
+        activity_run_id=room.activity_run_id,
+    ).values_list("user_id", "phase_index", "post_count")
+
+    for user_id, phase_index, post_count in rows:
+        counts.setdefault(user_id, {})[phase_index] = post_count
+    return counts
@@ -0,0 +1,79 @@
+from collections import namedtuple
+
+from django.utils import timezone
+
+from . import clock
+
+PhaseSlot = namedtuple("PhaseSlot", ["index", "name", "prompt", "starts_after", "ends_after"])
+
+SCHEDULE_CACHE_SIZE = 1000
+
+
+def compile_schedule(phases) -> list:
+    # Phase offsets in seconds from the activity start
+    schedule = []
+    t = 0
+    for idx, ph in enumerate(phases or []):
+        mins = ph.get("time_limit_minutes") or 0
+        duration = mins * 60
+        schedule.append(PhaseSlot(idx, ph.get("name"), ph.get("prompt"), t, t + duration))
+        t += duration
+    return schedule
+
+
+# activity id -> (phases, schedule). Hits are checked against the phases the caller loaded, so an
+# activity edited by another process is recompiled rather than served stale.
+_schedules = {}
+
+
+def activity_schedule(activity) -> list:
+    cached = _schedules.get(activity.pk)
+    if cached is not None and cached[0] == activity.phases:
+        return cached[1]
+    schedule = compile_schedule(activity.phases)
+    if len(_schedules) >= SCHEDULE_CACHE_SIZE:
+        _schedules.clear()
+    _schedules[activity.pk] = (activity.phases, schedule)
+    return schedule
+
+
+def get_activity_state(room, now=None):
+    if not getattr(room, "selected_activity", None) or not getattr(room, "activity_is_running", False) or not getattr(room, "activity_started_at", None):
+        return {
+            "is_running": False,
+            "finished": False,
+            "activity_id": room.selected_activity.id if getattr(room, "selected_activity", None) else None,
+            "activity_name": room.selected_activity.name if getattr(room, "selected_activity", None) else None,
+        }
+
+    activity = room.selected_activity
+    schedule = activity_schedule(activity)
+    now = now or clock.now()
+    elapsed = (now - room.activity_started_at).total_seconds()
+
+    for slot in schedule:
+        if elapsed < slot.ends_after:
+            phase_ends_at = room.activity_started_at + timezone.timedelta(seconds=slot.ends_after)
+            return {
+                "is_running": True,
+                "finished": False,
+                "activity_id": activity.id,
+                "activity_name": activity.name,
+                "phase_index": slot.index,
+                "phase_name": slot.name,
+                "phase_prompt": slot.prompt,
+                "phase_ends_at": phase_ends_at.isoformat(),
+                "total_phases": len(schedule),
+            }
+
+    return {
+        "is_running": True,
+        "finished": True,
+        "activity_id": activity.id,
+        "activity_name": activity.name,
+        "phase_index": len(schedule) - 1 if schedule else 0,
+        "phase_name": schedule[-1].name if schedule else None,
+        "phase_prompt": schedule[-1].prompt if schedule else None,
+        "phase_ends_at": None,
+        "total_phases": len(schedule),
+    }
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .models import RoomMember
+
+logger = logging.getLogger(__name__)
+
+# Heartbeats within the window count as online, up to the TTL as idle, after that the member has left
+PRESENCE_ONLINE_WINDOW = timedelta(seconds=15)
+PRESENCE_TTL = timedelta(seconds=60)
+
+# Pending last_seen_at values are written to RoomMember at most this often
+PRESENCE_FLUSH_INTERVAL = timedelta(seconds=5)
+
+ONLINE = "online"
+IDLE = "idle"
+
+
+class PresenceStore:
+    def __init__(self, background_flush=False):
+        self._lock = threading.Lock()
+        self._rooms = {}      # room_id -> {user_id: {"name", "last_seen_at", "idle"}}
+        self._pending = {}    # (room_id, user_id) -> last_seen_at, not yet flushed
+        self._last_flush = None
+        # Without it, pending heartbeats are only written by the next heartbeat this process handles
+        self._background_flush = background_flush
+        self._flusher = None
+
+    def heartbeat(self, room, user, idle=False, now=None):
+        now = now or timezone.now()
+        with self._lock:
+            self._rooms.setdefault(room.id, {})[user.id] = {
+                "name": user.first_name or user.username,
+                "last_seen_at": now,
+                "idle": idle,
+            }
+            self._pending[(room.id, user.id)] = now
+        self.flush(now=now)
+        if self._background_flush:
+            self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._run_flusher, name="presence-flush", daemon=True)
+                self._flusher.start()
+
+    def _run_flusher(self):
+        # A member's last heartbeat before a quiet spell reaches the DB even if this process gets no more
+        while True:
+            time.sleep(PRESENCE_FLUSH_INTERVAL.total_seconds())
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Presence flush failed")
+
+    def status(self, entry, now):
+        age = now - entry["last_seen_at"]
+        if age > PRESENCE_TTL:
+            return None
+        if entry["idle"] or age > PRESENCE_ONLINE_WINDOW:
+            return IDLE
+        return ONLINE
+
+    def members(self, room, now=None) -> dict:
+        # {user_id: entry} for members this process has seen within the TTL; expired entries are dropped
+        now = now or timezone.now()
+        with self._lock:
+            entries = self._rooms.get(room.id, {})
+            for user_id in [uid for uid, e in entries.items() if self.status(e, now) is None]:
+                del entries[user_id]
+            if not entries:
+                self._rooms.pop(room.id, None)
+            return {uid: dict(e) for uid, e in entries.items()}
+
+    def flush(self, now=None, force=False):
+        now = now or timezone.now()
+        with self._lock:
+            due = self._last_flush is None or now - self._last_flush >= PRESENCE_FLUSH_INTERVAL
+            if not self._pending or not (due or force):
+                return 0
+            pending, self._pending = self._pending, {}
+            self._last_flush = now
+
+        by_room = {}
+        for (room_id, user_id), seen_at in pending.items():
+            by_room.setdefault(room_id, {})[user_id] = seen_at
+
+        # One UPDATE per room, with a CASE giving each member their own timestamp
+        for room_id, seen in by_room.items():
+            RoomMember.objects.filter(room_id=room_id, user_id__in=seen.keys()).update(
+                last_seen_at=Case(
+                    *[When(user_id=uid, then=Value(ts)) for uid, ts in seen.items()],
+                    output_field=DateTimeField(),
+                )
+            )
+        return len(pending)
+
+
+presence = PresenceStore(background_flush=True)
+
+
+def online_members(room) -> list:
+    now = timezone.now()
+    local = presence.members(room, now=now)
+
+    # Other workers' heartbeats only reach us through the flushed last_seen_at
+    flushed = RoomMember.objects.filter(
+        room=room,
+        last_seen_at__gte=now - PRESENCE_TTL,
+    ).select_related("user")
+
+    data = {}
+    for m in flushed:
+        entry = {"name": m.user.first_name or m.user.username, "last_seen_at": m.last_seen_at, "idle": False}
+        data[m.user_id] = entry
+    for user_id, entry in local.items():
+        if user_id not in data or entry["last_seen_at"] >= data[user_id]["last_seen_at"]:
+            data[user_id] = entry
+
+    result = []
+    for user_id, entry in data.items():
+        status = presence.status(entry, now)
+        if status is None:
+            continue
+        result.append({
+            "id": user_id,
+            "name": entry["name"],
+            "status": status,
+            "last_seen_at": entry["last_seen_at"].isoformat(),
+        })
+    result.sort(key=lambda m: m["name"])
+    return result
@@ -0,0 +1,119 @@
+from contextlib import ExitStack
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from .models import Room, RoomMember
+from .room_codes import ROOM_CODE_LENGTH, generate_room_code
+from .sharding import claim_codes, taken_codes
+
+MAX_BULK_ROOMS = 500
+ROOM_NAME_MAX_LENGTH = Room._meta.get_field("name").max_length
+BULK_CODE_ATTEMPTS = 5
+
+
+class ProvisioningError(Exception):
+    pass
+
+
+def resolve_members(refs) -> dict:
+    # Map each reference (user id or username) to a user id, in two queries
+    ids = {r for r in refs if isinstance(r, int)}
+    names = {r for r in refs if isinstance(r, str)}
+
+    resolved = {}
+    if ids:
+        resolved.update({uid: uid for uid in User.objects.filter(id__in=ids).values_list("id", flat=True)})
+    if names:
+        resolved.update(dict(User.objects.filter(username__in=names).values_list("username", "id")))
+
+    missing = [r for r in refs if r not in resolved]
+    if missing:
+        raise ProvisioningError(f"Unknown members: {', '.join(str(m) for m in missing[:10])}")
+    return resolved
+
+
+def _free_codes(count) -> list:
+    codes = set()
+    while len(codes) < count:
+        codes.add(generate_room_code(ROOM_CODE_LENGTH))
+    taken = taken_codes(codes)
+    codes -= taken
+    while len(codes) < count:
+        code = generate_room_code(ROOM_CODE_LENGTH)
+        if code not in taken:
+            codes.add(code)
+    return list(codes)
+
+
+def provision_rooms(specs, creator=None, activity=None, join_creator=False) -> list:
+    # specs: [{"name": str, "members": [user id or username, ...]}, ...]
+    if not specs:
+        raise ProvisioningError("No rooms requested")
+    if len(specs) > MAX_BULK_ROOMS:
+        raise ProvisioningError(f"At most {MAX_BULK_ROOMS} rooms can be provisioned at once")
+
+    refs = [ref for spec in specs for ref in spec.get("members") or []]
+    user_ids = resolve_members(refs) if refs else {}
+
+    with transaction.atomic():
+        for _ in range(BULK_CODE_ATTEMPTS):
+            codes = _free_codes(len(specs))
+            try:
+                # Savepoint so a code taken by a concurrent request only retries this step
+                with transaction.atomic():
+                    placement = claim_codes(codes)
+                    by_shard = {}
+                    for code, spec in zip(codes, specs):
+                        by_shard.setdefault(placement[code], []).append(Room(
+                            code=code,
+                            name=spec["name"],
+                            created_by=creator,
+                            selected_activity=activity,
+                        ))
+                    # One transaction per shard, all rolled back if any insert fails
+                    with ExitStack() as shards:
+                        for alias in by_shard:
+                            shards.enter_context(transaction.atomic(using=alias))
+                        for alias, shard_rooms in by_shard.items():
+                            Room.objects.using(alias).bulk_create(shard_rooms)
+                break
+            except IntegrityError:
+                # Retry with fresh codes only if one of these was taken meanwhile
+                if not taken_codes(codes):
+                    raise
+                continue
+        else:
+            raise ProvisioningError("Could not allocate unique room codes")
+
+        # Not every backend hands back primary keys from bulk_create
+        by_code = {}
+        for alias in by_shard:
+            by_code.update(Room.objects.using(alias).in_bulk([c for c in codes if placement[c] == alias], field_name="code"))
+        rooms = [by_code[code] for code in codes]
+
+        pairs = []
+        for room, spec in zip(rooms, specs):
+            members = {user_ids[ref] for ref in spec.get("members") or []}
+            if join_creator and creator is not None:
+                members.add(creator.id)
+            pairs.extend((room, uid) for uid in members)
+
+        for alias in by_shard:
+            with transaction.atomic(using=alias):
+                RoomMember.objects.using(alias).bulk_create(
+                    [RoomMember(room_id=room.id, user_id=uid) for room, uid in pairs if placement[room.code] == alias],
+                    batch_size=1000,
+                )
+
+    counts = {}
+    for room, _ in pairs:
+        counts[room.id] = counts.get(room.id, 0) + 1
+    for room in rooms:
+        room.members_count = counts.get(room.id, 0)
+    return rooms
+
+
+def numbered_specs(count, prefix) -> list:
+    width = len(str(count))
+    return [{"name": f"{prefix} {i:0{width}d}", "members": []} for i in range(1, count + 1)]
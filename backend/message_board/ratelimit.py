@@ -0,0 +1,147 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+# endpoint -> (tokens per second, burst). Override any of them with settings.RATE_LIMITS;
+# None switches the limit off for that endpoint.
+DEFAULT_RATE_LIMITS = {
+    "messages_get": (1.0, 10),        # the client polls every 2s; leaves room for a few tabs
+    "messages_post": (0.5, 10),
+    "messages_batch": (0.2, 5),
+    "room_heartbeat": (0.5, 5),
+    "rooms_overview": (1.0, 10),
+}
+
+MAX_LOCAL_BUCKETS = 50000
+
+
+def rate_limits() -> dict:
+    return {**DEFAULT_RATE_LIMITS, **getattr(settings, "RATE_LIMITS", {})}
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+    def take(self, rate, burst, now):
+        # Returns 0 if a token was taken, otherwise seconds until one is available
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class LocalBuckets:
+    # Per-process buckets; least recently used ones are dropped past max_size (a dropped bucket is full)
+
+    def __init__(self, max_size=MAX_LOCAL_BUCKETS, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(burst, now)
+                if len(self._buckets) > self.max_size:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(rate, burst, now)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    # Buckets in the Django cache, shared between workers when the cache is (e.g. Redis/Memcached).
+    # Read-modify-write without a lock, so concurrent requests can occasionally both get a token.
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+
+    def take(self, key, rate, burst):
+        now = self.clock()
+        cache_key = f"ratelimit:{key}"
+        state = cache.get(cache_key)
+        bucket = TokenBucket(*state) if state else TokenBucket(burst, now)
+        wait = bucket.take(rate, burst, now)
+        # Expire once the bucket would have refilled anyway
+        cache.set(cache_key, (bucket.tokens, bucket.updated), timeout=math.ceil(burst / rate) + 1)
+        return wait
+
+    def clear(self):
+        pass
+
+
+rejections = Counter()
+_local = LocalBuckets()
+_shared = CacheBuckets()
+
+
+def _buckets():
+    if getattr(settings, "RATE_LIMIT_BACKEND", "local") == "cache":
+        return _shared
+    return _local
+
+
+def clear_buckets():
+    # Refills every bucket of this process; shared ones expire on their own
+    _local.clear()
+
+
+def _client_key(request):
+    if request.user.is_authenticated:
+        return f"u{request.user.id}"
+    return f"ip{request.META.get('REMOTE_ADDR', '')}"
+
+
+def rate_limit(request, endpoint, room=None):
+    # None if the request may go ahead, otherwise a 429 response to return.
+    # Buckets are per user (or IP) and room, so one noisy client only throttles itself.
+    limit = rate_limits().get(endpoint)
+    if not limit:
+        return None
+
+    rate, burst = limit
+    key = f"{endpoint}:{_client_key(request)}:{room.id if room is not None else '-'}"
+    wait = _buckets().take(key, rate, burst)
+    if not wait:
+        return None
+
+    rejections[endpoint] += 1
+    if rejections[endpoint] % 100 == 1:
+        logger.warning("Rate limit hit on %s (%d rejections so far), key %s", endpoint, rejections[endpoint], key)
+
+    retry_after = max(1, math.ceil(wait))
+    response = JsonResponse({"detail": "Too many requests", "retry_after": retry_after}, status=429)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def rejection_stats() -> dict:
+    return {
+        "backend": getattr(settings, "RATE_LIMIT_BACKEND", "local"),
+        "limits": {
+            endpoint: {"rate": limit[0], "burst": limit[1]} if limit else None
+            for endpoint, limit in rate_limits().items()
+        },
+        "rejections": dict(rejections),
+    }
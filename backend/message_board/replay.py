@@ -0,0 +1,300 @@
+import random
+import time
+import uuid
+from collections import Counter, namedtuple
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+
+from . import agent_rules
+from .agent_rules import check_all_rules, check_individual_inactivity_rule, rule_limits
+from .archival import run_posts
+from .clock import SimulatedClock, use_clock
+from .evidence import lacks_evidence
+from .fragments import clear_fragments
+from .models import Activity, Intervention, Post, RoomMember, RunSnapshot
+from .participation import record_post
+from .phases import compile_schedule, get_activity_state
+from .presence import PresenceStore
+from .room_codes import allocate_room
+from .scheduler import PhaseScheduler
+from .sharding import reserve_id_range, room_databases, room_db
+
+# Fixed start so cooldown buckets, and so the whole report, are the same on every run
+REPLAY_START = datetime(2025, 1, 6, 9, 0, tzinfo=dt_timezone.utc)
+# Members poll as often as the client does; each poll runs the inactivity rule
+REPLAY_POLL_INTERVAL = timedelta(seconds=2)
+
+# A class of four 15 minute phases, for synthetic runs without an activity
+DEFAULT_PHASES = [
+    {"name": name, "prompt": "", "time_limit_minutes": 15}
+    for name in ("understand", "propose", "critique", "decide")
+]
+
+ReplayEvent = namedtuple("ReplayEvent", ["offset", "member", "content"])
+
+_CLAIMS = [
+    "I think we should just go with the simpler option here",
+    "Honestly the second approach feels much cleaner to me",
+    "That idea is not going to work for the whole group",
+    "We should definitely pick the first one and move on",
+]
+_SUPPORTED = [
+    "Option {n} is better because it needs fewer steps",
+    "The data from last week shows {n} fewer errors with it",
+    "For example, the {n} cases we tried all passed",
+    "According to the notes it took {n} minutes less",
+]
+
+
+class ReplayError(Exception):
+    pass
+
+
+def synthetic_script(members=5, minutes=60, posts_per_minute=3.0, evidence_share=0.5, seed=0) -> list:
+    # Poisson posting with uneven (Pareto) activity per member, fully determined by the seed
+    rng = random.Random(seed)
+    weights = [rng.paretovariate(1.5) for _ in range(members)]
+    total_weight = sum(weights)
+    duration = minutes * 60
+
+    events = []
+    for member, weight in enumerate(weights):
+        rate = posts_per_minute * weight / total_weight / 60
+        t = rng.expovariate(rate)
+        while t < duration:
+            if rng.random() < evidence_share:
+                content = rng.choice(_SUPPORTED).format(n=rng.randint(2, 40))
+            else:
+                content = rng.choice(_CLAIMS)
+            events.append(ReplayEvent(t, member, content))
+            t += rng.expovariate(rate)
+    return sorted(events)
+
+
+def recorded_script(room, run_id):
+    # (events, member count, phases) of a past run, from the hot and archive tables
+    posts = run_posts(room, run_id, all_phases=True)
+    if not posts:
+        raise ReplayError(f"Run {run_id} of room {room.code} has no posts")
+
+    snapshot = RunSnapshot.objects.filter(activity_run_id=run_id).select_related("activity").first()
+    activity = (snapshot.activity if snapshot else None) or room.selected_activity
+    if snapshot and snapshot.started_at:
+        started_at = snapshot.started_at
+    elif room.activity_run_id == run_id and room.activity_started_at:
+        started_at = room.activity_started_at
+    else:
+        started_at = posts[0].created_at
+
+    members = {}
+    for user_id in (snapshot.user_ids if snapshot else []):
+        members.setdefault(user_id, len(members))
+    events = []
+    for post in posts:
+        member = members.setdefault(post.author_id, len(members))
+        events.append(ReplayEvent(max(0.0, (post.created_at - started_at).total_seconds()), member, post.content))
+    return sorted(events), len(members), (activity.phases if activity else DEFAULT_PHASES)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class _RuleMeter:
+    # CPU time and queries spent in the agent rules, per simulated minute
+    def __init__(self, queries):
+        self.queries = queries
+        self.minutes = {}
+
+    def measure(self, minute, fn, *args, **kwargs):
+        cpu, q = time.process_time(), self.queries.count
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            row = self.minutes.setdefault(minute, {"rule_calls": 0, "rule_cpu_ms": 0.0, "rule_queries": 0})
+            row["rule_calls"] += 1
+            row["rule_cpu_ms"] += (time.process_time() - cpu) * 1000
+            row["rule_queries"] += self.queries.count - q
+
+
+@contextmanager
+def scratch_databases():
+    # Points this thread's connections at fresh in-memory SQLite databases with the current
+    # schema, so the replay neither writes to nor locks the real ones. Other threads keep theirs.
+    # Only the databases rooms live in: nothing the replay does touches any other
+    live = {alias: connections[alias] for alias in room_databases()}
+    scratch = {}
+    try:
+        for alias in live:
+            conn = SQLiteDatabaseWrapper({
+                **connections.settings[alias],
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": ":memory:",
+                "OPTIONS": {},
+            }, alias)
+            scratch[alias] = conn
+            connections[alias] = conn
+            # Not migrate: data migrations would go looking for rows in the live database
+            with conn.schema_editor() as editor:
+                for model in apps.get_models():
+                    if model._meta.managed and not model._meta.proxy:
+                        editor.create_model(model)
+        for alias in room_databases():
+            reserve_id_range(alias)
+        yield
+    finally:
+        for alias, conn in live.items():
+            connections[alias] = conn
+        for conn in scratch.values():
+            conn.close()
+
+
+def replay(events, members, phases=None, poll_interval=REPLAY_POLL_INTERVAL, overrides=None) -> dict:
+    # Runs the script against the real rules on a simulated clock, in scratch in-memory databases
+    # (one per database when rooms are sharded); nothing it writes reaches the real ones.
+    # overrides: RuleLimits fields to change, e.g. {"equity_cooldown": timedelta(minutes=2)}
+    phases = phases or DEFAULT_PHASES
+    schedule = compile_schedule(phases)
+    if not schedule or members < 1:
+        raise ReplayError("Nothing to replay")
+    duration = int(schedule[-1].ends_after)
+    poll_every = max(1, int(poll_interval.total_seconds()))
+
+    clock = SimulatedClock(REPLAY_START)
+    queries = _QueryCounter()
+    meter = _RuleMeter(queries)
+    posts_per_minute = Counter()
+    try:
+        limits = rule_limits(**(overrides or {}))
+    except ValueError as e:
+        raise ReplayError(str(e))
+    # Agent rows cached from the real database don't exist in the scratch ones
+    agent_rules.forget_agents()
+    wall = time.perf_counter()
+
+    try:
+        with ExitStack() as stack:
+            stack.enter_context(scratch_databases())
+            databases = room_databases()
+            for alias in databases:
+                # Keeps inserts direct: the write buffer's thread would reach the real database
+                stack.enter_context(transaction.atomic(using=alias))
+                stack.enter_context(connections[alias].execute_wrapper(queries))
+            stack.enter_context(use_clock(clock))
+            tag = uuid.uuid4().hex[:8]
+            activity = Activity.objects.create(name=f"Replay {tag}", phases=phases)
+            users = []
+            for i in range(members):
+                user = User(username=f"replay-{tag}-{i}", first_name=f"Member {i + 1}")
+                user.set_unusable_password()
+                user.save()
+                users.append(user)
+
+            room = allocate_room(
+                shard=room_db(),
+                name=f"Replay {tag}",
+                selected_activity=activity,
+                activity_is_running=True,
+                activity_started_at=clock(),
+                activity_run_id=uuid.uuid4(),
+            )
+            RoomMember.objects.bulk_create([RoomMember(room=room, user=u) for u in users])
+            RoomMember.objects.filter(room=room).update(joined_at=clock())
+
+            presence = PresenceStore()
+            scheduler = PhaseScheduler(clock=clock, limits=limits)
+            scheduler.schedule_room(room)
+            pending = list(events)
+            pending.reverse()
+
+            for second in range(duration + 1):
+                now = clock()
+                minute = second // 60
+
+                if meter.measure(minute, scheduler.fire_due):
+                    room.refresh_from_db()
+                state = get_activity_state(room, now=now)
+                if state.get("finished"):
+                    break
+                phase_index = state.get("phase_index")
+
+                while pending and pending[-1].offset <= second:
+                    event = pending.pop()
+                    if event.member >= members:
+                        continue
+                    author = users[event.member]
+                    post = Post.objects.create(
+                        room=room,
+                        author=author,
+                        content=event.content,
+                        created_at=now,
+                        phase_index=phase_index,
+                        activity_run_id=room.activity_run_id,
+                        lacks_evidence=lacks_evidence(event.content),
+                    )
+                    record_post(post)
+                    presence.heartbeat(room, author, now=now)
+                    posts_per_minute[minute] += 1
+                    meter.measure(minute, check_all_rules, room, post, limits=limits)
+
+                if second % poll_every == 0:
+                    for user in users:
+                        presence.heartbeat(room, user, now=now)
+                        meter.measure(
+                            minute, check_individual_inactivity_rule, room, phase_index=phase_index, limits=limits
+                        )
+
+                clock.advance(timedelta(seconds=1))
+
+            not_replayed = len(pending)
+            interventions = list(
+                Intervention.objects.filter(room=room).values_list("created_at", "rule_name")
+            )
+            for alias in databases:
+                transaction.set_rollback(True, using=alias)
+    finally:
+        # Fragments and agent rows of the scratch databases must not outlive them
+        clear_fragments()
+        agent_rules.forget_agents()
+
+    wall = time.perf_counter() - wall
+
+    nudges_per_minute = {}
+    for created_at, rule_name in interventions:
+        minute = int((created_at - REPLAY_START).total_seconds() // 60)
+        nudges_per_minute.setdefault(minute, Counter())[rule_name.split(":")[0]] += 1
+
+    minutes = []
+    for minute in range(duration // 60 + (1 if duration % 60 else 0)):
+        row = {"minute": minute, "posts": posts_per_minute.get(minute, 0)}
+        row.update(meter.minutes.get(minute, {"rule_calls": 0, "rule_cpu_ms": 0.0, "rule_queries": 0}))
+        row["rule_cpu_ms"] = round(row["rule_cpu_ms"], 2)
+        row["interventions"] = dict(nudges_per_minute.get(minute, {}))
+        minutes.append(row)
+
+    by_rule = Counter(rule_name.split(":")[0] for _, rule_name in interventions)
+    return {
+        "simulated_minutes": duration / 60,
+        "wall_seconds": round(wall, 3),
+        "speedup": round(duration / wall, 1) if wall else None,
+        "members": members,
+        "posts": sum(posts_per_minute.values()),
+        # Events after the end of the last phase
+        "not_replayed": not_replayed,
+        "interventions": dict(by_rule),
+        "rule_calls": sum(m["rule_calls"] for m in minutes),
+        "rule_cpu_ms": round(sum(m["rule_cpu_ms"] for m in minutes), 2),
+        "rule_queries": sum(m["rule_queries"] for m in minutes),
+        "minutes": minutes,
+    }
@@ -0,0 +1,62 @@
+import string
+
+from django.db import IntegrityError, transaction
+from django.utils.crypto import get_random_string
+
+from .models import Room
+from .sharding import activate_shard, claim_codes, release_codes, shard_for_code, taken_codes
+
+ROOM_CODE_CHARS = string.ascii_uppercase + string.digits
+ROOM_CODE_LENGTH = 6
+ROOM_CODE_MAX_LENGTH = Room._meta.get_field("code").max_length
+
+# Collisions on this many inserts in a row make the code one character longer
+ROOM_CODE_ATTEMPTS_PER_LENGTH = 5
+
+
+class RoomCodeExhausted(Exception):
+    pass
+
+
+def generate_room_code(length=ROOM_CODE_LENGTH) -> str:
+    return get_random_string(length, allowed_chars=ROOM_CODE_CHARS)
+
+
+def allocate_room(code_length=ROOM_CODE_LENGTH, shard=None, **fields) -> Room:
+    # No exists() probe: insert and let the unique constraint (the directory's, when sharded)
+    # reject a taken code. shard forces the database instead of picking one from the code.
+    for length in range(code_length, ROOM_CODE_MAX_LENGTH + 1):
+        for _ in range(ROOM_CODE_ATTEMPTS_PER_LENGTH):
+            code = generate_room_code(length)
+            try:
+                alias = claim_codes([code], shard)[code]
+            except IntegrityError:
+                if not taken_codes([code]):
+                    raise
+                continue
+            try:
+                with transaction.atomic(using=alias):
+                    room = Room.objects.using(alias).create(code=code, **fields)
+            except Exception as e:
+                release_codes([code])
+                # Only a taken code is worth another try; anything else (a bad foreign key, a
+                # missing field) would fail the same way for every code
+                if isinstance(e, IntegrityError) and Room.objects.using(alias).filter(code=code).exists():
+                    continue
+                raise
+            activate_shard(alias)
+            return room
+
+    raise RoomCodeExhausted("Could not allocate a unique room code")
+
+
+def lookup_room(code, queryset=None):
+    # One indexed query on the code. Rows aren't cached: the phase and run fields change under
+    # other workers. What is cached is where the code lives (sharding.shard_for_code).
+    qs = queryset if queryset is not None else Room.objects.all()
+    code = (code or "").strip().upper()
+    if not code:
+        return None
+    # Everything else this request does with the room goes to the room's database
+    activate_shard(shard_for_code(code))
+    return qs.filter(code=code).first()
@@ -0,0 +1,278 @@
+import bisect
+import hashlib
+import heapq
+import logging
+import multiprocessing
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Max
+
+from .agent_rules import check_all_rules_for_batch, check_individual_inactivity_rule
+from .models import Post, Room
+from .phases import get_activity_state
+
+logger = logging.getLogger(__name__)
+
+RING_REPLICAS = 64
+# How long a worker trusts its in-memory copy of a room (phase/run changes show up after this)
+ROOM_STATE_TTL = 5.0
+DISPATCH_BATCH_SIZE = 1000
+# Inactivity has no triggering post; running rooms get a tick this often
+INACTIVITY_TICK_INTERVAL = 10.0
+# How long a missing post id is looked for again once higher ones have shown up. Ids are
+# handed out at insert but rows appear at commit (PostgreSQL sequences, write buffer batches),
+# so a lower id can land late; an id that never lands was a rolled-back insert.
+DISPATCH_GAP_TIMEOUT = 60.0
+
+
+def rules_inline() -> bool:
+    # "inline": web requests evaluate the agent rules themselves (the default).
+    # "workers": they only write; run_rule_workers picks new posts up and evaluates them.
+    return getattr(settings, "AGENT_RULES_MODE", "inline") != "workers"
+
+
+class HashRing:
+    # Consistent hashing of room codes onto worker names: adding or removing a worker
+    # only moves the rooms that hash next to it
+
+    def __init__(self, nodes=(), replicas=RING_REPLICAS):
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    @property
+    def nodes(self) -> list:
+        return sorted(set(self._nodes.values()))
+
+    def add(self, node):
+        for i in range(self.replicas):
+            key = self._hash(f"{node}#{i}")
+            if key not in self._nodes:
+                bisect.insort(self._keys, key)
+            self._nodes[key] = node
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            key = self._hash(f"{node}#{i}")
+            if self._nodes.get(key) == node:
+                del self._nodes[key]
+                self._keys.remove(key)
+
+    def node_for(self, code):
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, self._hash(code)) % len(self._keys)
+        return self._nodes[self._keys[i]]
+
+
+class RoomWorker:
+    # Evaluates the rules for the rooms of one shard, keeping those rooms in memory
+
+    def __init__(self, name, nodes):
+        self.name = name
+        self.ring = HashRing(nodes)
+        self._rooms = {}   # code -> (Room, loaded_at)
+
+    def room(self, code):
+        cached = self._rooms.get(code)
+        if cached and time.monotonic() - cached[1] < ROOM_STATE_TTL:
+            return cached[0]
+        room = Room.objects.select_related("selected_activity").filter(code=code).first()
+        if room is None:
+            self._rooms.pop(code, None)
+        else:
+            self._rooms[code] = (room, time.monotonic())
+        return room
+
+    def rebalance(self, nodes):
+        # Drop the hot state of rooms that now belong to another worker
+        self.ring = HashRing(nodes)
+        for code in [c for c in self._rooms if self.ring.node_for(c) != self.name]:
+            del self._rooms[code]
+
+    def handle(self, task):
+        kind, code, *args = task
+        room = self.room(code)
+        if room is None:
+            return
+
+        if kind == "posts":
+            posts = list(Post.objects.filter(id__in=args[0], room=room).select_related("author").order_by("id"))
+            for post in posts:
+                post.room = room
+            # Only posts from the run that is current now; earlier ones were for a run that has moved on
+            posts = [p for p in posts if p.activity_run_id == room.activity_run_id]
+            if posts:
+                check_all_rules_for_batch(room, posts)
+
+        elif kind == "tick":
+            state = get_activity_state(room)
+            if state.get("is_running") and not state.get("finished", False):
+                check_individual_inactivity_rule(room, phase_index=state.get("phase_index"))
+
+    def run(self, tasks):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            if task[0] == "ring":
+                self.rebalance(task[1])
+                continue
+            close_old_connections()
+            try:
+                self.handle(task)
+            except Exception:
+                logger.exception("Rule worker %s failed on %r", self.name, task[:2])
+
+
+def _worker_main(name, nodes, tasks):
+    RoomWorker(name, nodes).run(tasks)
+
+
+class RuleWorkerPool:
+    # One process and one local queue per worker. The queues stand in for a real broker; a
+    # multi-node setup would swap them for per-worker streams and keep the ring as is.
+
+    def __init__(self, workers=2):
+        self._context = multiprocessing.get_context("fork")   # children inherit the configured Django
+        self._next_id = 0
+        self._processes = {}   # name -> (Process, Queue)
+        self.ring = HashRing()
+        self.dispatched = defaultdict(int)
+        for _ in range(workers):
+            self.add_worker(broadcast=False)
+        self._broadcast()
+
+    def __len__(self):
+        return len(self._processes)
+
+    def add_worker(self, broadcast=True):
+        name = f"worker-{self._next_id}"
+        self._next_id += 1
+        self.ring.add(name)
+        # Connections must not be shared with the child
+        connections.close_all()
+        tasks = self._context.Queue()
+        process = self._context.Process(target=_worker_main, args=(name, self.ring.nodes, tasks), name=name, daemon=True)
+        process.start()
+        self._processes[name] = (process, tasks)
+        if broadcast:
+            self._broadcast()
+        return name
+
+    def remove_worker(self, name=None):
+        name = name or self.ring.nodes[-1]
+        process, tasks = self._processes.pop(name)
+        self.ring.remove(name)
+        self._broadcast()
+        # Whatever is still queued for it gets evaluated before it exits
+        tasks.put(None)
+        process.join(timeout=30)
+        return name
+
+    def _broadcast(self):
+        nodes = self.ring.nodes
+        for _, tasks in self._processes.values():
+            tasks.put(("ring", nodes))
+
+    def submit(self, code, task):
+        name = self.ring.node_for(code)
+        self._processes[name][1].put(task)
+        self.dispatched[name] += 1
+
+    def replace_dead(self) -> list:
+        # A worker that died leaves the ring (its rooms move on) and a fresh one joins
+        dead = [name for name, (process, _) in self._processes.items() if not process.is_alive()]
+        for name in dead:
+            logger.warning("Rule worker %s exited with %s; replacing it", name, self._processes[name][0].exitcode)
+            self._processes.pop(name)
+            self.ring.remove(name)
+        for _ in dead:
+            self.add_worker(broadcast=False)
+        if dead:
+            self._broadcast()
+        return dead
+
+    def stop(self):
+        for process, tasks in self._processes.values():
+            tasks.put(None)
+        for process, _ in self._processes.values():
+            process.join(timeout=30)
+        self._processes.clear()
+
+
+class PostDispatcher:
+    # Tails the Post table and hands new posts to the pool, grouped by room. after_id is a
+    # low-water mark: every post up to it has been dispatched (or given up on). Posts above it
+    # that were dispatched already are remembered, so ids that commit late are still picked up.
+
+    def __init__(self, pool, after_id=None, gap_timeout=DISPATCH_GAP_TIMEOUT):
+        self.pool = pool
+        if after_id is None:
+            after_id = Post.objects.aggregate(last=Max("id"))["last"] or 0
+        self.after_id = after_id
+        self.gap_timeout = gap_timeout
+        self._dispatched = {}   # id above after_id -> when it was dispatched
+        self._pending = []      # the same ids, as a heap
+        self._last_tick = 0.0
+
+    def dispatch_posts(self) -> int:
+        # Enough rows to get a full batch past the ones already dispatched
+        rows = Post.objects.filter(id__gt=self.after_id).order_by("id").values_list("id", "room__code")
+        now = time.monotonic()
+        by_room = defaultdict(list)
+        count = 0
+        for post_id, code in rows[:DISPATCH_BATCH_SIZE + len(self._dispatched)]:
+            if post_id in self._dispatched:
+                continue
+            if count == DISPATCH_BATCH_SIZE:
+                break
+            by_room[code].append(post_id)
+            self._dispatched[post_id] = now
+            heapq.heappush(self._pending, post_id)
+            count += 1
+        for code, ids in by_room.items():
+            self.pool.submit(code, ("posts", code, ids))
+        self._advance(now)
+        return count
+
+    def _advance(self, now):
+        # Move the low-water mark over the dispatched ids right above it. A missing id stops it
+        # until the post above the gap has waited gap_timeout: then the gap is given up on.
+        while self._pending:
+            post_id = self._pending[0]
+            if post_id != self.after_id + 1 and now - self._dispatched[post_id] < self.gap_timeout:
+                return
+            heapq.heappop(self._pending)
+            del self._dispatched[post_id]
+            self.after_id = post_id
+
+    def dispatch_ticks(self) -> int:
+        codes = list(
+            Room.objects.filter(activity_is_running=True, activity_started_at__isnull=False)
+            .values_list("code", flat=True)
+        )
+        for code in codes:
+            self.pool.submit(code, ("tick", code))
+        return len(codes)
+
+    def run_forever(self, poll_interval=1.0, tick_interval=INACTIVITY_TICK_INTERVAL, stop=None):
+        while stop is None or not stop():
+            close_old_connections()
+            self.pool.replace_dead()
+            while self.dispatch_posts() == DISPATCH_BATCH_SIZE:
+                pass
+            if time.monotonic() - self._last_tick >= tick_interval:
+                self.dispatch_ticks()
+                self._last_tick = time.monotonic()
+            time.sleep(poll_interval)
+
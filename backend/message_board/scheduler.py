@@ -0,0 +1,187 @@
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .agent_rules import check_equity_rule
+from .analytics import build_run_snapshot
+from .models import Room
+from .phases import activity_schedule
+
+logger = logging.getLogger(__name__)
+
+# Sent after a phase boundary has been persisted.
+# Arguments: room, activity_run_id, phase_index, previous_phase_index, finished
+phase_changed = Signal()
+
+# Rooms started within this margin before the last sync are looked at again, in case their
+# transaction committed late
+SYNC_MARGIN = timedelta(seconds=30)
+FULL_SYNC_INTERVAL = timedelta(minutes=1)
+
+
+def _current_phase(name):
+    # Room.current_phase only takes its fixed choices; free-form phase names leave it as it is
+    name = (name or "").strip().lower()
+    for value, label in Room._meta.get_field("current_phase").choices:
+        if name in (value, label.lower()):
+            return value
+    return None
+
+
+class PhaseScheduler:
+    # Min-heap of (fire_at, seq, room_id, run_id, phase_index) for every running room.
+    # phase_index == len(phases) is the end of the activity.
+
+    def __init__(self, clock=timezone.now, limits=None):
+        self.clock = clock
+        self.limits = limits
+        self._heap = []
+        self._seq = itertools.count()
+        self._runs = {}           # room_id -> run_id we have events queued for
+        self._watermark = None    # latest activity_started_at seen
+        self._last_full_sync = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule_room(self, room):
+        schedule = activity_schedule(room.selected_activity)
+        self._runs[room.id] = room.activity_run_id
+        if not schedule:
+            return
+
+        boundaries = [(slot.starts_after, slot.index) for slot in schedule]
+        boundaries.append((schedule[-1].ends_after, len(schedule)))
+
+        now = self.clock()
+        catch_up = None
+        for offset, phase_index in boundaries:
+            fire_at = room.activity_started_at + timedelta(seconds=offset)
+            if fire_at <= now:
+                catch_up = (fire_at, phase_index)
+                continue
+            self._push(fire_at, room.id, room.activity_run_id, phase_index)
+
+        # Fire the boundary we are already past, unless it was persisted before we started
+        if catch_up and catch_up[1] != room.current_phase_index:
+            self._push(catch_up[0], room.id, room.activity_run_id, catch_up[1])
+
+    def _push(self, fire_at, room_id, run_id, phase_index):
+        heapq.heappush(self._heap, (fire_at, next(self._seq), room_id, run_id, phase_index))
+
+    def sync(self):
+        now = self.clock()
+        rooms = Room.objects.filter(
+            activity_is_running=True,
+            selected_activity__isnull=False,
+            activity_started_at__isnull=False,
+        ).select_related("selected_activity")
+
+        full = self._last_full_sync is None or now - self._last_full_sync >= FULL_SYNC_INTERVAL
+        if not full:
+            rooms = rooms.filter(activity_started_at__gte=self._watermark - SYNC_MARGIN)
+
+        seen = set()
+        for room in rooms:
+            seen.add(room.id)
+            if self._watermark is None or room.activity_started_at > self._watermark:
+                self._watermark = room.activity_started_at
+            if self._runs.get(room.id) != room.activity_run_id:
+                self.schedule_room(room)
+
+        if full:
+            # Forget rooms that stopped; their queued events are dropped when they come up
+            for room_id in [rid for rid in self._runs if rid not in seen]:
+                del self._runs[room_id]
+            self._last_full_sync = now
+            if self._watermark is None:
+                self._watermark = now
+
+    def seconds_until_next(self):
+        if not self._heap:
+            return None
+        return max(0.0, (self._heap[0][0] - self.clock()).total_seconds())
+
+    def fire_due(self) -> int:
+        fired = 0
+        now = self.clock()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, room_id, run_id, phase_index = heapq.heappop(self._heap)
+            if self._runs.get(room_id) != run_id:
+                continue
+            try:
+                if self.transition(room_id, run_id, phase_index):
+                    fired += 1
+            except Exception:
+                logger.exception("Phase transition failed for room %s", room_id)
+        return fired
+
+    def transition(self, room_id, run_id, phase_index) -> bool:
+        try:
+            room = Room.objects.select_related("selected_activity").get(pk=room_id)
+        except Room.DoesNotExist:
+            return False
+
+        schedule = activity_schedule(room.selected_activity) if room.selected_activity else []
+        finished = phase_index >= len(schedule)
+        previous = room.current_phase_index
+
+        # Conditional UPDATE: a restarted/stopped run or another scheduler that got here first matches no row
+        updates = {"current_phase_index": phase_index}
+        if not finished:
+            current_phase = _current_phase(schedule[phase_index].name)
+            if current_phase:
+                updates["current_phase"] = current_phase
+        updated = Room.objects.filter(
+            pk=room_id,
+            activity_run_id=run_id,
+            activity_is_running=True,
+        ).exclude(current_phase_index=phase_index).update(**updates)
+        if not updated:
+            return False
+
+        for field, value in updates.items():
+            setattr(room, field, value)
+
+        # End-of-phase rules for the phase that just closed
+        if previous is not None and previous < len(schedule):
+            check_equity_rule(room, phase_index=previous, limits=self.limits)
+
+        if finished:
+            self._runs.pop(room_id, None)
+            # Once per run: only one scheduler gets the end-of-run UPDATE above through
+            build_run_snapshot(
+                room,
+                run_id,
+                total_phases=len(schedule),
+                activity=room.selected_activity,
+                started_at=room.activity_started_at,
+            )
+
+        phase_changed.send(
+            sender=self.__class__,
+            room=room,
+            activity_run_id=run_id,
+            phase_index=None if finished else phase_index,
+            previous_phase_index=previous,
+            finished=finished,
+        )
+        return True
+
+    def run_forever(self, resync_interval=5.0, stop=None):
+        self.sync()
+        last_sync = time.monotonic()
+        while stop is None or not stop():
+            self.fire_due()
+
+            if time.monotonic() - last_sync >= resync_interval:
+                self.sync()
+                last_sync = time.monotonic()
+
+            wait = self.seconds_until_next()
+            time.sleep(resync_interval if wait is None else min(wait, resync_interval))
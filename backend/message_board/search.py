@@ -0,0 +1,260 @@
+import logging
+import re
+import uuid
+
+from django.db import connections
+
+from .models import ArchivedPost, Post
+from .sharding import each_shard, room_databases, room_db, shard_for_id, use_shard
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_SNIPPET_TOKENS = 12
+
+logger = logging.getLogger(__name__)
+
+# Created by migration 0025
+SQLITE_FTS_TABLE = "message_board_post_fts"
+POST_TABLES = ("message_board_post", "message_board_archivedpost")
+SEARCH_COLUMNS = "content, room_id, activity_run_id, phase_index, author_id"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class SearchError(Exception):
+    pass
+
+
+_fts_ready = set()   # aliases of SQLite databases known to have the FTS table and its triggers
+
+
+def _sqlite_triggers(table, other) -> dict:
+    # The triggers of migration 0025, by name
+    upsert = (
+        f"INSERT OR REPLACE INTO {SQLITE_FTS_TABLE}(rowid, {SEARCH_COLUMNS}) "
+        f"VALUES (new.id, new.content, new.room_id, new.activity_run_id, new.phase_index, new.author_id);"
+    )
+    return {
+        f"{table}_fts_ai": f"CREATE TRIGGER {table}_fts_ai AFTER INSERT ON {table} BEGIN {upsert} END;",
+        f"{table}_fts_au": f"CREATE TRIGGER {table}_fts_au AFTER UPDATE OF {SEARCH_COLUMNS} ON {table} BEGIN {upsert} END;",
+        f"{table}_fts_ad": (
+            f"CREATE TRIGGER {table}_fts_ad AFTER DELETE ON {table} "
+            f"WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = old.id) "
+            f"BEGIN DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = old.id; END;"
+        ),
+    }
+
+
+def search_triggers() -> dict:
+    post, archived = POST_TABLES
+    return {**_sqlite_triggers(post, archived), **_sqlite_triggers(archived, post)}
+
+
+def missing_search_triggers(connection) -> list:
+    # Rebuilding a table (SQLite's way of altering most columns) drops the triggers on it
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        present = {name for (name,) in cursor.fetchall()}
+    return [name for name in search_triggers() if name not in present]
+
+
+def search_backend() -> str:
+    # Of the active room database. Only SQLite has a full-text index; elsewhere searches scan.
+    connection = connections[room_db()]
+    if connection.vendor != "sqlite":
+        return "scan"
+    if connection.alias not in _fts_ready:
+        # FTS5 missing from the SQLite build, migrations not run yet, or a stale index
+        if SQLITE_FTS_TABLE not in connection.introspection.table_names():
+            return "scan"
+        missing = missing_search_triggers(connection)
+        if missing:
+            logger.warning("Search triggers %s missing on %s; run rebuild_search_index", ", ".join(missing), connection.alias)
+            return "scan"
+        _fts_ready.add(connection.alias)
+    return "fts5"
+
+
+def _fts5_query(text) -> str:
+    # Each word as a quoted term (implicit AND), the last one as a prefix so partial words match;
+    # FTS5 operators in user input are never interpreted
+    words = _WORD.findall(text)
+    if not words:
+        raise SearchError("q must contain at least one word")
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _filter_sql(filters, run_value):
+    clauses, params = [], []
+    for column in ("room_id", "phase_index", "author_id"):
+        if filters.get(column) is not None:
+            clauses.append(f"{column} = %s")
+            params.append(filters[column])
+    if filters.get("room_id__in") is not None:
+        clauses.append(f"room_id IN ({', '.join(['%s'] * len(filters['room_id__in']))})")
+        params.extend(filters["room_id__in"])
+    if filters.get("activity_run_id") is not None:
+        clauses.append("activity_run_id = %s")
+        params.append(run_value(filters["activity_run_id"]))
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def _search_fts5(text, filters, limit, offset):
+    where, params = _filter_sql(filters, lambda run: run.hex)   # UUIDs are stored as hex on SQLite
+    sql = (
+        f"SELECT rowid, bm25({SQLITE_FTS_TABLE}), "
+        f"snippet({SQLITE_FTS_TABLE}, 0, '[', ']', '…', {SEARCH_SNIPPET_TOKENS}) "
+        f"FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s{where} "
+        f"ORDER BY bm25({SQLITE_FTS_TABLE}), rowid DESC LIMIT %s OFFSET %s"
+    )
+    with connections[room_db()].cursor() as cursor:
+        cursor.execute(sql, [_fts5_query(text), *params, limit, offset])
+        # bm25 is lower-is-better; flip it so every backend returns higher-is-better scores
+        return [(pk, -score, snippet) for pk, score, snippet in cursor.fetchall()]
+
+
+def _search_scan(text, filters, limit, offset):
+    # No full-text index on this backend: a plain scan, newest first
+    words = _WORD.findall(text)
+    if not words:
+        raise SearchError("q must contain at least one word")
+    hits = []
+    for model in (Post, ArchivedPost):
+        qs = model.objects.filter(**{k: v for k, v in filters.items() if v is not None})
+        for word in words:
+            qs = qs.filter(content__icontains=word)
+        hits += qs.values_list("id", "content")[:offset + limit]
+    hits.sort(key=lambda h: -h[0])
+    return [(pk, 0.0, content) for pk, content in hits[offset:offset + limit]]
+
+
+SEARCHERS = {"fts5": _search_fts5, "scan": _search_scan}
+
+
+def search_posts(text, room_id=None, activity_run_id=None, phase_index=None, author_id=None,
+                 page=1, page_size=SEARCH_PAGE_SIZE, room_ids=None) -> dict:
+    # room_ids: only posts of these rooms (None: every room)
+    text = (text or "").strip()
+    if not text:
+        raise SearchError("q is required")
+    if page < 1 or not 1 <= page_size <= SEARCH_MAX_PAGE_SIZE:
+        raise SearchError(f"page must be positive and page_size between 1 and {SEARCH_MAX_PAGE_SIZE}")
+    if activity_run_id is not None and not isinstance(activity_run_id, uuid.UUID):
+        activity_run_id = uuid.UUID(str(activity_run_id))
+
+    filters = {
+        "room_id": room_id,
+        "activity_run_id": activity_run_id,
+        "phase_index": phase_index,
+        "author_id": author_id,
+        "room_id__in": None if room_ids is None else sorted(room_ids),
+    }
+    if room_ids is not None and not room_ids:
+        return {"backend": "none", "page": page, "page_size": page_size, "has_more": False, "results": []}
+    # One extra row tells us whether there is a next page, without counting every match
+    offset, limit = (page - 1) * page_size, page_size + 1
+    databases = [shard_for_id(room_id)] if room_id is not None else room_databases()
+    if len(databases) == 1:
+        with use_shard(databases[0]):
+            backend = search_backend()
+            hits = SEARCHERS[backend](text, filters, limit, offset)
+    else:
+        # Every shard's best offset + limit hits, merged; ids are unique across shards
+        hits, backends = [], set()
+        for _ in each_shard():
+            backend = search_backend()
+            backends.add(backend)
+            hits += SEARCHERS[backend](text, filters, offset + limit, 0)
+        if len(backends) > 1:
+            backend = "mixed"
+        hits = sorted(hits, key=lambda h: (-h[1], -h[0]))[offset:offset + limit]
+    has_more = len(hits) > page_size
+    hits = hits[:page_size]
+
+    posts, archived = {}, {}
+    by_shard = {}
+    for pk, _, _ in hits:
+        by_shard.setdefault(shard_for_id(pk), []).append(pk)
+    for alias, ids in by_shard.items():
+        posts.update(Post.objects.using(alias).select_related("room", "author").in_bulk(ids))
+        archived.update(
+            ArchivedPost.objects.using(alias).select_related("room", "author").in_bulk([pk for pk in ids if pk not in posts])
+        )
+
+    results = []
+    for pk, score, snippet in hits:
+        post = posts.get(pk) or archived.get(pk)
+        if post is None:
+            continue
+        results.append({
+            "id": post.id,
+            "room": post.room.code,
+            "activity_run_id": str(post.activity_run_id) if post.activity_run_id else None,
+            "phase_index": post.phase_index,
+            "author": post.author.first_name or post.author.username,
+            "content": post.content,
+            "snippet": snippet,
+            "created_at": post.created_at.isoformat(),
+            "archived": pk not in posts,
+            "score": round(score, 4),
+        })
+
+    return {"backend": backend, "page": page, "page_size": page_size, "has_more": has_more, "results": results}
+
+
+def rebuild_search_index() -> int:
+    # Re-derives the index of every room database from both tables; returns the number of indexed posts
+    return sum(_rebuild_index() for _ in each_shard())
+
+
+def _rebuild_index() -> int:
+    connection = connections[room_db()]
+    if connection.vendor == "sqlite" and SQLITE_FTS_TABLE in connection.introspection.table_names():
+        restore_search_triggers(connection)
+    backend = search_backend()
+    with connection.cursor() as cursor:
+        if backend == "fts5":
+            cursor.execute(f"DELETE FROM {SQLITE_FTS_TABLE}")
+            for table in POST_TABLES:
+                cursor.execute(
+                    f"INSERT OR REPLACE INTO {SQLITE_FTS_TABLE}(rowid, {SEARCH_COLUMNS}) "
+                    f"SELECT id, {SEARCH_COLUMNS} FROM {table}"
+                )
+            cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute(f"SELECT count(*) FROM {SQLITE_FTS_TABLE}")
+            return cursor.fetchone()[0]
+    return Post.objects.count() + ArchivedPost.objects.count()
+
+
+def restore_search_triggers(connection) -> list:
+    # Recreates the triggers a table rebuild dropped; returns their names
+    missing = missing_search_triggers(connection)
+    triggers = search_triggers()
+    with connection.cursor() as cursor:
+        for name in missing:
+            cursor.execute(triggers[name])
+    return missing
+
+
+def _after_migrate(sender, using, **kwargs):
+    # A migration that rebuilt the post tables took the triggers with it; put them back and
+    # re-index what was written in between
+    connection = connections[using]
+    if connection.vendor != "sqlite" or SQLITE_FTS_TABLE not in connection.introspection.table_names():
+        return
+    if restore_search_triggers(connection):
+        _fts_ready.discard(using)
+        with use_shard(using):
+            _rebuild_index()
+
+
+def connect_signals():
+    from django.apps import apps
+    from django.db.models.signals import post_migrate
+
+    post_migrate.connect(
+        _after_migrate, sender=apps.get_app_config("message_board"),
+        dispatch_uid="message_board.search.after_migrate",
+    )
@@ -0,0 +1,384 @@
+import contextvars
+import copy
+import zlib
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.base import ModelState
+
+# Rooms, and every row that belongs to a room, can be spread over several databases
+# (settings.ROOM_SHARDS). A room's shard is picked from its code when it is created and
+# recorded in RoomDirectory; users, activities and agents stay in the default database and
+# are copied to every shard, so joins and foreign keys keep working inside a shard.
+#
+# Each shard allocates ids from its own range (index * SHARD_ID_SPACING, the default database
+# being index 0), so ids stay unique across shards and a room_id alone says where a row lives.
+SHARD_ID_SPACING = 10 ** 12
+
+SHARDED_MODELS = {
+    "room", "roommember", "post", "intervention", "evidencenudgestate",
+    "participationcounter", "runsnapshot", "archivedpost", "archivedintervention",
+    "room_members",   # the auto-created memberships table, before migration 0018
+}
+REFERENCE_MODELS = {("auth", "user"), ("message_board", "activity"), ("message_board", "agent")}
+
+DIRECTORY_CACHE_SIZE = 50000
+
+_current = contextvars.ContextVar("message_board_shard", default=None)
+
+
+def placement_shards() -> list:
+    # Databases new rooms are placed on; empty means sharding is off
+    return list(getattr(settings, "ROOM_SHARDS", []))
+
+
+def sharding_enabled() -> bool:
+    return bool(placement_shards())
+
+
+def room_databases() -> list:
+    # Every database that can hold rooms, in id range order. Only ever append to ROOM_SHARDS:
+    # a shard's position is its id range.
+    if not sharding_enabled():
+        return [DEFAULT_DB_ALIAS]
+    return [DEFAULT_DB_ALIAS] + [alias for alias in placement_shards() if alias != DEFAULT_DB_ALIAS]
+
+
+def shard_for_id(pk) -> str:
+    aliases = room_databases()
+    index = pk // SHARD_ID_SPACING
+    return aliases[index] if 0 <= index < len(aliases) else DEFAULT_DB_ALIAS
+
+
+def shard_for_new_code(code) -> str:
+    shards = placement_shards()
+    return shards[zlib.crc32(code.encode()) % len(shards)] if shards else DEFAULT_DB_ALIAS
+
+
+def current_shard() -> str:
+    # The database hint-less queries on room data go to: the room being handled in this request
+    # (set by lookup_room/allocate_room), else the process default (ROOM_SHARD, for per-shard daemons)
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    return _current.get() or getattr(settings, "ROOM_SHARD", None) or DEFAULT_DB_ALIAS
+
+
+def room_db(room=None) -> str:
+    if room is not None and sharding_enabled():
+        return room._state.db or (shard_for_id(room.pk) if room.pk else shard_for_new_code(room.code))
+    return current_shard()
+
+
+@contextmanager
+def use_shard(alias):
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def activate_shard(alias):
+    # For the rest of the request; ShardMiddleware clears it
+    _current.set(alias)
+
+
+def each_shard():
+    # Runs the loop body once per room database, with that database active
+    for alias in room_databases():
+        with use_shard(alias):
+            yield alias
+
+
+def across_shards(queryset):
+    # The queryset's rows from every room database, one after another
+    for alias in room_databases():
+        yield from queryset.using(alias)
+
+
+class ShardMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _current.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _current.reset(token)
+
+
+# Directory: room code -> shard. Rooms never move, so entries are cached for good.
+
+_directory = {}
+
+
+def _directory_model():
+    return apps.get_model("message_board", "RoomDirectory")
+
+
+def remember_shard(code, alias):
+    if len(_directory) >= DIRECTORY_CACHE_SIZE:
+        _directory.clear()
+    _directory[code] = alias
+
+
+def shard_for_code(code) -> str:
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    alias = _directory.get(code)
+    if alias is None:
+        alias = _directory_model().objects.filter(code=code).values_list("shard", flat=True).first()
+        if alias is None:
+            # Unknown code: rooms from before sharding live in the default database
+            return DEFAULT_DB_ALIAS
+        remember_shard(code, alias)
+    return alias
+
+
+def taken_codes(codes) -> set:
+    if not sharding_enabled():
+        Room = apps.get_model("message_board", "Room")
+        return set(Room.objects.filter(code__in=codes).values_list("code", flat=True))
+    return set(_directory_model().objects.filter(code__in=codes).values_list("code", flat=True))
+
+
+def claim_codes(codes, shard=None) -> dict:
+    # Reserves the codes in the directory and returns {code: shard}. Raises IntegrityError if any
+    # is taken; with sharding off, the rooms table's own unique constraint does that job.
+    if not sharding_enabled():
+        return {code: DEFAULT_DB_ALIAS for code in codes}
+    RoomDirectory = _directory_model()
+    placement = {code: shard or shard_for_new_code(code) for code in codes}
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        RoomDirectory.objects.bulk_create([RoomDirectory(code=code, shard=alias) for code, alias in placement.items()])
+    return placement
+
+
+def release_codes(codes):
+    if sharding_enabled():
+        codes = list(codes)
+        for i in range(0, len(codes), 1000):
+            _directory_model().objects.filter(code__in=codes[i:i + 1000]).delete()
+        for code in codes:
+            _directory.pop(code, None)
+
+
+def rebuild_directory() -> dict:
+    # Records every room on every shard and drops entries of rooms that are gone
+    RoomDirectory = _directory_model()
+    Room = apps.get_model("message_board", "Room")
+    known = dict(RoomDirectory.objects.values_list("code", "shard"))
+    found = {}
+    for alias in room_databases():
+        for code in Room.objects.using(alias).values_list("code", flat=True).iterator():
+            found[code] = alias
+
+    missing = [RoomDirectory(code=code, shard=alias) for code, alias in found.items() if code not in known]
+    RoomDirectory.objects.bulk_create(missing, batch_size=1000)
+    stale = [code for code, alias in known.items() if found.get(code) != alias]
+    for i in range(0, len(stale), 1000):
+        RoomDirectory.objects.filter(code__in=stale[i:i + 1000]).delete()
+    # A room recorded on the wrong shard gets its entry back, pointing at where it is
+    RoomDirectory.objects.bulk_create(
+        [RoomDirectory(code=code, shard=found[code]) for code in stale if code in found], batch_size=1000
+    )
+    _directory.clear()
+    return {"added": len(missing), "removed": sum(1 for code in stale if code not in found),
+            "corrected": sum(1 for code in stale if code in found)}
+
+
+def _is_sharded(model) -> bool:
+    return model._meta.app_label == "message_board" and model._meta.model_name in SHARDED_MODELS
+
+
+def _is_reference(model) -> bool:
+    return (model._meta.app_label, model._meta.model_name) in REFERENCE_MODELS
+
+
+class RoomShardRouter:
+    # Installed when ROOM_SHARDS is set (see settings)
+
+    def _route(self, model, hints):
+        if _is_reference(model) or model._meta.model_name == "roomdirectory":
+            return DEFAULT_DB_ALIAS
+        if not _is_sharded(model):
+            return None
+        instance = hints.get("instance")
+        if instance is not None and _is_sharded(instance):
+            if instance._state.db:
+                return instance._state.db
+            if isinstance(instance, apps.get_model("message_board", "Room")):
+                return room_db(instance)
+            if getattr(instance, "room_id", None):
+                return shard_for_id(instance.room_id)
+        return current_shard()
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if _is_reference(model) and instance is not None and _is_sharded(instance) and instance._state.db:
+            # Reached from a room's row (room.members, post.author): the shard's copy, so the
+            # query can join that shard's tables
+            return instance._state.db
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Reference rows exist on every shard
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == "message_board" and model_name == "roomdirectory":
+            return db == DEFAULT_DB_ALIAS
+        return None
+
+
+# Reference tables: written to the default database, copied to every shard
+
+def _shard_copies():
+    return [alias for alias in room_databases() if alias != DEFAULT_DB_ALIAS]
+
+
+def _copy_saved(sender, instance, using=None, **kwargs):
+    # Fixtures (loaddata) are copied too. Querysets' update() and bulk_create() send no signals;
+    # reference_drift() spots what they leave behind and sync_reference_tables() repairs it.
+    if using != DEFAULT_DB_ALIAS:
+        return
+    for alias in _shard_copies():
+        row = copy.copy(instance)
+        row._state = ModelState()
+        row.save(using=alias)
+
+
+def _copy_deleted(sender, instance, using=None, **kwargs):
+    if using != DEFAULT_DB_ALIAS:
+        return
+    for alias in _shard_copies():
+        # Cascades to the shard's own rows (a guest's posts, an agent's interventions)
+        sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def sync_reference_tables(alias, batch_size=1000) -> dict:
+    # Brings a shard's copies of users, activities and agents in line with the default database
+    synced = {}
+    for app_label, model_name in sorted(REFERENCE_MODELS):
+        model = apps.get_model(app_label, model_name)
+        fields = [f.name for f in model._meta.concrete_fields if not f.primary_key]
+        unique = [model._meta.pk.name]
+        ids = set()
+        rows = model._base_manager.using(DEFAULT_DB_ALIAS).order_by("pk")
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            ids.add(row.pk)
+            batch.append(row)
+            if len(batch) >= batch_size:
+                model._base_manager.using(alias).bulk_create(
+                    batch, update_conflicts=True, unique_fields=unique, update_fields=fields
+                )
+                batch = []
+        if batch:
+            model._base_manager.using(alias).bulk_create(
+                batch, update_conflicts=True, unique_fields=unique, update_fields=fields
+            )
+        stale = [pk for pk in model._base_manager.using(alias).values_list("pk", flat=True) if pk not in ids]
+        for i in range(0, len(stale), batch_size):
+            model._base_manager.using(alias).filter(pk__in=stale[i:i + batch_size]).delete()
+        synced[model._meta.label] = {"copied": len(ids), "removed": len(stale)}
+    return synced
+
+
+def reference_drift(alias) -> dict:
+    # {model label: (rows missing on the shard, rows only on the shard)} for the reference tables
+    # whose ids differ; rows changed in place by update() look the same here
+    drift = {}
+    for app_label, model_name in sorted(REFERENCE_MODELS):
+        model = apps.get_model(app_label, model_name)
+        expected = set(model._base_manager.using(DEFAULT_DB_ALIAS).values_list("pk", flat=True))
+        found = set(model._base_manager.using(alias).values_list("pk", flat=True))
+        if expected != found:
+            drift[model._meta.label] = (len(expected - found), len(found - expected))
+    return drift
+
+
+def reserve_id_range(alias) -> int:
+    # Moves the shard's id sequences to the start of its range; a no-op when already past it
+    aliases = room_databases()
+    if alias not in aliases or alias == DEFAULT_DB_ALIAS:
+        return 0
+    start = aliases.index(alias) * SHARD_ID_SPACING
+    connection = connections[alias]
+    tables = [
+        model._meta.db_table
+        for model in apps.get_app_config("message_board").get_models()
+        if _is_sharded(model) and model._meta.pk.get_internal_type() in ("AutoField", "BigAutoField")
+    ]
+    with connection.cursor() as cursor:
+        for table in tables:
+            if connection.vendor == "sqlite":
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, start])
+                elif row[0] < start:
+                    cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [start, table])
+            elif connection.vendor == "postgresql":
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, 'id'), %s) "
+                    f"WHERE (SELECT coalesce(max(id), 0) FROM {table}) < %s",
+                    [table, start, start],
+                )
+    return start
+
+
+def _has_reference_tables(alias) -> bool:
+    tables = set(connections[alias].introspection.table_names())
+    return all(apps.get_model(*name)._meta.db_table in tables for name in REFERENCE_MODELS)
+
+
+def _before_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    # Data migrations query without a database; point them at the one being migrated
+    if sharding_enabled():
+        activate_shard(using)
+
+
+def _after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if not sharding_enabled():
+        return
+    if using != DEFAULT_DB_ALIAS and using in room_databases():
+        # Migration 0002 seeds a GLOBAL room in every database it runs on; on a shard that room
+        # has an id from the default database's range, and no business being there
+        start = room_databases().index(using) * SHARD_ID_SPACING
+        apps.get_model("message_board", "Room")._base_manager.using(using).filter(pk__lte=start).delete()
+        # A new shard starts without users, activities and agents, which its rooms point at
+        if _has_reference_tables(DEFAULT_DB_ALIAS):
+            sync_reference_tables(using)
+    if using == DEFAULT_DB_ALIAS:
+        # Rooms from before sharding; their codes must not be handed out again on a shard
+        codes = apps.get_model("message_board", "Room")._base_manager.using(using).values_list("code", flat=True)
+        RoomDirectory = _directory_model()
+        RoomDirectory.objects.bulk_create(
+            [RoomDirectory(code=code, shard=using) for code in codes.iterator()],
+            batch_size=1000, ignore_conflicts=True,
+        )
+        # Rows written by data migrations don't go through the copy signals
+        for alias in _shard_copies():
+            if _has_reference_tables(alias):
+                sync_reference_tables(alias)
+    reserve_id_range(using)
+    activate_shard(None)
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_migrate, post_save, pre_migrate
+
+    for app_label, model_name in REFERENCE_MODELS:
+        model = apps.get_model(app_label, model_name)
+        post_save.connect(_copy_saved, sender=model, dispatch_uid=f"message_board.sharding.copy_saved.{model_name}")
+        post_delete.connect(_copy_deleted, sender=model, dispatch_uid=f"message_board.sharding.copy_deleted.{model_name}")
+    app_config = apps.get_app_config("message_board")
+    pre_migrate.connect(_before_migrate, sender=app_config, dispatch_uid="message_board.sharding.before_migrate")
+    post_migrate.connect(_after_migrate, sender=app_config, dispatch_uid="message_board.sharding.after_migrate")
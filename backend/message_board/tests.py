@@ -0,0 +1,1405 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import gzip
+import importlib.util
+import io
+import json
+import time
+import unittest
+import uuid
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from message_board import (
+    agent_rules, clock, evidence, ratelimit, replay, room_codes, scheduler, search, sharding, warmup,
+    write_buffer,
+)
+from message_board.archival import ARCHIVE_RETENTION, archivable_runs, archive_run
+from message_board.cleanup import GC_INACTIVE_AFTER, abandoned_rooms, active_on_shards, collect, collect_garbage
+from message_board.idempotency import InvalidIdempotencyKey, idempotency_key
+from message_board.ingest import MAX_BACKDATE, MAX_BATCH_POSTS, ingest_posts
+from message_board.membership import MEMBER_POST_TOUCH_INTERVAL, touch_member_posted
+from message_board.models import (
+    Activity, Agent, ArchivedPost, EvidenceNudgeState, Intervention, ParticipationCounter, Post, Room, RoomDirectory,
+    RoomMember, RunSnapshot,
+)
+from message_board.overview import build_overview
+from message_board.participation import phase_post_counts, record_post
+from message_board.presence import PresenceStore
+from message_board.ratelimit import CacheBuckets, LocalBuckets, clear_buckets, rejection_stats
+from message_board.replay import ReplayError, synthetic_script
+from message_board.room_codes import allocate_room, lookup_room
+from message_board.rule_workers import PostDispatcher
+from message_board.scheduler import PhaseScheduler
+from message_board.write_buffer import WriteBuffer, WriteBufferTimeout, insert
+
+
+class ParticipationCounterTests(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(code="PCTEST", name="Counters")
+        self.user = User.objects.create(username="counter-user")
+
+    def test_null_run_and_phase_are_one_counter(self):
+        ParticipationCounter.objects.create(room=self.room, user=self.user, post_count=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ParticipationCounter.objects.create(room=self.room, user=self.user, post_count=1)
+
+    def test_posts_outside_a_run_are_all_counted(self):
+        for _ in range(3):
+            record_post(Post.objects.create(room=self.room, author=self.user, content="hello"))
+
+        self.assertEqual(ParticipationCounter.objects.filter(room=self.room).count(), 1)
+        self.assertEqual(phase_post_counts(self.room, None), {self.user.id: 3})
+
+    def test_post_and_counter_are_written_together(self):
+        RoomMember.objects.create(room=self.room, user=self.user)
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(self.user)
+
+        with mock.patch("message_board.participation._bump_counter", side_effect=DatabaseError("counter lost")):
+            with self.assertRaises(DatabaseError):
+                client.post(f"/api/messages/?room={self.room.code}", json.dumps({"content": "hi"}),
+                            content_type="application/json")
+            with self.assertRaises(DatabaseError):
+                client.post(f"/api/messages/batch/?room={self.room.code}",
+                            json.dumps({"posts": [{"client_id": "a", "content": "hi"}]}),
+                            content_type="application/json")
+
+        self.assertFalse(Post.objects.filter(room=self.room).exists())
+
+
+class RoomCodeTests(TestCase):
+    def test_taken_codes_are_retried(self):
+        Room.objects.create(code="AAAAAA")
+        codes = iter(["AAAAAA", "AAAAAA", "BBBBBB"])
+        with mock.patch.object(room_codes, "generate_room_code", lambda length: next(codes)):
+            room = allocate_room(name="Retry")
+        self.assertEqual(room.code, "BBBBBB")
+
+    def test_other_integrity_errors_are_raised(self):
+        # NOT NULL on name: no other code would do better
+        calls = []
+
+        def generate(length):
+            calls.append(length)
+            return f"C{len(calls):05d}"
+
+        with mock.patch.object(room_codes, "generate_room_code", generate):
+            with self.assertRaises(IntegrityError):
+                allocate_room(name=None)
+        self.assertEqual(len(calls), 1)
+
+    def test_lookup_room(self):
+        room = Room.objects.create(code="LOOKUP")
+        self.assertEqual(lookup_room(" lookup "), room)
+        self.assertIsNone(lookup_room("NOPE42"))
+        self.assertIsNone(lookup_room(""))
+
+
+class ConcurrentRoomCodeTests(TransactionTestCase):
+    def test_concurrent_allocation_gives_unique_codes(self):
+        # Two-character codes: collisions are frequent enough that the retry path runs
+        def worker(count):
+            try:
+                return [allocate_room(code_length=2, name="concurrent").code for _ in range(count)]
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = [code for batch in pool.map(worker, [50] * 8) for code in batch]
+
+        self.assertEqual(len(codes), 400)
+        self.assertEqual(len(set(codes)), 400)
+        self.assertEqual(Room.objects.filter(name="concurrent").count(), 400)
+
+
+class RoomsBulkTests(TestCase):
+    def setUp(self):
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(User.objects.create(username="bulk-facilitator", last_name="facilitator"))
+
+    def post(self, payload):
+        return self.client.post("/api/rooms/bulk/", json.dumps(payload), content_type="application/json")
+
+    def test_creates_rooms(self):
+        response = self.post({"rooms": [{"name": "One", "members": ["bulk-facilitator"]}, {"name": "Two"}]})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Room.objects.filter(name__in=["One", "Two"]).count(), 2)
+
+    def test_members_are_written_to_room_member(self):
+        learner = User.objects.create(username="bulk-learner")
+        response = self.post({"join": True, "rooms": [
+            {"name": "Three", "members": ["bulk-learner", learner.id]},
+            {"name": "Four"},
+        ]})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([r["members_count"] for r in response.json()["rooms"]], [2, 1])
+
+        three = Room.objects.get(name="Three")
+        self.assertEqual(
+            sorted(RoomMember.objects.filter(room=three).values_list("user__username", flat=True)),
+            ["bulk-facilitator", "bulk-learner"],
+        )
+        # Room.members reads the same rows
+        self.assertEqual(sorted(three.members.values_list("username", flat=True)), ["bulk-facilitator", "bulk-learner"])
+
+    def test_rejects_badly_typed_specs(self):
+        rooms = Room.objects.count()
+        for payload in (
+            [],
+            {"rooms": [{"name": 5}]},
+            {"rooms": [{"name": "x" * 101}]},
+            {"rooms": [{"name": "Room", "members": [[1]]}]},
+            {"rooms": [{"name": "Room", "members": [{"id": 1}]}]},
+            {"rooms": [{"name": "Room", "members": [True]}]},
+            {"count": 2, "name_prefix": ["a"]},
+            {"count": 2, "activity_id": "first"},
+        ):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.post(payload).status_code, 400)
+        self.assertEqual(Room.objects.count(), rooms)
+
+
+class RoomMemberMigrationTests(TransactionTestCase):
+    before = [("message_board", "0017_room_created_by")]
+    after = [("message_board", "0018_room_members_through_roommember")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_memberships_survive_the_through_model_migration(self):
+        apps = self.migrate(self.before)
+        OldUser = apps.get_model("auth", "User")
+        OldRoom = apps.get_model("message_board", "Room")
+        OldRoomMember = apps.get_model("message_board", "RoomMember")
+        alice, bob = (OldUser.objects.create(username=name) for name in ("alice", "bob"))
+        room = OldRoom.objects.create(code="MIGR01")
+        seen = timezone.now() - timedelta(minutes=5)
+        # alice is in both tables (with activity data), bob only in the auto M2M table
+        room.members.add(alice, bob)
+        OldRoomMember.objects.create(room=room, user=alice, last_seen_at=seen)
+
+        apps = self.migrate(self.after)
+        NewRoomMember = apps.get_model("message_board", "RoomMember")
+        rows = {m.user.username: m for m in NewRoomMember.objects.filter(room_id=room.id).select_related("user")}
+        self.assertEqual(sorted(rows), ["alice", "bob"])
+        self.assertEqual(rows["alice"].last_seen_at, seen)
+        self.assertEqual(
+            sorted(apps.get_model("message_board", "Room").objects.get(pk=room.pk).members.values_list("username", flat=True)),
+            ["alice", "bob"],
+        )
+
+
+class JsonBodyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="json-user")
+        self.room = Room.objects.create(code="JSONBD")
+        RoomMember.objects.create(room=self.room, user=self.user)
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.user)
+
+    def test_body_must_be_an_object(self):
+        for url in (
+            "/api/temp-login/",
+            "/api/rooms/",
+            f"/api/messages/?room={self.room.code}",
+            f"/api/messages/batch/?room={self.room.code}",
+            f"/api/rooms/{self.room.code}/heartbeat/",
+            f"/api/rooms/{self.room.code}/select-activity/",
+        ):
+            for body in ("[1, 2]", '"text"', "3"):
+                with self.subTest(url=url, body=body):
+                    response = self.client.post(url, body, content_type="application/json")
+                    self.assertEqual(response.status_code, 400, response.content)
+                    self.assertEqual(response.json()["detail"], "Expected a JSON object")
+
+    def test_idempotency_key_needs_an_object(self):
+        request = RequestFactory().post("/api/messages/")
+        with self.assertRaises(InvalidIdempotencyKey):
+            idempotency_key(request, ["client_id"])
+
+
+class ExportFilterTests(TestCase):
+    def setUp(self):
+        self.facilitator = User.objects.create(username="export-facilitator", last_name="facilitator")
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.facilitator)
+
+    def exported_rooms(self, client):
+        response = client.get("/api/export/")
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        return sorted({row["room"] for row in rows})
+
+    def test_facilitators_export_only_their_rooms(self):
+        agent = Agent.objects.create(name="Export Agent")
+        created = Room.objects.create(code="MINE01", created_by=self.facilitator)
+        joined = Room.objects.create(code="MINE02")
+        RoomMember.objects.create(room=joined, user=self.facilitator)
+        other = Room.objects.create(code="OTHER1")
+        stranger = User.objects.create(username="stranger")
+        for room in (created, joined, other):
+            Post.objects.create(room=room, author=stranger, content="hello")
+        Intervention.objects.create(room=other, agent=agent, rule_name="r", message="m")
+        ArchivedPost.objects.create(id=10 ** 6, room=other, author=stranger, content="old", created_at=timezone.now())
+
+        self.assertEqual(self.exported_rooms(self.client), ["MINE01", "MINE02"])
+
+        staff = Client(HTTP_HOST="localhost")
+        staff.force_login(User.objects.create(username="export-staff", is_staff=True))
+        self.assertEqual(self.exported_rooms(staff), ["MINE01", "MINE02", "OTHER1"])
+
+    def test_impossible_dates_are_rejected(self):
+        for url in ("/api/export/", "/api/analytics/runs/"):
+            for query in ("since=2024-13-01T00:00:00", "until=2024-02-30T00:00:00", "since=yesterday"):
+                with self.subTest(url=url, query=query):
+                    response = self.client.get(f"{url}?{query}")
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn("ISO 8601", response.json()["detail"])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.buckets = LocalBuckets(max_size=3, clock=self.clock)
+
+    def test_burst_then_wait_for_next_token(self):
+        waits = [self.buckets.take("a", rate=0.5, burst=3) for _ in range(4)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertAlmostEqual(waits[3], 2.0)
+
+        self.clock.now += 2.0
+        self.assertEqual(self.buckets.take("a", 0.5, 3), 0)
+        self.assertGreater(self.buckets.take("a", 0.5, 3), 0)
+
+    def test_refill_is_capped_at_burst(self):
+        for _ in range(3):
+            self.buckets.take("a", 0.5, 3)
+        self.clock.now += 60
+        self.assertEqual([self.buckets.take("a", 0.5, 3) for _ in range(4)].count(0), 3)
+
+    def test_least_recently_used_bucket_is_dropped_full(self):
+        for _ in range(3):
+            self.buckets.take("a", 0.5, 3)
+        for key in ("b", "c", "d"):
+            self.buckets.take(key, 0.5, 3)
+        # "a" was evicted, so it starts over with a full burst
+        self.assertEqual([self.buckets.take("a", 0.5, 3) for _ in range(3)], [0, 0, 0])
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_cache_buckets(self):
+        cache.clear()
+        buckets = CacheBuckets(clock=self.clock)
+        self.assertEqual([buckets.take("a", 0.5, 2) for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(buckets.take("a", 0.5, 2), 2.0)
+        self.clock.now += 2.0
+        self.assertEqual(buckets.take("a", 0.5, 2), 0)
+
+
+# Slow enough that no token comes back while a test runs
+@override_settings(RATE_LIMITS={"messages_get": (0.001, 2)})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        clear_buckets()
+        self.room = Room.objects.create(code="LIMIT1")
+        self.other_room = Room.objects.create(code="LIMIT2")
+        self.noisy = self.client_for("noisy")
+        self.quiet = self.client_for("quiet")
+
+    def client_for(self, username):
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(User.objects.create(username=username))
+        return client
+
+    def poll(self, client, room=None):
+        return client.get(f"/api/messages/?room={(room or self.room).code}")
+
+    def test_429_with_retry_after_once_the_burst_is_spent(self):
+        before = rejection_stats()["rejections"].get("messages_get", 0)
+        self.assertNotEqual(self.poll(self.noisy).status_code, 429)
+        self.assertNotEqual(self.poll(self.noisy).status_code, 429)
+
+        response = self.poll(self.noisy)
+        self.assertEqual(response.status_code, 429)
+        # One token at 0.001/s is about 1000s away
+        self.assertAlmostEqual(int(response["Retry-After"]), 1000, delta=1)
+        self.assertEqual(response.json()["retry_after"], int(response["Retry-After"]))
+        self.assertEqual(rejection_stats()["rejections"]["messages_get"], before + 1)
+
+    def test_buckets_are_per_user_and_room(self):
+        for _ in range(3):
+            self.poll(self.noisy)
+        self.assertEqual(self.poll(self.noisy).status_code, 429)
+        self.assertNotEqual(self.poll(self.quiet).status_code, 429)
+        self.assertNotEqual(self.poll(self.noisy, self.other_room).status_code, 429)
+
+    @override_settings(RATE_LIMITS={"messages_get": None})
+    def test_none_switches_the_limit_off(self):
+        for _ in range(5):
+            self.assertNotEqual(self.poll(self.noisy).status_code, 429)
+
+    def test_rejections_are_reported(self):
+        for _ in range(3):
+            self.poll(self.noisy)
+        facilitator = Client(HTTP_HOST="localhost")
+        facilitator.force_login(User.objects.create(username="limits", last_name="facilitator"))
+        stats = facilitator.get("/api/rate-limits/").json()
+        self.assertGreaterEqual(stats["rejections"]["messages_get"], 1)
+        self.assertEqual(stats["limits"]["messages_get"], {"rate": 0.001, "burst": 2})
+
+
+class InsertOnceTests(TestCase):
+    def setUp(self):
+        agent_rules.forget_agents()
+        self.room = Room.objects.create(code="ONCE01")
+        self.agent = Agent.objects.create(name="Test Agent")
+
+    def intervention(self, **fields):
+        fields = {"room": self.room, "agent": self.agent, "rule_name": "test", "message": "hi", "dedup_key": "k1", **fields}
+        return Intervention(**fields)
+
+    def test_duplicate_dedup_key_is_skipped(self):
+        self.assertIsNotNone(agent_rules._insert_once(self.intervention()))
+        self.assertIsNone(agent_rules._insert_once(self.intervention()))
+        self.assertEqual(Intervention.objects.filter(dedup_key="k1").count(), 1)
+
+    def test_other_integrity_errors_propagate(self):
+        with self.assertRaises(IntegrityError):
+            agent_rules._insert_once(self.intervention(message=None))
+
+
+class EvidenceNudgeTests(TestCase):
+    def setUp(self):
+        agent_rules.forget_agents()
+        self.room = Room.objects.create(code="EVID01", activity_run_id=uuid.uuid4())
+        self.user = User.objects.create(username="claims")
+        self.clock = clock.SimulatedClock()
+
+    def flag(self, count=1):
+        with clock.use_clock(self.clock):
+            return agent_rules._record_evidence_flags(self.room, self.user, 0, flagged=count)
+
+    def nudges(self):
+        return Intervention.objects.filter(room=self.room, rule_name__startswith="missing_evidence:").count()
+
+    def test_every_nth_flag_is_nudged_within_one_interval(self):
+        results = [self.flag() for _ in range(7)]
+        # The first by time, then the 3rd and 6th by count
+        self.assertEqual(results, [True, False, True, False, False, True, False])
+        self.assertEqual(self.nudges(), 3)
+        self.assertEqual(EvidenceNudgeState.objects.get().flagged_count, 7)
+
+    def test_deduplicated_nudge_does_not_restart_the_interval(self):
+        with mock.patch.object(agent_rules, "_insert_once", return_value=None):
+            self.assertFalse(self.flag())
+        self.assertIsNone(EvidenceNudgeState.objects.get().last_nudged_at)
+
+        # Still due by time, so the next flag gets its nudge
+        self.assertTrue(self.flag())
+        self.assertEqual(EvidenceNudgeState.objects.get().last_nudged_at, self.clock.current)
+
+
+class InactivityPresenceTests(TestCase):
+    def setUp(self):
+        agent_rules.forget_agents()
+        self.room = Room.objects.create(code="QUIET1")
+        self.now = timezone.now()
+        self.members = {}
+        for name in ("present", "unseen", "gone"):
+            user = User.objects.create(username=name)
+            self.members[name] = RoomMember.objects.create(room=self.room, user=user)
+        RoomMember.objects.filter(room=self.room).update(joined_at=self.now - timedelta(minutes=10))
+
+    def nudged(self):
+        with clock.use_clock(lambda: self.now):
+            agent_rules.check_individual_inactivity_rule(self.room)
+        rules = Intervention.objects.filter(room=self.room).values_list("rule_name", flat=True)
+        return {m.user.username for m in self.members.values() if f"individual_inactivity:user={m.user_id}" in rules}
+
+    def test_silent_member_who_is_still_present_is_nudged(self):
+        store = PresenceStore()
+        present, gone = self.members["present"], self.members["gone"]
+        store.heartbeat(self.room, gone.user, now=self.now - timedelta(minutes=5))
+        store.heartbeat(self.room, present.user, now=self.now - timedelta(seconds=25))
+        store.heartbeat(self.room, present.user, now=self.now - timedelta(seconds=22))
+        # The last heartbeat came too soon after the previous flush; the timer writes it
+        self.assertEqual(store.flush(now=self.now - timedelta(seconds=21)), 0)
+        self.assertEqual(store.flush(now=self.now - timedelta(seconds=15)), 1)
+        present.refresh_from_db()
+        self.assertEqual(present.last_seen_at, self.now - timedelta(seconds=22))
+
+        self.assertEqual(self.nudged(), {"present", "unseen"})
+
+
+@override_settings(RATE_LIMITS={"messages_post": None}, AGENT_RULES_MODE="inline")
+class ConcurrentInterventionTests(TransactionTestCase):
+    fixtures = ["activities.json"]
+    requests = 12
+
+    def setUp(self):
+        agent_rules.forget_agents()
+        self.users = {
+            name: User.objects.create(username=name, first_name=name.title(), last_name=role)
+            for name, role in (("alice", "facilitator"), ("bob", ""), ("dan", ""))
+        }
+        self.room = Room.objects.create(code="RACE01", selected_activity=Activity.objects.get(pk=1))
+        RoomMember.objects.bulk_create([RoomMember(room=self.room, user=u) for u in self.users.values()])
+        response = self.client_for("alice").post(f"/api/rooms/{self.room.code}/start-activity/", "{}", content_type="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.room.refresh_from_db()
+
+        # Dan hasn't posted, so the next post's equity check nudges him
+        ParticipationCounter.objects.bulk_create([
+            ParticipationCounter(room=self.room, user=self.users[name], activity_run_id=self.room.activity_run_id,
+                                 phase_index=0, post_count=5)
+            for name in ("alice", "bob")
+        ])
+
+    def tearDown(self):
+        agent_rules.forget_agents()
+
+    def client_for(self, username):
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(self.users[username])
+        return client
+
+    def test_parallel_posts_nudge_once(self):
+        start = threading.Barrier(self.requests)
+
+        def post(i):
+            client = self.client_for("alice")
+            try:
+                start.wait()
+                return client.post(
+                    f"/api/messages/?room={self.room.code}",
+                    json.dumps({"content": f"Merge sort, because it is stable ({i})"}),
+                    content_type="application/json",
+                ).status_code
+            finally:
+                connections.close_all()
+
+        # Every request gets past the _recent() fast path, as racing ones can; only the unique
+        # dedup_key stands between them and a duplicate nudge
+        with mock.patch.object(agent_rules, "_recent", return_value=False):
+            with ThreadPoolExecutor(max_workers=self.requests) as pool:
+                statuses = list(pool.map(post, range(self.requests)))
+
+        self.assertEqual(statuses, [201] * self.requests)
+        nudges = Intervention.objects.filter(
+            room=self.room, rule_name=f"unequal_participation:user={self.users['dan'].id}"
+        )
+        self.assertEqual(nudges.count(), 1)
+
+
+class RecordingPool:
+    def __init__(self):
+        self.post_ids = []
+
+    def submit(self, code, task):
+        self.post_ids.extend(task[2])
+
+
+class PostDispatcherTests(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(code="TAIL01")
+        self.user = User.objects.create(username="tail-user")
+        self.pool = RecordingPool()
+
+    def post(self, **fields):
+        return Post.objects.create(room=self.room, author=self.user, content="hello", **fields)
+
+    def test_late_commit_below_a_dispatched_id_is_dispatched(self):
+        first = self.post()
+        dispatcher = PostDispatcher(self.pool, after_id=first.id)
+        # first.id + 1 is handed out but not committed yet; first.id + 2 commits before it
+        late_id, early = first.id + 1, self.post(id=first.id + 2)
+
+        self.assertEqual(dispatcher.dispatch_posts(), 1)
+        self.assertEqual(dispatcher.after_id, first.id)
+
+        self.post(id=late_id)
+        self.assertEqual(dispatcher.dispatch_posts(), 1)
+        self.assertEqual(self.pool.post_ids, [early.id, late_id])
+        self.assertEqual(dispatcher.after_id, early.id)
+        self.assertEqual(dispatcher.dispatch_posts(), 0)
+
+    def test_gap_is_given_up_after_the_timeout(self):
+        first = self.post()
+        dispatcher = PostDispatcher(self.pool, after_id=first.id, gap_timeout=0)
+        # first.id + 1 was rolled back and never shows up
+        above = self.post(id=first.id + 2)
+        self.assertEqual(dispatcher.dispatch_posts(), 1)
+        self.assertEqual(dispatcher.after_id, above.id)
+        self.assertEqual(self.pool.post_ids, [above.id])
+
+
+class ReplayTests(TransactionTestCase):
+    phases = [{"name": "discuss", "prompt": "", "time_limit_minutes": 6}]
+
+    def setUp(self):
+        self.events = synthetic_script(members=4, minutes=6, posts_per_minute=4.0, seed=1)
+
+    def live_counts(self):
+        return [model.objects.count() for model in (User, Activity, Agent, Room, Post, Intervention)]
+
+    def test_live_database_is_neither_written_nor_locked(self):
+        before = self.live_counts()
+        written = []
+        record_post = replay.record_post
+
+        def record_and_write_live(post):
+            if not written:
+                # Another thread (a request) writing while the replay is under way
+                def write():
+                    try:
+                        written.append(Activity.objects.create(name="Written during the replay"))
+                    finally:
+                        connections.close_all()
+                thread = threading.Thread(target=write)
+                thread.start()
+                thread.join()
+            return record_post(post)
+
+        with mock.patch.object(replay, "record_post", record_and_write_live):
+            report = replay.replay(self.events, 4, self.phases)
+
+        self.assertGreater(report["posts"], 0)
+        self.assertGreater(sum(report["interventions"].values()), 0)
+        self.assertEqual(len(written), 1)
+        written[0].delete()
+        self.assertEqual(self.live_counts(), before)
+
+    def test_overrides_are_parameters(self):
+        default = replay.replay(self.events, 4, self.phases)
+        strict = replay.replay(
+            self.events, 4, self.phases, overrides={"individual_inactivity_threshold": timedelta(seconds=30)}
+        )
+
+        self.assertGreater(
+            strict["interventions"].get("individual_inactivity", 0),
+            default["interventions"].get("individual_inactivity", 0),
+        )
+        self.assertEqual(agent_rules.INDIVIDUAL_INACTIVITY_THRESHOLD, timedelta(minutes=2))
+        with self.assertRaises(ReplayError):
+            replay.replay(self.events, 4, self.phases, overrides={"no_such_limit": 1})
+
+
+@override_settings(WRITE_BUFFER=True, RATE_LIMITS={"messages_post": None}, AGENT_RULES_MODE="inline")
+class WriteBufferTimeoutTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="buffered")
+        self.room = Room.objects.create(code="BUFFER")
+        RoomMember.objects.create(room=self.room, user=self.user)
+        # A buffer whose thread never gets to the queue, as when the database is stuck
+        self.buffer = WriteBuffer()
+        patches = [
+            mock.patch.object(self.buffer, "_ensure_started"),
+            mock.patch.object(write_buffer, "write_buffer", self.buffer),
+            mock.patch.object(write_buffer, "WRITE_BUFFER_TIMEOUT", 0.2),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def post(self, **fields):
+        return Post(room=self.room, author=self.user, content="queued", **fields)
+
+    def drain(self):
+        # What the buffer thread does once it gets going again
+        self.buffer._commit([self.buffer._queue.get_nowait() for _ in range(self.buffer._queue.qsize())])
+
+    def test_queued_row_is_withdrawn(self):
+        with self.assertRaises(WriteBufferTimeout):
+            insert(self.post())
+        self.drain()
+
+        self.assertEqual(self.buffer.stats["cancelled"], 1)
+        self.assertFalse(Post.objects.filter(room=self.room).exists())
+
+    def test_row_already_being_written_is_waited_for(self):
+        inserted = []
+        thread = threading.Thread(target=lambda: inserted.append(insert(self.post())))
+        thread.start()
+        obj, future, _ = self.buffer._queue.get(timeout=5)
+        self.assertTrue(future.set_running_or_notify_cancel())
+        # The caller's timeout passes while the row is in the buffer's transaction
+        thread.join(timeout=0.5)
+        self.assertTrue(thread.is_alive())
+        obj.save(force_insert=True)
+        future.set_result(obj)
+        thread.join(timeout=5)
+
+        self.assertEqual(inserted, [obj])
+        self.assertTrue(Post.objects.filter(pk=obj.pk).exists())
+
+    def test_timeout_is_503_and_the_key_stays_usable(self):
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(self.user)
+
+        def send():
+            return client.post(
+                f"/api/messages/?room={self.room.code}",
+                json.dumps({"content": "Quicksort, because it is in place"}),
+                content_type="application/json",
+                HTTP_IDEMPOTENCY_KEY="retry-me",
+            )
+
+        response = send()
+        self.assertEqual(response.status_code, 503, response.content)
+        self.assertEqual(response["Retry-After"], str(write_buffer.WRITE_BUFFER_RETRY_AFTER))
+        self.drain()
+        self.assertFalse(Post.objects.filter(room=self.room).exists())
+
+        with override_settings(WRITE_BUFFER=False):
+            response = send()
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Post.objects.filter(room=self.room, client_id="retry-me").count(), 1)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.facilitator = User.objects.create(username="search-facilitator", last_name="facilitator")
+        self.mine = Room.objects.create(code="SRCH01")
+        RoomMember.objects.create(room=self.mine, user=self.facilitator)
+        self.other = Room.objects.create(code="SRCH02")
+        for room in (self.mine, self.other):
+            Post.objects.create(room=room, author=self.facilitator, content=f"Merge sort in {room.code}")
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.facilitator)
+        search._fts_ready.clear()
+        self.addCleanup(search._fts_ready.clear)
+
+    def rooms_found(self, client, query="q=merge"):
+        response = client.get(f"/api/search/?{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(hit["room"] for hit in response.json()["results"])
+
+    def test_facilitators_search_only_their_rooms(self):
+        self.assertEqual(self.rooms_found(self.client), ["SRCH01"])
+        response = self.client.get(f"/api/search/?q=merge&room={self.other.code}")
+        self.assertEqual(response.status_code, 404)
+
+        staff = Client(HTTP_HOST="localhost")
+        staff.force_login(User.objects.create(username="search-staff", is_staff=True))
+        self.assertEqual(self.rooms_found(staff), ["SRCH01", "SRCH02"])
+
+    def test_index_triggers_exist(self):
+        self.assertEqual(search.missing_search_triggers(connections["default"]), [])
+        self.assertEqual(search.search_backend(), "fts5")
+
+    def test_triggers_dropped_by_a_table_rebuild_are_restored(self):
+        with connections["default"].cursor() as cursor:
+            cursor.execute("DROP TRIGGER message_board_post_fts_ai")
+        Post.objects.create(room=self.mine, author=self.facilitator, content="Quicksort written meanwhile")
+        # A stale index is not used
+        self.assertEqual(search.search_backend(), "scan")
+
+        search._after_migrate(sender=None, using="default")
+
+        self.assertEqual(search.missing_search_triggers(connections["default"]), [])
+        result = search.search_posts("quicksort")
+        self.assertEqual(result["backend"], "fts5")
+        self.assertEqual([hit["content"] for hit in result["results"]], ["Quicksort written meanwhile"])
+
+
+class RunSnapshotTests(TestCase):
+    def setUp(self):
+        clear_buckets()
+        self.facilitator = User.objects.create(username="snap-facilitator", last_name="facilitator")
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.facilitator)
+        self.now = timezone.now()
+        activity = Activity.objects.create(name="Short", phases=[{"name": "understand", "time_limit_minutes": 1}])
+        self.room = Room.objects.create(
+            code="SNAP01", selected_activity=activity, activity_is_running=True,
+            activity_started_at=self.now - timedelta(minutes=5), activity_run_id=uuid.uuid4(), created_by=self.facilitator,
+        )
+        RoomMember.objects.create(room=self.room, user=self.facilitator)
+        for _ in range(2):
+            Post.objects.create(room=self.room, author=self.facilitator, content="hi", phase_index=0,
+                                activity_run_id=self.room.activity_run_id)
+
+    def test_snapshot_is_taken_at_the_end_of_run_transition_only(self):
+        self.assertEqual(self.client.get(f"/api/rooms/{self.room.code}/").status_code, 200)
+        self.assertEqual(self.client.get(f"/api/messages/?room={self.room.code}").status_code, 200)
+        self.assertFalse(RunSnapshot.objects.exists())
+
+        for _ in range(2):
+            scheduler = PhaseScheduler(clock=lambda: self.now)
+            scheduler.sync()
+            scheduler.fire_due()
+
+        snapshot = RunSnapshot.objects.get()
+        self.assertEqual(snapshot.activity_run_id, self.room.activity_run_id)
+        self.assertEqual(snapshot.post_counts, [2])
+
+    def test_analytics_cover_only_the_facilitators_rooms(self):
+        other = Room.objects.create(code="SNAP02")
+        RunSnapshot.objects.create(room=self.room, activity_run_id=uuid.uuid4(), user_ids=[1], phase_indices=[0],
+                                   post_counts=[3], flagged_counts=[0], nudge_counts=[0])
+        RunSnapshot.objects.create(room=other, activity_run_id=uuid.uuid4(), user_ids=[2], phase_indices=[0],
+                                   post_counts=[5], flagged_counts=[0], nudge_counts=[0])
+
+        response = self.client.get("/api/analytics/runs/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([run["room"] for run in response.json()["participation_balance"]], ["SNAP01"])
+
+
+class FlagAll:
+    def lacks_evidence(self, texts):
+        return [True] * len(texts)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        clear_buckets()
+        self.user = User.objects.create(username="frag-user")
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.user)
+        activity = Activity.objects.create(name="Long", phases=[{"name": "understand", "time_limit_minutes": 30}])
+        self.room = Room.objects.create(
+            code="FRAG01", selected_activity=activity, activity_is_running=True,
+            activity_started_at=timezone.now(), activity_run_id=uuid.uuid4(),
+        )
+        RoomMember.objects.create(room=self.room, user=self.user)
+        for i in range(20):
+            Post.objects.create(room=self.room, author=self.user, content=f"post number {i} " * 5, phase_index=0,
+                                activity_run_id=self.room.activity_run_id, lacks_evidence=False)
+
+    def flags(self, **headers):
+        response = self.client.get(f"/api/messages/?room={self.room.code}", **headers)
+        self.assertEqual(response.status_code, 200)
+        body = response.content
+        if response.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return {m["lacks_evidence"] for m in json.loads(body)["messages"]}
+
+    def test_rescore_elsewhere_changes_the_served_timeline(self):
+        self.assertEqual(self.flags(), {False})
+        self.assertEqual(self.flags(HTTP_ACCEPT_ENCODING="gzip"), {False})
+
+        # Stands in for another worker: only the database changes, this process's caches stay as they are
+        list(evidence.rescore_posts(scorer=FlagAll()))
+
+        self.assertEqual(self.flags(), {True})
+        self.assertEqual(self.flags(HTTP_ACCEPT_ENCODING="gzip"), {True})
+
+
+class PhaseSchedulerTests(TestCase):
+    def setUp(self):
+        self.clock = clock.SimulatedClock()
+        self.start = self.clock.current
+        self.activity = Activity.objects.create(name="Two phases", phases=[
+            {"name": "Understand", "time_limit_minutes": 1},
+            {"name": "Brainstorm ideas", "time_limit_minutes": 1},
+        ])
+        self.late = self.room("SCHED1", started_at=self.start)
+        self.early = self.room("SCHED2", started_at=self.start - timedelta(seconds=30))
+        self.fired = []
+        scheduler.phase_changed.connect(self.record, dispatch_uid="scheduler-test")
+        self.addCleanup(scheduler.phase_changed.disconnect, dispatch_uid="scheduler-test")
+
+    def room(self, code, started_at):
+        return Room.objects.create(
+            code=code, selected_activity=self.activity, activity_is_running=True, current_phase="decide",
+            activity_started_at=started_at, activity_run_id=uuid.uuid4(),
+        )
+
+    def record(self, room, phase_index, finished, **kwargs):
+        self.fired.append((room.code, "end" if finished else phase_index))
+
+    def run_until(self, phases, offset):
+        self.clock.current = self.start + offset
+        phases.sync()
+        return phases.fire_due()
+
+    def test_boundaries_fire_in_time_order(self):
+        phases = PhaseScheduler(clock=self.clock)
+        self.run_until(phases, timedelta(seconds=10))
+        self.run_until(phases, timedelta(minutes=3))
+        self.assertEqual(self.fired, [
+            ("SCHED2", 0), ("SCHED1", 0),
+            ("SCHED2", 1), ("SCHED1", 1),
+            ("SCHED2", "end"), ("SCHED1", "end"),
+        ])
+        self.assertEqual(len(phases), 0)
+
+    def test_restarted_scheduler_skips_persisted_boundaries(self):
+        self.assertEqual(self.run_until(PhaseScheduler(clock=self.clock), timedelta(seconds=10)), 2)
+
+        # A fresh process primes its heap from the rooms; phase 0 is already in the database
+        restarted = PhaseScheduler(clock=self.clock)
+        self.assertEqual(self.run_until(restarted, timedelta(seconds=20)), 0)
+        self.assertEqual(self.run_until(restarted, timedelta(seconds=45)), 1)
+        self.assertEqual(self.fired[-1], ("SCHED2", 1))
+
+    def test_restart_after_missed_boundaries_fires_only_the_latest(self):
+        self.assertEqual(self.run_until(PhaseScheduler(clock=self.clock), timedelta(seconds=70)), 2)
+        self.assertEqual(sorted(self.fired), [("SCHED1", 1), ("SCHED2", 1)])
+
+    def test_end_of_run_transition(self):
+        phases = PhaseScheduler(clock=self.clock)
+        self.run_until(phases, timedelta(seconds=10))
+        self.late.refresh_from_db()
+        self.assertEqual(self.late.current_phase, "understand")
+
+        self.run_until(phases, timedelta(seconds=70))
+        self.late.refresh_from_db()
+        # "Brainstorm ideas" is not one of current_phase's choices, so it stays put
+        self.assertEqual((self.late.current_phase_index, self.late.current_phase), (1, "understand"))
+
+        self.run_until(phases, timedelta(minutes=3))
+        self.late.refresh_from_db()
+        self.assertEqual(self.late.current_phase_index, 2)
+        self.assertEqual(RunSnapshot.objects.filter(room=self.late, activity_run_id=self.late.activity_run_id).count(), 1)
+        # Already finished: another scheduler's copy of the event changes nothing
+        self.assertFalse(phases.transition(self.late.id, self.late.activity_run_id, 2))
+
+
+class BatchIngestTests(TestCase):
+    def setUp(self):
+        clear_buckets()
+        self.user = User.objects.create(username="offline-writer")
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.user)
+        self.now = timezone.now()
+        activity = Activity.objects.create(name="Long", phases=[{"name": "understand", "time_limit_minutes": 60}])
+        self.room = Room.objects.create(code="BATCH1")
+        RoomMember.objects.create(room=self.room, user=self.user)
+        self.running = Room.objects.create(
+            code="BATCH2", selected_activity=activity, activity_is_running=True,
+            activity_started_at=self.now - timedelta(minutes=5), activity_run_id=uuid.uuid4(),
+        )
+
+    def send(self, posts):
+        return self.client.post(f"/api/messages/batch/?room={self.room.code}", json.dumps({"posts": posts}),
+                                content_type="application/json")
+
+    def test_mixed_batch(self):
+        response = self.send([
+            {"client_id": "a", "content": "first"},
+            {"content": "no client id"},
+            {"client_id": "b", "content": "   "},
+            "not an object",
+            {"client_id": "a", "content": "first again"},
+            {"client_id": "c", "content": "second"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["created"], 2)
+        results = body["results"]
+        self.assertEqual([r["status"] for r in results], ["created", "invalid", "invalid", "invalid", "duplicate", "created"])
+        self.assertEqual(results[4]["id"], results[0]["id"])
+        self.assertEqual(sorted(Post.objects.values_list("client_id", flat=True)), ["a", "c"])
+
+    def test_resent_batch_is_all_duplicates(self):
+        posts = [{"client_id": f"p{i}", "content": f"post {i}"} for i in range(3)]
+        first = self.send(posts).json()["results"]
+        second = self.send(posts).json()
+        self.assertEqual(second["created"], 0)
+        self.assertEqual([r["status"] for r in second["results"]], ["duplicate"] * 3)
+        self.assertEqual([r["id"] for r in second["results"]], [r["id"] for r in first])
+        self.assertEqual(Post.objects.count(), 3)
+
+    def test_batch_size_limit(self):
+        posts = [{"client_id": f"p{i}", "content": "x"} for i in range(MAX_BATCH_POSTS + 1)]
+        self.assertEqual(self.send(posts).status_code, 400)
+        self.assertEqual(self.send(posts[:MAX_BATCH_POSTS]).json()["created"], MAX_BATCH_POSTS)
+
+    def test_timestamps_are_clamped(self):
+        items = [
+            {"client_id": "future", "content": "x", "created_at": (self.now + timedelta(hours=1)).isoformat()},
+            {"client_id": "stale", "content": "x", "created_at": (self.now - timedelta(hours=2)).isoformat()},
+            {"client_id": "recent", "content": "x", "created_at": (self.now - timedelta(minutes=1)).isoformat()},
+            {"client_id": "garbled", "content": "x", "created_at": "yesterday"},
+        ]
+        created = {p.client_id: p.created_at for p in ingest_posts(self.room, self.user, items, now=self.now)["created"]}
+        self.assertEqual(created, {
+            "future": self.now,
+            "stale": self.now - MAX_BACKDATE,
+            "recent": self.now - timedelta(minutes=1),
+            "garbled": self.now,
+        })
+
+        # No earlier than the start of a running activity
+        items = [{"client_id": "before-start", "content": "x", "created_at": (self.now - timedelta(minutes=20)).isoformat()}]
+        post = ingest_posts(self.running, self.user, items, now=self.now)["created"][0]
+        self.assertEqual((post.created_at, post.phase_index), (self.running.activity_started_at, 0))
+
+
+class IdempotentPostTests(TestCase):
+    def setUp(self):
+        clear_buckets()
+        cache.clear()
+        self.room = Room.objects.create(code="IDEM01")
+        self.clients = {}
+        for name in ("alice", "bob"):
+            user = User.objects.create(username=name)
+            RoomMember.objects.create(room=self.room, user=user)
+            self.clients[name] = Client(HTTP_HOST="localhost")
+            self.clients[name].force_login(user)
+
+    def post(self, name, key, content="hello"):
+        return self.clients[name].post(f"/api/messages/?room={self.room.code}", json.dumps({"content": content}),
+                                       content_type="application/json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_returns_the_first_post(self):
+        first = self.post("alice", "retry-1")
+        self.assertEqual(first.status_code, 201)
+        again = self.post("alice", "retry-1", content="hello (resent)")
+        self.assertEqual(again.status_code, 201)
+        self.assertEqual(again["Idempotent-Replayed"], "true")
+        self.assertEqual(again.json()["id"], first.json()["id"])
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_keys_are_per_author(self):
+        alice = self.post("alice", "shared-key")
+        bob = self.post("bob", "shared-key")
+        self.assertEqual(bob.status_code, 201)
+        self.assertFalse(bob.has_header("Idempotent-Replayed"))
+        self.assertNotEqual(bob.json()["id"], alice.json()["id"])
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_retry_after_the_cache_entry_expired(self):
+        first = self.post("alice", "expired-1")
+        cache.clear()
+        again = self.post("alice", "expired-1")
+        self.assertEqual(again["Idempotent-Replayed"], "true")
+        self.assertEqual(again.json()["id"], first.json()["id"])
+        self.assertEqual(Post.objects.count(), 1)
+
+
+class ArchivalTests(TestCase):
+    def setUp(self):
+        clear_buckets()
+        self.facilitator = User.objects.create(username="archivist", last_name="facilitator")
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.facilitator)
+        self.agent = Agent.objects.create(name="Archive Agent")
+        self.room = Room.objects.create(code="ARCH01", created_by=self.facilitator, activity_run_id=uuid.uuid4())
+        RoomMember.objects.create(room=self.room, user=self.facilitator)
+        self.long_ago = timezone.now() - ARCHIVE_RETENTION - timedelta(days=1)
+        self.old_run, self.busy_run = uuid.uuid4(), uuid.uuid4()
+        for run in (self.old_run, self.busy_run):
+            for i in range(3):
+                Post.objects.create(room=self.room, author=self.facilitator, content=f"post {i}", phase_index=0,
+                                    activity_run_id=run, created_at=self.long_ago + timedelta(minutes=i))
+            Intervention.objects.create(room=self.room, agent=self.agent, rule_name="r", message="nudge", phase_index=0,
+                                        activity_run_id=run, created_at=self.long_ago)
+        # One recent row keeps a run out of the archive
+        Intervention.objects.create(room=self.room, agent=self.agent, rule_name="r", message="late", phase_index=0,
+                                    activity_run_id=self.busy_run)
+        Post.objects.create(room=self.room, author=self.facilitator, content="current", activity_run_id=self.room.activity_run_id)
+
+    def test_only_runs_idle_past_the_retention_are_archivable(self):
+        self.assertEqual(archivable_runs(), [(self.room.id, self.old_run)])
+
+    def test_archived_run_reads_back(self):
+        history = f"/api/messages/?room={self.room.code}&run={self.old_run}"
+        before = self.client.get(history).json()["messages"]
+        self.assertEqual(len(before), 4)
+
+        self.assertEqual(archive_run(self.room, self.old_run), {"posts": 3, "interventions": 1, "batches": 2})
+        self.assertFalse(Post.objects.filter(activity_run_id=self.old_run).exists())
+        self.assertEqual(ArchivedPost.objects.filter(activity_run_id=self.old_run).count(), 3)
+        self.assertTrue(RunSnapshot.objects.filter(activity_run_id=self.old_run).exists())
+        self.assertEqual(archivable_runs(), [])
+
+        self.assertEqual(self.client.get(history).json()["messages"], before)
+
+        response = self.client.get(f"/api/export/?room={self.room.code}&run={self.old_run}")
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted((row["record_type"], row["content"]) for row in rows), [
+            ("intervention", "nudge"), ("post", "post 0"), ("post", "post 1"), ("post", "post 2"),
+        ])
+
+
+class GarbageCollectionTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.long_ago = self.now - GC_INACTIVE_AFTER - timedelta(days=10)
+        self.cutoff = self.now - GC_INACTIVE_AFTER
+        # Rooms the migrations seeded
+        self.seeded = list(Room.objects.values_list("pk", flat=True))
+
+    def codes(self):
+        return sorted(Room.objects.exclude(pk__in=self.seeded).values_list("code", flat=True))
+
+    def guest(self, username, **fields):
+        user = User(username=username, date_joined=self.long_ago, **fields)
+        user.set_unusable_password()
+        user.save()
+        return user
+
+    def room(self, code, members=(), seen=None, **fields):
+        room = Room.objects.create(code=code, **fields)
+        Room.objects.filter(pk=room.pk).update(created_at=self.long_ago)
+        for user in members:
+            RoomMember.objects.create(room=room, user=user, last_seen_at=seen or self.long_ago)
+        RoomMember.objects.filter(room=room).update(joined_at=self.long_ago)
+        return room
+
+    def test_abandoned_rooms_and_guests_go_active_ones_stay(self):
+        gone_guest = self.guest("gone")
+        poster, regular = self.guest("poster"), self.guest("regular")
+        member = User.objects.create_user(username="member", password="secret", date_joined=self.long_ago)
+        self.room("GONE01", members=[gone_guest])
+        self.room("SEEN01", members=[regular], seen=self.now)
+        posted = self.room("POST01", members=[poster])
+        Post.objects.create(room=posted, author=poster, content="still here", created_at=self.long_ago)
+        self.room("RUNS01", activity_is_running=True)
+        Room.objects.create(code="NEW001")
+
+        report = collect_garbage(now=self.now)
+
+        self.assertEqual(self.codes(), ["NEW001", "POST01", "RUNS01", "SEEN01"])
+        self.assertEqual(
+            sorted(User.objects.values_list("username", flat=True)),
+            sorted([poster.username, regular.username, member.username]),
+        )
+        self.assertEqual(report["deleted"]["message_board.Room"], 1)
+        self.assertEqual(report["deleted"]["auth.User"], 1)
+
+    def test_batches_are_bounded_and_resumable(self):
+        rooms = [self.room(f"BATCH{i}") for i in range(5)]
+        batches = list(collect(lambda: abandoned_rooms(self.cutoff), batch_size=2, max_batches=2))
+        self.assertEqual([last_id for last_id, _ in batches], [rooms[1].id, rooms[3].id])
+        self.assertEqual(self.codes(), ["BATCH4"])
+
+        list(collect(lambda: abandoned_rooms(self.cutoff), after_id=batches[-1][0], batch_size=2))
+        self.assertEqual(self.codes(), [])
+
+    def test_guests_active_on_another_shard_are_kept(self):
+        elsewhere, gone = self.guest("elsewhere"), self.guest("gone")
+        with mock.patch("message_board.cleanup.active_on_shards", return_value={elsewhere.id}) as veto:
+            collect_garbage(now=self.now)
+        veto.assert_called_once_with([elsewhere.id, gone.id], self.cutoff)
+        self.assertEqual(list(User.objects.values_list("username", flat=True)), ["elsewhere"])
+
+
+class EvidenceScorerTests(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(code="SCORE1")
+        self.user = User.objects.create(username="scored")
+        self.posts = [
+            Post.objects.create(room=self.room, author=self.user, content=f"claim {i}", lacks_evidence=False)
+            for i in range(5)
+        ]
+        self.ids = [post.id for post in self.posts]
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "needs numpy")
+    def test_default_weights_agree_with_the_heuristic(self):
+        posts = evidence.synthetic_posts(2000, seed=1) + ["", "?", "Because it rained", "See [3]", "I think we should"]
+        self.assertEqual(evidence.get_scorer().lacks_evidence(posts), [agent_rules.message_lacks_evidence(p) for p in posts])
+
+    def test_rescore_walks_posts_by_id(self):
+        with CaptureQueriesContext(connection) as queries:
+            progress = list(evidence.rescore_posts(Post.objects.filter(room=self.room), scorer=FlagAll(), batch_size=2))
+        self.assertEqual([(p["last_id"], p["scanned"], p["flagged"]) for p in progress], [
+            (self.ids[1], 2, 2), (self.ids[3], 2, 2), (self.ids[4], 1, 1),
+        ])
+        selects = [q["sql"] for q in queries.captured_queries if q["sql"].startswith("SELECT")]
+        # Keyset pagination: each batch starts after the last id, never at an OFFSET
+        self.assertTrue(all("OFFSET" not in sql and '"id" >' in sql for sql in selects), selects)
+        self.assertEqual(Post.objects.filter(lacks_evidence=True).count(), 5)
+
+    def test_rescore_command_resumes_after_an_id(self):
+        out = io.StringIO()
+        with mock.patch("message_board.management.commands.rescore_evidence.get_scorer", return_value=FlagAll()):
+            call_command("rescore_evidence", "--after", str(self.ids[2]), "--batch-size", "1", stdout=out)
+        self.assertEqual(list(Post.objects.filter(lacks_evidence=True).values_list("id", flat=True)), self.ids[3:])
+        self.assertIn(f"last id {self.ids[4]}", out.getvalue())
+
+
+class OverviewTests(TestCase):
+    def setUp(self):
+        clear_buckets()
+        cache.clear()
+        self.facilitator = User.objects.create(username="overseer", last_name="facilitator")
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.facilitator)
+        self.now = timezone.now()
+        agent = Agent.objects.create(name="Overview Agent")
+        activity = Activity.objects.create(name="Two phases", phases=[
+            {"name": "understand", "time_limit_minutes": 10}, {"name": "propose", "time_limit_minutes": 10},
+        ])
+
+        self.created = Room.objects.create(
+            code="OVER01", created_by=self.facilitator, selected_activity=activity, activity_is_running=True,
+            activity_started_at=self.now - timedelta(minutes=15), activity_run_id=uuid.uuid4(),
+        )
+        self.joined = Room.objects.create(code="OVER02")
+        RoomMember.objects.create(room=self.joined, user=self.facilitator)
+        other = Room.objects.create(code="OVER03", activity_run_id=uuid.uuid4())
+
+        learners = [User.objects.create(username=f"learner{i}") for i in range(3)]
+        RoomMember.objects.bulk_create([RoomMember(room=self.created, user=u) for u in learners])
+        run = self.created.activity_run_id
+        ParticipationCounter.objects.bulk_create([
+            ParticipationCounter(room=self.created, user=learners[0], activity_run_id=run, phase_index=0, post_count=2,
+                                 last_posted_at=self.now - timedelta(minutes=12)),
+            ParticipationCounter(room=self.created, user=learners[1], activity_run_id=run, phase_index=0, post_count=1),
+            ParticipationCounter(room=self.created, user=learners[1], activity_run_id=run, phase_index=1, post_count=2,
+                                 last_posted_at=self.now - timedelta(minutes=4)),
+            # Another run of the same room, and someone else's room
+            ParticipationCounter(room=self.created, user=learners[2], activity_run_id=uuid.uuid4(), phase_index=0, post_count=9),
+            ParticipationCounter(room=other, user=learners[2], activity_run_id=other.activity_run_id, phase_index=0, post_count=4),
+        ])
+        for minutes in range(7):
+            Intervention.objects.create(room=self.created, agent=agent, rule_name=f"r{minutes}", message="m",
+                                        activity_run_id=run, created_at=self.now - timedelta(minutes=10 - minutes))
+        Intervention.objects.create(room=other, agent=agent, rule_name="other", message="m", activity_run_id=other.activity_run_id)
+
+    def test_overview_covers_the_facilitators_rooms(self):
+        response = self.client.get("/api/rooms/overview/")
+        self.assertEqual(response.status_code, 200)
+        rooms = {room["code"]: room for room in response.json()["rooms"]}
+        self.assertEqual(sorted(rooms), ["OVER01", "OVER02"])
+
+        created = rooms["OVER01"]
+        self.assertEqual(created["members_count"], 3)
+        self.assertEqual(created["posts_by_phase"], {"0": 3, "1": 2})
+        self.assertEqual(created["total_posts"], 5)
+        self.assertEqual(created["activity"]["phase_index"], 1)
+        self.assertEqual([i["rule_name"] for i in created["recent_interventions"]], ["r6", "r5", "r4", "r3", "r2"])
+        self.assertEqual(created["last_activity_at"], (self.now - timedelta(minutes=4)).isoformat())
+
+        joined = rooms["OVER02"]
+        self.assertEqual((joined["members_count"], joined["total_posts"], joined["recent_interventions"]), (1, 0, []))
+
+    def test_query_count_does_not_grow_with_rooms(self):
+        with self.assertNumQueries(3):
+            build_overview(self.facilitator)
+        for i in range(5):
+            Room.objects.create(code=f"MORE0{i}", created_by=self.facilitator, activity_run_id=uuid.uuid4())
+        with self.assertNumQueries(3):
+            self.assertEqual(len(build_overview(self.facilitator)["rooms"]), 7)
+
+    def test_learners_are_refused(self):
+        learner = Client(HTTP_HOST="localhost")
+        learner.force_login(User.objects.get(username="learner0"))
+        self.assertEqual(learner.get("/api/rooms/overview/").status_code, 403)
+
+
+@override_settings(WARM_START=True)
+class ReadyTests(TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.addCleanup(warmup._state.update, dict(warmup._state))
+        warmup._state.update(status="idle", pid=None)
+        self.client = Client(HTTP_HOST="localhost")
+
+    def prime(self):
+        self.release.wait(10)
+        return {"rooms": 0}
+
+    def wait_for(self, status):
+        for _ in range(200):
+            if warmup.warmup_status()["status"] == status:
+                return
+            time.sleep(0.01)
+        self.fail(f"warm-up never got to {status}: {warmup.warmup_status()}")
+
+    def test_not_ready_until_warm_up_finishes(self):
+        with mock.patch.object(warmup, "prime", side_effect=self.prime):
+            for _ in range(2):
+                response = self.client.get("/api/ready/")
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.json()["status"], "priming")
+
+            self.release.set()
+            self.wait_for("ready")
+
+        response = self.client.get("/api/ready/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["primed"], {"rooms": 0})
+
+    def test_failed_warm_up_is_retried(self):
+        with mock.patch.object(warmup, "prime", side_effect=RuntimeError("database away")), \
+                self.assertLogs("message_board.warmup", "ERROR"):
+            self.assertEqual(self.client.get("/api/ready/").status_code, 503)
+            self.wait_for("failed")
+        with mock.patch.object(warmup, "prime", return_value={"rooms": 1}):
+            self.assertEqual(self.client.get("/api/ready/").status_code, 503)
+            self.wait_for("ready")
+        self.assertEqual(self.client.get("/api/ready/").status_code, 200)
+
+
+class MemberPostedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.room = Room.objects.create(code="TOUCH1", activity_run_id=uuid.uuid4())
+        self.user = User.objects.create(username="toucher")
+        self.member = RoomMember.objects.create(room=self.room, user=self.user)
+        # Start of a throttle window, so a second or two later is still the same one
+        now = timezone.now()
+        self.clock = clock.SimulatedClock(now - timedelta(seconds=now.timestamp() % MEMBER_POST_TOUCH_INTERVAL.total_seconds()))
+
+    def post(self, phase_index=0, after=timedelta(0)):
+        self.clock.advance(after)
+        post = Post(room=self.room, author=self.user, content="x", created_at=self.clock.current,
+                    activity_run_id=self.room.activity_run_id, phase_index=phase_index)
+        with clock.use_clock(self.clock):
+            touch_member_posted(post)
+        self.member.refresh_from_db()
+        return post
+
+    def assertTouched(self, post):
+        self.assertEqual(
+            (self.member.last_posted_at, self.member.last_seen_at, self.member.activity_run_id, self.member.phase_index),
+            (post.created_at, post.created_at, post.activity_run_id, post.phase_index),
+        )
+
+    def test_first_post_is_written(self):
+        self.assertTouched(self.post())
+
+    def test_posts_within_the_interval_are_coalesced(self):
+        first = self.post()
+        self.post(after=timedelta(seconds=1))
+        self.assertTouched(first)
+        # A new phase is written straight away, and so is the next post once the interval is over
+        self.assertTouched(self.post(phase_index=1, after=timedelta(seconds=1)))
+        self.assertTouched(self.post(phase_index=1, after=MEMBER_POST_TOUCH_INTERVAL))
+
+
+SHARDS = ["shard1", "shard2"]
+
+
+@override_settings(ROOM_SHARDS=SHARDS, DATABASE_ROUTERS=["message_board.sharding.RoomShardRouter"])
+class ShardingTests(TestCase):
+    databases = {"default", *SHARDS}
+
+    def setUp(self):
+        clear_buckets()
+        cache.clear()
+        sharding._directory.clear()
+        self.addCleanup(sharding._directory.clear)
+        for alias in SHARDS:
+            sharding.reserve_id_range(alias)
+            sharding.sync_reference_tables(alias)
+        self.facilitator = User.objects.create(username="shard-facilitator", last_name="facilitator")
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.facilitator)
+
+    def provision(self, count=20):
+        response = self.client.post("/api/rooms/bulk/", json.dumps({"count": count, "name_prefix": "Group", "join": True}),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 201, response.content)
+        return [room["code"] for room in response.json()["rooms"]]
+
+    def test_rooms_are_placed_through_the_directory(self):
+        codes = self.provision()
+        placement = dict(RoomDirectory.objects.filter(code__in=codes).values_list("code", "shard"))
+        self.assertEqual(set(placement.values()), set(SHARDS))
+        for code, alias in placement.items():
+            room = Room.objects.using(alias).get(code=code)
+            self.assertEqual(sharding.shard_for_id(room.id), alias)
+            self.assertEqual(sharding.shard_for_code(code), alias)
+            self.assertTrue(RoomMember.objects.using(alias).filter(room=room, user=self.facilitator).exists())
+            self.assertEqual(lookup_room(code)._state.db, alias)
+            others = set(sharding.room_databases()) - {alias}
+            self.assertFalse(any(Room.objects.using(other).filter(code=code).exists() for other in others))
+
+    def test_codes_are_unique_across_shards(self):
+        codes = self.provision()
+        self.assertEqual(sharding.taken_codes(codes + ["NOSUCH"]), set(codes))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            sharding.claim_codes([codes[0]], shard="shard2" if sharding.shard_for_code(codes[0]) == "shard1" else "shard1")
+
+        # A code taken on either shard is skipped when allocating
+        fresh = "FRESH1"
+        with mock.patch.object(room_codes, "generate_room_code", side_effect=[codes[0], codes[1], fresh]):
+            room = allocate_room(name="Another")
+        self.assertEqual(room.code, fresh)
+        self.assertEqual(room._state.db, sharding.shard_for_new_code(fresh))
+
+    def test_export_and_search_cover_every_shard(self):
+        codes = self.provision(20)
+        by_shard = {}
+        for code in codes:
+            by_shard.setdefault(sharding.shard_for_code(code), code)
+        for alias, code in by_shard.items():
+            response = self.client.post(f"/api/messages/?room={code}", json.dumps({"content": f"sharded note from {alias}"}),
+                                        content_type="application/json")
+            self.assertEqual(response.status_code, 201, response.content)
+        # Someone else's room on a shard stays out of this facilitator's results
+        stranger = allocate_room(name="Elsewhere", shard="shard1")
+        Post.objects.using("shard1").create(room=stranger, author=self.facilitator, content="sharded note, not theirs")
+
+        response = self.client.get("/api/export/")
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(row["room"] for row in rows), sorted(by_shard.values()))
+
+        response = self.client.get("/api/search/?q=sharded")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(sorted(hit["room"] for hit in response.json()["results"]), sorted(by_shard.values()))
+
+    def test_reference_rows_reach_every_shard(self):
+        saved = User.objects.create(username="saved")
+        call_command("loaddata", "activities.json", verbosity=0)
+        for alias in SHARDS:
+            self.assertTrue(User.objects.using(alias).filter(pk=saved.pk).exists())
+            self.assertEqual(Activity.objects.using(alias).count(), Activity.objects.count())
+
+        # bulk_create sends no post_save: the shards drift until a sync
+        bulk = User.objects.bulk_create([User(username="bulk-one"), User(username="bulk-two")])
+        self.assertEqual(sharding.reference_drift("shard1"), {"auth.User": (2, 0)})
+        out = io.StringIO()
+        call_command("shards", "status", stdout=out)
+        self.assertIn("auth.User: 2 missing", out.getvalue())
+
+        call_command("shards", "sync", stdout=io.StringIO())
+        for alias in SHARDS:
+            self.assertEqual(sharding.reference_drift(alias), {})
+            self.assertEqual(User.objects.using(alias).filter(username__startswith="bulk-").count(), len(bulk))
+
+    def test_migrating_a_new_shard_fills_its_reference_tables(self):
+        # A freshly created shard database: schema only
+        for model in (User, Activity, Agent):
+            model._base_manager.using("shard2").all().delete()
+        Activity.objects.create(name="Seeded", phases=[])
+
+        call_command("migrate", database="shard2", verbosity=0)
+
+        self.assertEqual(sharding.reference_drift("shard2"), {})
+        self.assertTrue(Activity.objects.using("shard2").filter(name="Seeded").exists())
+        room = allocate_room(name="After migrate", shard="shard2")
+        self.assertEqual(sharding.shard_for_id(room.id), "shard2")
+
+    def test_guests_active_on_a_shard_are_not_collected(self):
+        now = timezone.now()
+        guest = User(username="shard-guest", date_joined=now - timedelta(days=60))
+        guest.set_unusable_password()
+        guest.save()
+        room = allocate_room(name="Guest room", shard="shard2")
+        Post.objects.using("shard2").create(room=room, author_id=guest.id, content="hello")
+
+        self.assertEqual(active_on_shards([guest.id], now - timedelta(days=30)), {guest.id})
+        collect_garbage(now=now)
+        self.assertTrue(User.objects.filter(pk=guest.pk).exists())
@@ -8,9 +8,20 @@ router.register(r"activities", ActivityViewSet, basename="activities")
 
 urlpatterns = [
     path("rooms/", views.rooms, name="rooms"),
+    path("rooms/bulk/", views.rooms_bulk, name="rooms_bulk"),
+    path("rooms/overview/", views.rooms_overview, name="rooms_overview"),
     path("messages/", views.messages, name="messages"),
+    path("messages/batch/", views.messages_batch, name="messages_batch"),
+    path("export/", views.export_runs, name="export_runs"),
+    path("search/", views.search_messages, name="search_messages"),
+    path("analytics/runs/", views.analytics_runs, name="analytics_runs"),
+    path("rate-limits/", views.rate_limit_stats, name="rate_limit_stats"),
+    path("ready/", views.ready, name="ready"),
     path("rooms/<str:code>/", views.room_detail, name="room_detail"),
     path("rooms/<str:code>/members/", views.room_members, name="room_members"),
+    path("rooms/<str:code>/online/", views.room_online, name="room_online"),
+    path("rooms/<str:code>/heartbeat/", views.room_heartbeat, name="room_heartbeat"),
+    path("rooms/<str:code>/participation/", views.room_participation, name="room_participation"),
     path("rooms/<str:code>/select-activity/", views.select_activity, name="select_activity"),
     path("rooms/<str:code>/start-activity/", views.start_activity, name="start_activity"),
     
@@ -1,13 +1,32 @@
 import json
 import uuid
-from django.http import JsonResponse
-from django.utils.crypto import get_random_string
+from django.db import IntegrityError
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
-from .models import Post, Room, Intervention, Activity, RoomMember
+from .models import Post, Room, Intervention, Activity, RoomMember, RunSnapshot
 from .serializers import PostSerializer, ActivitySerializer
-from .agent_rules import check_all_rules, check_individual_inactivity_rule, message_lacks_evidence
+from .analytics import SnapshotFrame
+from .archival import run_interventions, run_posts
+from .agent_rules import check_all_rules, check_individual_inactivity_rule
+from .evidence import lacks_evidence
+from .exports import EXPORT_KINDS, ExportError, parse_export_filters, stream_export
+from .fragments import object_timeline, post_fragment, timeline, timeline_response
+from .idempotency import InvalidIdempotencyKey, existing_post, idempotency_key, remember_response, remembered_response
+from .ingest import MAX_BATCH_POSTS, ingest_posts
+from .overview import cached_overview, facilitator_room_ids
+from .participation import record_post, run_post_counts
+from .phases import get_activity_state
+from .presence import online_members, presence
+from .provisioning import MAX_BULK_ROOMS, ROOM_NAME_MAX_LENGTH, ProvisioningError, numbered_specs, provision_rooms
+from .ratelimit import rate_limit, rejection_stats
+from .room_codes import allocate_room, lookup_room
+from .rule_workers import rules_inline
+from .search import SEARCH_PAGE_SIZE, SearchError, search_posts
+from .sharding import across_shards
+from .warmup import start_warmup, warmup_status
+from .write_buffer import WRITE_BUFFER_RETRY_AFTER, WriteBufferTimeout, insert
 from django.utils import timezone
 
 
@@ -35,6 +54,8 @@ def rooms(request):
         payload = json.loads(request.body or "{}")
     except json.JSONDecodeError:
         return JsonResponse({"detail": "Invalid JSON"}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"detail": "Expected a JSON object"}, status=400)
 
     action = (payload.get("action") or "").strip().lower()
 
@@ -45,19 +66,13 @@ def rooms(request):
         if not name:
             return JsonResponse({"detail": "name is required"}, status=400)
 
-        # Ensure unique code (rare collision, but easy to guard)
-        code = get_random_string(6).upper()
-        while Room.objects.filter(code=code).exists():
-            code = get_random_string(6).upper()
-
-        room = Room.objects.create(code=code, name=name)
-        room.members.add(request.user)  
-        RoomMember.objects.get_or_create(room=room, user=request.user)
+        room = allocate_room(name=name, created_by=request.user)
+        RoomMember.objects.create(room=room, user=request.user)
 
         return JsonResponse({
             "code": room.code,
             "name": room.name,
-            "members_count": room.members.count(),
+            "members_count": 1,
         }, status=201)
 
     if action == "join":
@@ -65,39 +80,135 @@ def rooms(request):
         if not code:
             return JsonResponse({"detail": "code is required"}, status=400)
 
-        try:
-            room = Room.objects.get(code=code)
-        except Room.DoesNotExist:
+        room = lookup_room(code)
+        if room is None:
             return JsonResponse({"detail": "Room not found"}, status=404)
 
-        already_member = room.members.filter(id=request.user.id).exists()
-        room.members.add(request.user)
-        RoomMember.objects.get_or_create(room=room, user=request.user)  
+        _, joined = RoomMember.objects.get_or_create(room=room, user=request.user)
 
         return JsonResponse({
             "code": room.code,
             "name": room.name,
-            "joined": not already_member,
-            "members_count": room.members.count(),
+            "joined": joined,
+            "members_count": RoomMember.objects.filter(room=room).count(),
         }, status=200)
 
     return JsonResponse({"detail": "Invalid action"}, status=400)
 
+def _is_facilitator(user):
+    return user.is_staff or user.last_name == "facilitator"
+
+
+def _room_scope(user):
+    # Filters limiting room data to what the user may read: staff everything, a facilitator
+    # (a role guests pick for themselves) only the rooms they created or belong to
+    if user.is_staff:
+        return {}
+    return {"room__in": facilitator_room_ids(user)}
+
+
+def _visible_room_ids(user):
+    # _room_scope as a set of ids from every room database; None for staff (every room)
+    if user.is_staff:
+        return None
+    return {row["id"] for row in across_shards(facilitator_room_ids(user))}
+
+
+@csrf_exempt
+def rooms_bulk(request):
+    if request.method != "POST":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    if not _is_facilitator(request.user):
+        return JsonResponse({"detail": "Facilitator role required"}, status=403)
+
+    try:
+        payload = json.loads(request.body or "{}")
+    except json.JSONDecodeError:
+        return JsonResponse({"detail": "Invalid JSON"}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"detail": "Expected a JSON object"}, status=400)
+
+    specs = payload.get("rooms")
+    if specs is None:
+        try:
+            count = int(payload.get("count") or 0)
+        except (TypeError, ValueError):
+            return JsonResponse({"detail": "count must be an integer"}, status=400)
+        if not 1 <= count <= MAX_BULK_ROOMS:
+            return JsonResponse({"detail": f"count must be between 1 and {MAX_BULK_ROOMS}"}, status=400)
+        prefix = payload.get("name_prefix") or ""
+        if not isinstance(prefix, str):
+            return JsonResponse({"detail": "name_prefix must be a string"}, status=400)
+        specs = numbered_specs(count, prefix.strip() or "Room")
+    elif not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+        return JsonResponse({"detail": "rooms must be a list of objects"}, status=400)
+
+    for spec in specs:
+        name = spec.get("name") or ""
+        if not isinstance(name, str):
+            return JsonResponse({"detail": "name must be a string"}, status=400)
+        spec["name"] = name.strip()
+        if not spec["name"]:
+            return JsonResponse({"detail": "name is required for every room"}, status=400)
+        if len(spec["name"]) > ROOM_NAME_MAX_LENGTH:
+            return JsonResponse({"detail": f"name must be at most {ROOM_NAME_MAX_LENGTH} characters"}, status=400)
+        members = spec.get("members") or []
+        if not isinstance(members, list):
+            return JsonResponse({"detail": "members must be a list"}, status=400)
+        # User ids or usernames; bool is an int subclass but never a user id
+        if not all(isinstance(m, (str, int)) and not isinstance(m, bool) for m in members):
+            return JsonResponse({"detail": "members must be user ids or usernames"}, status=400)
+
+    activity = None
+    activity_id = payload.get("activity_id")
+    if activity_id:
+        try:
+            activity_id = int(activity_id)
+        except (TypeError, ValueError):
+            return JsonResponse({"detail": "activity_id must be an integer"}, status=400)
+        try:
+            activity = Activity.objects.get(id=activity_id)
+        except Activity.DoesNotExist:
+            return JsonResponse({"detail": "Activity not found"}, status=404)
+
+    try:
+        created = provision_rooms(
+            specs,
+            creator=request.user,
+            activity=activity,
+            join_creator=bool(payload.get("join")),
+        )
+    except ProvisioningError as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+
+    return JsonResponse({
+        "rooms": [
+            {"code": room.code, "name": room.name, "members_count": room.members_count}
+            for room in created
+        ],
+        "activity_id": activity.id if activity else None,
+    }, status=201)
+
 @csrf_exempt
 def messages(request):
     room_code = (request.GET.get("room") or "").strip().upper()
     if not room_code:
         return JsonResponse({"detail": "room is required"}, status=400)
 
-    try:
-        room = Room.objects.get(code=room_code)
-    except Room.DoesNotExist:
+    room = lookup_room(room_code, Room.objects.select_related("selected_activity"))
+    if room is None:
         return JsonResponse({"detail": "Room not found"}, status=404)
 
+    limited = rate_limit(request, "messages_get" if request.method == "GET" else "messages_post", room)
+    if limited:
+        return limited
 
     state = get_activity_state(room)
 
-    
     phase_param = request.GET.get("phase")
     if phase_param is not None and phase_param != "":
         try:
@@ -111,41 +222,33 @@ def messages(request):
         phase_index = None
 
     if request.method == "GET":
-        check_individual_inactivity_rule(room, phase_index=phase_index)
-
-        posts_qs = Post.objects.filter(room=room, phase_index=phase_index, activity_run_id=room.activity_run_id).order_by("created_at")
-        interventions_qs = Intervention.objects.filter(room=room, phase_index=phase_index, activity_run_id=room.activity_run_id).order_by("created_at")
-
-        messages_data = []
-
-        for post in posts_qs:
-            messages_data.append({
-                "type": "post",
-                "id": post.id,
-                "content": post.content,
-                "author": post.author.first_name or post.author.username,
-                "created_at": post.created_at.isoformat(),
-                "phase_index": post.phase_index,
-                "lacks_evidence": post.lacks_evidence,
-
-            })
-
-        for intervention in interventions_qs:
-            messages_data.append({
-                "type": "intervention",
-                "id": intervention.id,
-                "content": intervention.message,
-                "author": intervention.agent.name,
-                "explanation": intervention.explanation,
-                "rule_name": intervention.rule_name,
-                "created_at": intervention.created_at.isoformat(),
-                "phase_index": intervention.phase_index,
-            })
-
-        messages_data.sort(key=lambda x: x["created_at"])
-
-        
-        return JsonResponse({
+        run_param = request.GET.get("run")
+        if run_param:
+            # History: a past (possibly archived) run, all phases unless one is asked for
+            try:
+                run_id = uuid.UUID(run_param)
+            except ValueError:
+                return JsonResponse({"detail": "run must be a UUID"}, status=400)
+            all_phases = phase_param is None or phase_param == ""
+            if all_phases:
+                phase_index = None
+            fragments, version = object_timeline(
+                run_posts(room, run_id, phase_index, all_phases=all_phases),
+                run_interventions(room, run_id, phase_index, all_phases=all_phases),
+            )
+        else:
+            run_id = room.activity_run_id
+            if request.user.is_authenticated:
+                presence.heartbeat(room, request.user)
+            if rules_inline():
+                check_individual_inactivity_rule(room, phase_index=phase_index)
+
+            posts_qs = Post.objects.filter(room=room, phase_index=phase_index, activity_run_id=room.activity_run_id).order_by("created_at")
+            interventions_qs = Intervention.objects.filter(room=room, phase_index=phase_index, activity_run_id=room.activity_run_id).order_by("created_at")
+            fragments, version = timeline(posts_qs, interventions_qs)
+
+        # Entries come pre-serialized from the fragment cache; "messages" is spliced in last
+        return timeline_response(request, {
             "room": room.code,
             "phase_index": phase_index,
             "activity": {
@@ -153,14 +256,13 @@ def messages(request):
                 "finished": state.get("finished", False),
                 "activity_id": state.get("activity_id"),
                 "activity_name": state.get("activity_name"),
-                "activity_run_id": str(room.activity_run_id) if room.activity_run_id else None,
+                "activity_run_id": str(run_id) if run_id else None,
                 "phase_name": state.get("phase_name"),
                 "phase_prompt": state.get("phase_prompt"),
                 "phase_ends_at": state.get("phase_ends_at"),
                 "total_phases": state.get("total_phases"),
             },
-            "messages": messages_data,
-        })
+        }, fragments, version)
 
     if request.method != "POST":
         return JsonResponse({"detail": "Method not allowed"}, status=405)
@@ -172,27 +274,111 @@ def messages(request):
         payload = json.loads(request.body or "{}")
     except json.JSONDecodeError:
         return JsonResponse({"detail": "Invalid JSON"}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"detail": "Expected a JSON object"}, status=400)
 
     content = (payload.get("content") or "").strip()
     if not content:
         return JsonResponse({"detail": "content is required"}, status=400)
 
+    try:
+        key = idempotency_key(request, payload)
+    except InvalidIdempotencyKey as e:
+        return JsonResponse({"detail": str(e)}, status=400)
 
+    if key is not None:
+        replay = _replay_post(request.user, key)
+        if replay is not None:
+            return replay
 
-    post = Post.objects.create(
-        room=room,
-        author=request.user,
-        content=content,
-        phase_index=phase_index,
-        activity_run_id=room.activity_run_id,
-        lacks_evidence=message_lacks_evidence(content),
+    try:
+        post = insert(Post(
+            room=room,
+            author=request.user,
+            content=content,
+            phase_index=phase_index,
+            activity_run_id=room.activity_run_id,
+            lacks_evidence=lacks_evidence(content),
+            client_id=key,
+        ), on_saved=record_post)
+    except IntegrityError:
+        # A concurrent retry with the same key won the insert
+        replay = _replay_post(request.user, key)
+        if replay is None:
+            raise
+        return replay
+    except WriteBufferTimeout:
+        # Nothing was written; a retry with the same Idempotency-Key is safe
+        response = JsonResponse({"detail": "Too busy, try again", "retry_after": WRITE_BUFFER_RETRY_AFTER}, status=503)
+        response["Retry-After"] = str(WRITE_BUFFER_RETRY_AFTER)
+        return response
+
+    post_fragment(post)
+
+    if rules_inline():
+        check_all_rules(room, post)
+
+    data = PostSerializer(post).data
+    if key is not None:
+        remember_response(request.user, key, 201, data)
+    return JsonResponse(data, status=201)
+
+
+def _replay_post(user, key):
+    # Retries get the original response back without touching the rules again
+    remembered = remembered_response(user, key)
+    if remembered is None:
+        post = existing_post(user, key)
+        if post is None:
+            return None
+        remembered = (201, PostSerializer(post).data)
+        remember_response(user, key, *remembered)
+
+    status, data = remembered
+    response = JsonResponse(data, status=status)
+    response["Idempotent-Replayed"] = "true"
+    return response
 
-    )
+@csrf_exempt
+def messages_batch(request):
+    if request.method != "POST":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    room_code = (request.GET.get("room") or "").strip().upper()
+    if not room_code:
+        return JsonResponse({"detail": "room is required"}, status=400)
+
+    room = lookup_room(room_code, Room.objects.select_related("selected_activity"))
+    if room is None:
+        return JsonResponse({"detail": "Room not found"}, status=404)
+
+    limited = rate_limit(request, "messages_batch", room)
+    if limited:
+        return limited
 
-    
-    check_all_rules(room, post)
+    try:
+        payload = json.loads(request.body or "{}")
+    except json.JSONDecodeError:
+        return JsonResponse({"detail": "Invalid JSON"}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"detail": "Expected a JSON object"}, status=400)
+
+    items = payload.get("posts")
+    if not isinstance(items, list) or not items:
+        return JsonResponse({"detail": "posts must be a non-empty list"}, status=400)
+    if len(items) > MAX_BATCH_POSTS:
+        return JsonResponse({"detail": f"At most {MAX_BATCH_POSTS} posts per batch"}, status=400)
 
-    return JsonResponse(PostSerializer(post).data, status=201)
+    result = ingest_posts(room, request.user, items)
+
+    return JsonResponse({
+        "room": room.code,
+        "created": len(result["created"]),
+        "results": result["results"],
+    }, status=200)
 
 @csrf_exempt
 def room_members(request, code):
@@ -202,29 +388,262 @@ def room_members(request, code):
     if not request.user.is_authenticated:
         return JsonResponse({"detail": "Authentication required"}, status=401)
 
+    room = lookup_room(code)
+    if room is None:
+        return JsonResponse({"detail": "Room not found"}, status=404)
+
+    memberships = (
+        RoomMember.objects.filter(room=room)
+        .select_related("user")
+        .order_by("user__first_name", "user__username")
+    )
+    data = [
+        {
+            "id": m.user.id,
+            "name": (m.user.first_name or m.user.username),
+            "last_posted_at": m.last_posted_at.isoformat() if m.last_posted_at else None,
+            "last_seen_at": m.last_seen_at.isoformat() if m.last_seen_at else None,
+        }
+        for m in memberships
+    ]
+    return JsonResponse(data, safe=False)
+
+
+@csrf_exempt
+def room_heartbeat(request, code):
+    if request.method != "POST":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    room = lookup_room(code)
+    if room is None:
+        return JsonResponse({"detail": "Room not found"}, status=404)
+
+    limited = rate_limit(request, "room_heartbeat", room)
+    if limited:
+        return limited
+
     try:
-        room = Room.objects.get(code=code.strip().upper())
-    except Room.DoesNotExist:
+        payload = json.loads(request.body or "{}")
+    except json.JSONDecodeError:
+        return JsonResponse({"detail": "Invalid JSON"}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"detail": "Expected a JSON object"}, status=400)
+
+    presence.heartbeat(room, request.user, idle=bool(payload.get("idle")))
+    return JsonResponse({"detail": "ok"}, status=200)
+
+
+@csrf_exempt
+def room_online(request, code):
+    if request.method != "GET":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    room = lookup_room(code)
+    if room is None:
+        return JsonResponse({"detail": "Room not found"}, status=404)
+
+    return JsonResponse(online_members(room), safe=False)
+
+
+@csrf_exempt
+def room_participation(request, code):
+    if request.method != "GET":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    room = lookup_room(code)
+    if room is None:
         return JsonResponse({"detail": "Room not found"}, status=404)
 
+    counts = run_post_counts(room)
     members = room.members.all().order_by("first_name", "username")
-    data = [{"id": u.id, "name": (u.first_name or u.username)} for u in members]
-    return JsonResponse(data, safe=False)
+
+    data = []
+    for u in members:
+        per_phase = counts.get(u.id, {})
+        data.append({
+            "id": u.id,
+            "name": u.first_name or u.username,
+            "total_posts": sum(per_phase.values()),
+            "posts_by_phase": {str(phase): n for phase, n in per_phase.items()},
+        })
+
+    return JsonResponse({
+        "room": room.code,
+        "activity_run_id": str(room.activity_run_id) if room.activity_run_id else None,
+        "members": data,
+    })
 
 
 @csrf_exempt
-def room_detail(request, code):
+def export_runs(request):
+    if request.method != "GET":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    if not _is_facilitator(request.user):
+        return JsonResponse({"detail": "Facilitator role required"}, status=403)
+
+    fmt = (request.GET.get("format") or "jsonl").strip().lower()
+    kinds_param = request.GET.get("kinds")
+    kinds = [k.strip() for k in kinds_param.split(",") if k.strip()] if kinds_param else list(EXPORT_KINDS)
+
+    try:
+        filters = parse_export_filters(
+            room=request.GET.get("room"),
+            run=request.GET.get("run"),
+            since=request.GET.get("since"),
+            until=request.GET.get("until"),
+        )
+        filters.update(_room_scope(request.user))
+        chunks = stream_export(filters, fmt=fmt, kinds=kinds)
+    except ExportError as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="activity-runs.{fmt}"'
+    return response
+
+
+@csrf_exempt
+def analytics_runs(request):
+    if request.method != "GET":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    if not _is_facilitator(request.user):
+        return JsonResponse({"detail": "Facilitator role required"}, status=403)
+
+    try:
+        filters = parse_export_filters(
+            room=request.GET.get("room"),
+            run=request.GET.get("run"),
+            since=request.GET.get("since"),
+            until=request.GET.get("until"),
+        )
+    except ExportError as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+    filters.update(_room_scope(request.user))
+
+    frame = SnapshotFrame.load(across_shards(RunSnapshot.objects.filter(**filters).select_related("room")))
+
+    return JsonResponse({
+        "rows": len(frame),
+        "participation_balance": frame.participation_balance(),
+        "evidence_flag_rate_by_phase": frame.evidence_flag_rate_by_phase(),
+        "nudge_effectiveness": frame.nudge_effectiveness(),
+    })
+
+
+@csrf_exempt
+def rooms_overview(request):
+    if request.method != "GET":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    if not _is_facilitator(request.user):
+        return JsonResponse({"detail": "Facilitator role required"}, status=403)
+
+    limited = rate_limit(request, "rooms_overview")
+    if limited:
+        return limited
+
+    return JsonResponse(cached_overview(request.user))
+
+
+@csrf_exempt
+def search_messages(request):
     if request.method != "GET":
         return JsonResponse({"detail": "Method not allowed"}, status=405)
 
     if not request.user.is_authenticated:
         return JsonResponse({"detail": "Authentication required"}, status=401)
 
-    code = (code or "").strip().upper()
+    if not _is_facilitator(request.user):
+        return JsonResponse({"detail": "Facilitator role required"}, status=403)
+
+    room_ids = _visible_room_ids(request.user)
+    room_id = None
+    room_code = (request.GET.get("room") or "").strip()
+    if room_code:
+        room = lookup_room(room_code)
+        if room is None or (room_ids is not None and room.id not in room_ids):
+            return JsonResponse({"detail": "Room not found"}, status=404)
+        room_id = room.id
 
     try:
-        room = Room.objects.get(code=code)
-    except Room.DoesNotExist:
+        run = request.GET.get("run") or None
+        result = search_posts(
+            request.GET.get("q"),
+            room_id=room_id,
+            activity_run_id=uuid.UUID(run) if run else None,
+            phase_index=int(request.GET["phase"]) if request.GET.get("phase") else None,
+            author_id=int(request.GET["author"]) if request.GET.get("author") else None,
+            page=int(request.GET.get("page") or 1),
+            page_size=int(request.GET.get("page_size") or SEARCH_PAGE_SIZE),
+            room_ids=room_ids,
+        )
+    except ValueError:
+        return JsonResponse({"detail": "run must be a UUID; phase, author, page and page_size integers"}, status=400)
+    except SearchError as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+
+    return JsonResponse(result)
+
+
+@csrf_exempt
+def rate_limit_stats(request):
+    if request.method != "GET":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    if not _is_facilitator(request.user):
+        return JsonResponse({"detail": "Facilitator role required"}, status=403)
+
+    # Counters are per process
+    return JsonResponse(rejection_stats())
+
+
+@csrf_exempt
+def ready(request):
+    if request.method != "GET":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    status = warmup_status()
+    if status["status"] == "ready":
+        return JsonResponse(status)
+    # Normally already started by the WSGI/ASGI entry point; this covers other servers and retries
+    start_warmup()
+    return JsonResponse({"detail": "Warming up", **warmup_status()}, status=503)
+
+
+@csrf_exempt
+def room_detail(request, code):
+    if request.method != "GET":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication required"}, status=401)
+
+    room = lookup_room(code, Room.objects.select_related("selected_activity"))
+    if room is None:
         return JsonResponse({"detail": "Room not found"}, status=404)
 
     state = get_activity_state(room)
@@ -261,11 +680,8 @@ def start_activity(request, code):
     if not request.user.is_authenticated:
         return JsonResponse({"detail": "Authentication required"}, status=401)
 
-    code = (code or "").strip().upper()
-
-    try:
-        room = Room.objects.get(code=code)
-    except Room.DoesNotExist:
+    room = lookup_room(code, Room.objects.select_related("selected_activity"))
+    if room is None:
         return JsonResponse({"detail": "Room not found"}, status=404)
 
     if not room.selected_activity:
@@ -275,7 +691,8 @@ def start_activity(request, code):
     room.activity_is_running = True
     room.activity_started_at = timezone.now()
     room.activity_run_id = uuid.uuid4()
-    room.save(update_fields=["activity_is_running", "activity_started_at"])
+    room.current_phase_index = None
+    room.save(update_fields=["activity_is_running", "activity_started_at", "activity_run_id", "current_phase_index"])
 
     return JsonResponse({
         "detail": "Activity started",
@@ -292,17 +709,16 @@ def select_activity(request, code):
     if not request.user.is_authenticated:
         return JsonResponse({"detail": "Authentication required"}, status=401)
 
-    code = (code or "").strip().upper()
-
-    try:
-        room = Room.objects.get(code=code)
-    except Room.DoesNotExist:
+    room = lookup_room(code, Room.objects.select_related("selected_activity"))
+    if room is None:
         return JsonResponse({"detail": "Room not found"}, status=404)
 
     try:
         payload = json.loads(request.body or "{}")
     except json.JSONDecodeError:
         return JsonResponse({"detail": "Invalid JSON"}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"detail": "Expected a JSON object"}, status=400)
 
     activity_id = payload.get("activity_id")
     if not activity_id:
@@ -316,56 +732,11 @@ def select_activity(request, code):
     room.selected_activity = activity
     room.activity_is_running = False
     room.activity_started_at = None
-    room.save(update_fields=["selected_activity", "activity_is_running", "activity_started_at"])
+    room.current_phase_index = None
+    room.save(update_fields=["selected_activity", "activity_is_running", "activity_started_at", "current_phase_index"])
 
     return JsonResponse({
         "detail": "Activity selected",
         "activity_id": activity.id,
         "activity_name": activity.name,
     }, status=200)
-
-def get_activity_state(room):
-    if not getattr(room, "selected_activity", None) or not getattr(room, "activity_is_running", False) or not getattr(room, "activity_started_at", None):
-        return {
-            "is_running": False,
-            "finished": False,
-            "activity_id": room.selected_activity.id if getattr(room, "selected_activity", None) else None,
-            "activity_name": room.selected_activity.name if getattr(room, "selected_activity", None) else None,
-        }
-
-    activity = room.selected_activity
-    phases = activity.phases or []
-    now = timezone.now()
-    elapsed = (now - room.activity_started_at).total_seconds()
-
-    t = 0
-    for idx, ph in enumerate(phases):
-        mins = ph.get("time_limit_minutes") or 0
-        duration = mins * 60
-        if elapsed < t + duration:
-            phase_ends_at = room.activity_started_at + timezone.timedelta(seconds=(t + duration))
-            return {
-                "is_running": True,
-                "finished": False,
-                "activity_id": activity.id,
-                "activity_name": activity.name,
-                "phase_index": idx,
-                "phase_name": ph.get("name"),
-                "phase_prompt": ph.get("prompt"),
-                "phase_ends_at": phase_ends_at.isoformat(),
-                "total_phases": len(phases),
-            }
-        t += duration
-
-    return {
-        "is_running": True,
-        "finished": True,
-        "activity_id": activity.id,
-        "activity_name": activity.name,
-        "phase_index": len(phases) - 1 if phases else 0,
-        "phase_name": phases[-1].get("name") if phases else None,
-        "phase_prompt": phases[-1].get("prompt") if phases else None,
-        "phase_ends_at": None,
-        "total_phases": len(phases),
-    }
-
@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+
+from core.backends import remember_users
+from .agent_rules import prime_agents
+from .evidence import get_scorer, scorer_enabled
+from .fragments import FRAGMENT_CACHE_SIZE, intervention_fragment, post_fragment
+from .models import Intervention, Post, Room, RoomMember
+from .phases import activity_schedule
+from .sharding import each_shard, remember_shard
+
+logger = logging.getLogger(__name__)
+
+WARMUP_MAX_ROOMS = 1000
+# Half the fragment cache each for posts and interventions, newest first
+WARMUP_MAX_FRAGMENTS = FRAGMENT_CACHE_SIZE // 2
+
+_lock = threading.Lock()
+# Per process: a worker forked from a primed master starts over (its copy has no priming thread)
+_state = {"status": "idle", "pid": None}
+
+
+def prime() -> dict:
+    # Loads what the first poll of every running room would otherwise pay for; returns counts
+    primed = {}
+
+    # URLconf, and through it the views and everything they import
+    get_resolver().url_patterns
+
+    primed["agents"] = prime_agents()
+    primed.update(rooms=0, schedules=0, users=0, fragments=0)
+    activities = set()
+    for alias in each_shard():
+        rooms = list(
+            Room.objects.filter(activity_is_running=True)
+            .select_related("selected_activity")
+            .order_by("-activity_started_at")[:WARMUP_MAX_ROOMS]
+        )
+        for room in rooms:
+            remember_shard(room.code, alias)
+            if room.selected_activity:
+                activity_schedule(room.selected_activity)
+                activities.add(room.selected_activity_id)
+        primed["rooms"] += len(rooms)
+
+        members = RoomMember.objects.filter(room__in=[room.pk for room in rooms]).select_related("user")
+        primed["users"] += remember_users({m.user for m in members})
+
+        runs = [room.activity_run_id for room in rooms if room.activity_run_id]
+        posts = Post.objects.filter(activity_run_id__in=runs).select_related("author").order_by("-id")
+        interventions = Intervention.objects.filter(activity_run_id__in=runs).select_related("agent").order_by("-id")
+        for post in posts[:WARMUP_MAX_FRAGMENTS]:
+            post_fragment(post)
+            primed["fragments"] += 1
+        for intervention in interventions[:WARMUP_MAX_FRAGMENTS]:
+            intervention_fragment(intervention)
+            primed["fragments"] += 1
+    primed["schedules"] = len(activities)
+
+    if scorer_enabled():
+        get_scorer()
+    return primed
+
+
+def _run():
+    started = time.perf_counter()
+    try:
+        primed = prime()
+    except Exception as e:
+        logger.exception("Warm-up failed")
+        with _lock:
+            _state.update(status="failed", error=str(e))
+        return
+    finally:
+        # The thread's connections would otherwise stay open for the life of the worker
+        connections.close_all()
+
+    seconds = round(time.perf_counter() - started, 3)
+    logger.info("Warm-up done in %.2fs: %s", seconds, primed)
+    with _lock:
+        _state.update(status="ready", primed=primed, seconds=seconds, error=None)
+
+
+def start_warmup():
+    # Primes the caches in a background thread, so the worker can take requests meanwhile.
+    # A no-op while priming or once ready; retries after a failure.
+    with _lock:
+        if _state["pid"] != os.getpid():
+            _state.clear()
+            _state.update(status="idle", pid=os.getpid())
+        if not getattr(settings, "WARM_START", True):
+            _state["status"] = "ready"
+            return
+        if _state["status"] not in ("idle", "failed"):
+            return
+        _state["status"] = "priming"
+    threading.Thread(target=_run, name="warmup", daemon=True).start()
+
+
+def warmup_status() -> dict:
+    with _lock:
+        if _state["pid"] != os.getpid():
+            return {"status": "idle"}
+        return {k: v for k, v in _state.items() if k != "pid"}
@@ -0,0 +1,146 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+
+from .sharding import use_shard
+
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_MAX_BATCH = 64
+# How long the first insert of a batch waits for company
+WRITE_BUFFER_MAX_WAIT = 0.005
+# A caller gives up on its insert after this long, if the row hasn't been picked up by then
+WRITE_BUFFER_TIMEOUT = 10.0
+# Retry-After for callers that gave up
+WRITE_BUFFER_RETRY_AFTER = 5
+
+
+class WriteBufferTimeout(Exception):
+    # The insert was withdrawn from the queue before it was written; nothing was saved
+    pass
+
+
+class WriteBuffer:
+    # Group commit: inserts submitted from request threads within a few ms of each other are
+    # written by one background thread in a single transaction. Each caller's future resolves
+    # only after that transaction has committed, with the saved object (pk set) or its error.
+
+    def __init__(self, max_batch=WRITE_BUFFER_MAX_BATCH, max_wait=WRITE_BUFFER_MAX_WAIT):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = Counter()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, obj, on_saved=None) -> Future:
+        future = Future()
+        self._ensure_started()
+        self._queue.put((obj, future, on_saved))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            close_old_connections()
+            try:
+                self._commit(batch)
+            except Exception:
+                logger.exception("Write buffer failed on a batch of %d", len(batch))
+
+    def _commit(self, batch):
+        # Rows whose caller gave up are dropped; the rest can't be withdrawn from here on
+        pending = [row for row in batch if row[1].set_running_or_notify_cancel()]
+        self.stats["cancelled"] += len(batch) - len(pending)
+        batch = pending
+
+        # One transaction per database the rows go to (rooms can live on different shards)
+        by_db = {}
+        for row in batch:
+            by_db.setdefault(router.db_for_write(type(row[0]), instance=row[0]), []).append(row)
+        for using, rows in by_db.items():
+            # on_saved's queries go to the same database
+            with use_shard(using):
+                self._commit_rows(using, rows)
+
+    def _commit_rows(self, using, batch):
+        outcomes = []
+        try:
+            with transaction.atomic(using=using):
+                for obj, future, on_saved in batch:
+                    # A savepoint per row: one bad row (e.g. a duplicate client_id) fails alone
+                    try:
+                        with transaction.atomic(using=using):
+                            obj.save(force_insert=True, using=using)
+                            if on_saved is not None:
+                                on_saved(obj)
+                    except Exception as e:
+                        obj.pk = None
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, obj, None))
+        except Exception as e:
+            # The commit itself failed: nothing in the batch was written
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["rows"] += len(batch)
+        for future, obj, error in outcomes:
+            if error is None:
+                future.set_result(obj)
+            else:
+                future.set_exception(error)
+
+
+write_buffer = WriteBuffer()
+
+
+def insert(obj, on_saved=None):
+    # Saves a new row, through the write buffer when settings.WRITE_BUFFER is on. Inside a
+    # transaction of the caller's own the row has to be part of it, so that always writes directly.
+    # on_saved(obj) runs in the row's transaction: its writes are committed with the row or not at all.
+    # Raises whatever the save raised (IntegrityError on a duplicate, ...), only after rollback,
+    # and WriteBufferTimeout if the row was still queued after WRITE_BUFFER_TIMEOUT.
+    using = router.db_for_write(type(obj), instance=obj)
+    if not getattr(settings, "WRITE_BUFFER", False) or connections[using].in_atomic_block:
+        with transaction.atomic(using=using):
+            obj.save(force_insert=True, using=using)
+            if on_saved is not None:
+                on_saved(obj)
+        return obj
+    future = write_buffer.submit(obj, on_saved)
+    try:
+        return future.result(timeout=WRITE_BUFFER_TIMEOUT)
+    except FutureTimeoutError:
+        if future.cancel():
+            raise WriteBufferTimeout(f"{type(obj).__name__} not written within {WRITE_BUFFER_TIMEOUT}s")
+        # Already in a transaction: it commits or fails, and the caller has to know which
+        return future.result()
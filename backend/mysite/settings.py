@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 import os
+import sys
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -60,8 +62,36 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'message_board.sharding.ShardMiddleware',
 ]
 
+# Sessions: "db" (Django's default), "cached_db" (reads served from the cache) or
+# "signed_cookies" (no session table at all; the session lives in the cookie)
+SESSION_ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}
+SESSION_ENGINE = SESSION_ENGINES[os.getenv("SESSION_BACKEND", "db")]
+
+# A cache shared by all workers. Without one, each process has its own LocMem cache and guest
+# users are not cached (see core.backends.cache_is_shared)
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+
+# Guest (temp_login) users are loaded from the cache instead of auth_user on every request
+AUTHENTICATION_BACKENDS = [
+    "core.backends.CachedModelBackend",
+    # Keeps sessions created before the cached backend was introduced valid
+    "django.contrib.auth.backends.ModelBackend",
+]
+GUEST_USER_CACHE_TTL = 300
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
@@ -85,13 +115,49 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# SQLite writers take the write lock when their transaction begins. A deferred transaction
+# that reads first and then writes fails at once with "database is locked" when another
+# writer got in between, instead of waiting out the timeout.
+SQLITE_OPTIONS = {'transaction_mode': 'IMMEDIATE', 'timeout': 20}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
+        # A file rather than the in-memory default, so tests that run several threads share it;
+        # in the temp directory, out of the source tree
+        'TEST': {'NAME': Path(tempfile.gettempdir()) / 'message-board-test.sqlite3'},
     }
 }
 
+# Room sharding (off unless set): rooms and everything in them are spread over these databases
+# by room code, e.g. ROOM_SHARDS=default,shard1,shard2. Shards missing from DATABASES get a SQLite
+# file next to db.sqlite3. Only ever append to the list. See message_board/sharding.py.
+# Setting up: `migrate` (the default database) first, then `migrate --database=<alias>` for each
+# shard, which copies users, activities and agents over and moves the shard to its id range.
+# `shards sync` and `shards directory` repair drift later on.
+ROOM_SHARDS = [alias.strip() for alias in os.getenv("ROOM_SHARDS", "").split(",") if alias.strip()]
+for alias in ROOM_SHARDS:
+    DATABASES.setdefault(alias, {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db-{alias}.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
+    })
+# Shard that room queries outside a request go to; run one scheduler/rule worker per shard
+ROOM_SHARD = os.getenv("ROOM_SHARD") or None
+DATABASE_ROUTERS = ['message_board.sharding.RoomShardRouter'] if ROOM_SHARDS else []
+# The sharding tests spread rooms over these. Without the router (which the tests install for
+# themselves), nothing else touches them.
+if sys.argv[1:2] == ['test']:
+    for alias in ('shard1', 'shard2'):
+        DATABASES.setdefault(alias, {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': Path(tempfile.gettempdir()) / f'message-board-{alias}.sqlite3',
+            'OPTIONS': SQLITE_OPTIONS,
+            'TEST': {'NAME': Path(tempfile.gettempdir()) / f'message-board-test-{alias}.sqlite3'},
+        })
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -144,6 +210,31 @@ if csrf_trusted_origins_env:
         if origin.strip()
     ]
 
+# Rate limiting: "local" keeps token buckets per process, "cache" shares them through the
+# default cache (only useful with a shared cache such as Redis or Memcached)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+# Per-endpoint overrides of message_board.ratelimit.DEFAULT_RATE_LIMITS, e.g.
+# RATE_LIMITS = {"messages_post": (1.0, 20), "messages_get": None}
+RATE_LIMITS = {}
+
+# "inline" evaluates the agent rules inside the web request; "workers" leaves them to the
+# run_rule_workers command, which shards rooms across a process pool
+AGENT_RULES_MODE = os.getenv("AGENT_RULES_MODE", "inline")
+
+# Group commit for single Post/Intervention inserts: rows arriving within a few ms share one
+# transaction (each request still waits for the commit). Mostly helps SQLite under bursts.
+WRITE_BUFFER = os.getenv("WRITE_BUFFER", "False") == "True"
+
+# "heuristic" flags unsupported claims with message_board.agent_rules.message_lacks_evidence;
+# "numpy" uses the batch scorer in message_board.evidence (needs numpy), with its weights read
+# from EVIDENCE_WEIGHTS_FILE (default: message_board/evidence_weights.json)
+EVIDENCE_SCORER = os.getenv("EVIDENCE_SCORER", "heuristic")
+EVIDENCE_WEIGHTS_FILE = os.getenv("EVIDENCE_WEIGHTS_FILE") or None
+
+# Each web worker primes its caches (running rooms, schedules, agents, guest users, timeline
+# fragments) on boot; /api/ready/ reports healthy once that is done
+WARM_START = os.getenv("WARM_START", "True") == "True"
+
 # Auth redirects
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+# Prime the process caches in the background; /api/ready/ answers 503 until that's done
+from message_board.warmup import start_warmup  # noqa: E402
+
+start_warmup()